@@ -1,18 +1,817 @@
+import asyncio
+import gc
+import gzip
+import hashlib
+import heapq
+import hmac
+import json
+import math
+import mmap
+import os
 import re
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
 import uuid
-
-import uvicorn
+import weakref
+import zlib
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import astuple, dataclass, field
+from functools import partial
+from itertools import combinations, islice
+from pathlib import Path
+
+import brotli
 from dotenv import load_dotenv
-from fastapi import FastAPI
-from fastapi.responses import FileResponse
-from litellm import completion
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.requests import HTTPConnection
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
 
 load_dotenv()
 
 # --- Config ---
 
 MODEL = "vertex_ai/gemini-2.5-flash"
+BASE_DIR = Path(__file__).resolve().parent
+
+# Inputs longer than CHUNK_TOKEN_BUDGET are split on citation/reference
+# boundaries and reviewed chunk by chunk so no single prompt grows unbounded.
+MAX_MESSAGE_CHARS = 200_000
+CHARS_PER_TOKEN = 4
+CHUNK_TOKEN_BUDGET = 1500
+CHUNK_OVERLAP_UNITS = 1
+CHUNK_MAX_WORKERS = 8
+TRIAGE_MAX_CHARS = CHUNK_TOKEN_BUDGET * CHARS_PER_TOKEN
+TRIAGE_SAMPLE_CHUNKS = 4
+
+# litellm (and the Google auth stack it pulls in for Vertex) takes seconds to
+# import, so it is loaded on the first model call instead of at startup.
+# Set WARM_UP=1 to load it in the background as soon as the server starts.
+WARM_UP = os.environ.get("WARM_UP") == "1"
+
+# Standalone reviews send only the rules and few-shot examples relevant to the
+# kinds of citation found in the input. Set PRUNE_PROMPTS=0 to always send the
+# full prompt (e.g. to compare eval scores).
+PRUNE_PROMPTS = os.environ.get("PRUNE_PROMPTS", "1") != "0"
+
+
+# --- Model Client ---
+
+
+def completion(**kwargs):
+    """Call litellm.completion, importing litellm on first use."""
+    from litellm import completion as litellm_completion
+
+    return litellm_completion(**kwargs)
+
+
+def warm_up() -> None:
+    """Import the model clients ahead of the first request."""
+    import litellm  # noqa: F401
+
+    try:
+        import google.auth  # noqa: F401
+    except ImportError:
+        pass
+
+
+# --- Usage Accounting ---
+
+# Token counts from every model call are attributed to the labels in scope
+# (session, style, stage, conversation turn), aggregated in memory for
+# /stats, and appended to USAGE_LOG_PATH as JSON lines every
+# USAGE_FLUSH_INTERVAL_S. `python app.py usage-report` summarizes the log.
+
+USAGE_LOG_PATH = Path(os.environ.get("USAGE_LOG_PATH", BASE_DIR / ".cache" / "usage.jsonl"))
+USAGE_FLUSH_INTERVAL_S = 30.0
+USAGE_DIMENSIONS = ("style", "stage", "turn")
+# Per-session totals are kept for the most recently active sessions only;
+# the log has every session's usage for the report.
+USAGE_MAX_SESSIONS = 10_000
+
+# USD per million tokens (input, output).
+MODEL_PRICES = {
+    "vertex_ai/gemini-2.5-flash": (0.30, 2.50),
+}
+
+_usage_labels: ContextVar[dict] = ContextVar("usage_labels", default={})
+
+
+@contextmanager
+def usage_labels(**labels):
+    """Attribute model calls made inside the block to labels."""
+    token = _usage_labels.set({**_usage_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _usage_labels.reset(token)
+
+
+def submit_with_labels(pool: ThreadPoolExecutor, fn: Callable, *args):
+    """pool.submit that carries the caller's usage labels into the worker thread."""
+    return pool.submit(copy_context().run, fn, *args)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def turn_bucket(turn: int | None) -> str:
+    if turn is None:
+        return "n/a"
+    for limit, label in ((1, "1"), (2, "2"), (5, "3-5"), (10, "6-10")):
+        if turn <= limit:
+            return label
+    return "11+"
+
+
+class UsageLedger:
+    """In-memory token and cost totals with an append-only log on disk."""
+
+    def __init__(self, path: Path = USAGE_LOG_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._pending: list[dict] = []
+        self._totals: dict[str, dict[str, dict[str, float]]] = {}
+        self._sessions: OrderedDict[str, dict[str, float]] = OrderedDict()
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int, **labels) -> None:
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        entry = {
+            "ts": time.time(),
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost": cost,
+            **labels,
+        }
+        with self._lock:
+            self._pending.append(entry)
+            keys = [(dim, str(labels.get(dim, "n/a"))) for dim in USAGE_DIMENSIONS]
+            for dim, value in keys:
+                _add_usage(self._totals.setdefault(dim, {}).setdefault(value, {}), entry)
+            session = labels.get("session")
+            if session:
+                _add_usage(self._sessions.setdefault(session, {}), entry)
+                self._sessions.move_to_end(session)
+                if len(self._sessions) > USAGE_MAX_SESSIONS:
+                    self._sessions.popitem(last=False)
+
+    def session_usage(self, session_id: str) -> dict[str, float]:
+        with self._lock:
+            return dict(self._sessions.get(session_id, {}))
+
+    def forget_session(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                dim: {value: dict(totals) for value, totals in values.items()}
+                for dim, values in self._totals.items()
+            }
+
+    def flush(self) -> int:
+        """Append pending records to the log; returns how many were written."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in pending)
+        return len(pending)
+
+
+def _add_usage(totals: dict[str, float], entry: dict) -> None:
+    totals["calls"] = totals.get("calls", 0) + 1
+    for field in ("prompt_tokens", "completion_tokens", "cost"):
+        totals[field] = totals.get(field, 0) + entry[field]
+
+
+usage_ledger = UsageLedger()
+
+
+def record_usage(response, stage: str | None = None) -> None:
+    """Record the token usage of a completion response under the current labels."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    labels = dict(_usage_labels.get())
+    if stage is not None:
+        labels["stage"] = stage
+    labels.setdefault("stage", "review")
+    labels["turn_bucket"] = turn_bucket(labels.get("turn"))
+    usage_ledger.record(
+        MODEL,
+        getattr(usage, "prompt_tokens", 0) or 0,
+        getattr(usage, "completion_tokens", 0) or 0,
+        **labels,
+    )
+
+
+def _flush_usage_periodically(stop: threading.Event) -> None:
+    while not stop.wait(USAGE_FLUSH_INTERVAL_S):
+        usage_ledger.flush()
+    usage_ledger.flush()
+
+
+def usage_report(path: Path = USAGE_LOG_PATH) -> str:
+    """Summarize the usage log by style, stage, conversation length and session."""
+    groups: dict[str, dict[str, dict[str, float]]] = {
+        "style": {}, "stage": {}, "turns": {}, "session": {}
+    }
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                for group, value in (
+                    ("style", entry.get("style")),
+                    ("stage", entry.get("stage")),
+                    ("turns", entry.get("turn_bucket")),
+                    ("session", entry.get("session")),
+                ):
+                    _add_usage(groups[group].setdefault(value or "n/a", {}), entry)
+    except FileNotFoundError:
+        return f"No usage logged yet ({path})."
+    lines = []
+    for group, values in groups.items():
+        ranked = sorted(values.items(), key=lambda item: item[1]["cost"], reverse=True)
+        if group == "session":
+            ranked = ranked[:10]
+        lines.append(f"\nBy {group}:")
+        lines.append(f"  {'':<38}{'calls':>7}{'prompt':>11}{'completion':>12}{'cost $':>11}")
+        for value, totals in ranked:
+            lines.append(
+                f"  {value[:38]:<38}{totals['calls']:>7.0f}{totals['prompt_tokens']:>11.0f}"
+                f"{totals['completion_tokens']:>12.0f}{totals['cost']:>11.4f}"
+            )
+    return "\n".join(lines).lstrip("\n")
+
+
+# --- Profiling ---
+
+# Opt-in, for telling Python overhead, serialization, lock waits and model
+# time apart when latency spikes. With SLOW_REQUEST_MS set, every request to
+# PROFILED_PATHS is traced: profile_span records stage timings, and while a
+# request runs past the threshold the threads inside its spans are sampled.
+# Requests that end up slower than the threshold are saved. POST
+# /debug/profile?seconds=N samples every thread for N seconds. Profiles are
+# JSON files in PROFILE_DIR, shared by all workers; GET /debug/profiles and
+# `python app.py profiles [ID]` dump them. The endpoints exist only with
+# PROFILING_TOKEN set, for callers that send it as X-Profiling-Token. When
+# nothing is traced, a span costs one ContextVar lookup.
+
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+PROFILED_PATHS = ("/chat", "/compare", "/jobs")
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", BASE_DIR / ".cache" / "profiles"))
+PROFILE_KEEP = 100
+PROFILE_SAMPLE_INTERVAL_S = 0.005
+PROFILE_MAX_SECONDS = 300.0
+PROFILE_STACK_DEPTH = 64
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN", "")
+PROFILE_ID_PATTERN = re.compile(r"[\w-]+")
+
+
+class RequestTrace:
+    """Stage timings and stack samples for one request."""
+
+    __slots__ = ("path", "started", "start", "response_start", "spans", "threads", "stacks")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.response_start: float | None = None
+        self.spans: list[tuple[str, float, float]] = []
+        self.threads: dict[int, int] = {}
+        self.stacks: dict[str, int] = {}
+
+    def to_profile(self, elapsed: float, status: int | None) -> dict:
+        return {
+            "kind": "slow_request",
+            "path": self.path,
+            "status": status,
+            "started": self.started,
+            "duration_ms": round(elapsed * 1000, 3),
+            "response_start_ms": (
+                None if self.response_start is None else round(self.response_start * 1000, 3)
+            ),
+            "spans": [
+                {"name": name, "start_ms": round(start * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+                for name, start, duration in sorted(self.spans, key=lambda span: span[1])
+            ],
+            "samples": sum(self.stacks.values()),
+            "stacks": self.stacks,
+        }
+
+
+_request_trace: ContextVar[RequestTrace | None] = ContextVar("request_trace", default=None)
+_traces_in_flight: set[RequestTrace] = set()
+_sampler_lock = threading.Lock()
+_slow_request_sampler: threading.Thread | None = None
+
+
+@contextmanager
+def profile_span(name: str):
+    """Time the block as a stage of the request being traced, if any."""
+    trace = _request_trace.get()
+    if trace is None:
+        yield
+        return
+    ident = threading.get_ident()
+    trace.threads[ident] = trace.threads.get(ident, 0) + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        trace.spans.append((name, start - trace.start, end - start))
+        if trace.threads[ident] == 1:
+            del trace.threads[ident]
+        else:
+            trace.threads[ident] -= 1
+
+
+def _fold_stack(frame) -> str:
+    """A frame's call stack, root first, in the folded format flame graph tools read."""
+    names = []
+    while frame is not None and len(names) < PROFILE_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _sample_slow_requests() -> None:
+    while True:
+        time.sleep(PROFILE_SAMPLE_INTERVAL_S)
+        threshold = time.perf_counter() - SLOW_REQUEST_MS / 1000
+        slow = [trace for trace in list(_traces_in_flight) if trace.start < threshold]
+        if not slow:
+            continue
+        frames = sys._current_frames()
+        for trace in slow:
+            for ident in list(trace.threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = _fold_stack(frame)
+                    trace.stacks[stack] = trace.stacks.get(stack, 0) + 1
+        del frames
+
+
+def _start_slow_request_sampler() -> None:
+    global _slow_request_sampler
+    if _slow_request_sampler is not None:
+        return
+    with _sampler_lock:
+        if _slow_request_sampler is None:
+            _slow_request_sampler = threading.Thread(
+                target=_sample_slow_requests, name="profile-slow-requests", daemon=True
+            )
+            _slow_request_sampler.start()
+
+
+class SlowRequestMiddleware:
+    """Trace requests to PROFILED_PATHS and save those slower than SLOW_REQUEST_MS."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if SLOW_REQUEST_MS <= 0 or scope["type"] != "http" or not scope["path"].startswith(PROFILED_PATHS):
+            await self.app(scope, receive, send)
+            return
+        _start_slow_request_sampler()
+        trace = RequestTrace(f"{scope['method']} {scope['path']}")
+        status = None
+
+        async def traced_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                trace.response_start = time.perf_counter() - trace.start
+            await send(message)
+
+        token = _request_trace.set(trace)
+        _traces_in_flight.add(trace)
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            _traces_in_flight.discard(trace)
+            _request_trace.reset(token)
+            elapsed = time.perf_counter() - trace.start
+            if elapsed * 1000 >= SLOW_REQUEST_MS:
+                save_profile(trace.to_profile(elapsed, status))
+
+
+class SamplingProfiler:
+    """Samples the stack of every thread at an interval for a fixed time, then saves a profile."""
+
+    def __init__(self, interval_s: float = PROFILE_SAMPLE_INTERVAL_S):
+        self.interval_s = interval_s
+        self.last_profile_id: str | None = None
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float) -> bool:
+        """Start sampling for seconds; False if a run is already in progress."""
+        with self._lock:
+            if self.running:
+                return False
+            self._thread = threading.Thread(
+                target=self._run, args=(seconds,), name="profile-sampling", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def join(self, timeout: float | None = None) -> None:
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, seconds: float) -> None:
+        started = time.time()
+        until = time.monotonic() + seconds
+        stacks: dict[str, int] = {}
+        samples = 0
+        while time.monotonic() < until:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if name.startswith("profile-"):
+                    continue
+                stack = f"{name};{_fold_stack(frame)}"
+                stacks[stack] = stacks.get(stack, 0) + 1
+            samples += 1
+            time.sleep(self.interval_s)
+        self.last_profile_id = save_profile(
+            {
+                "kind": "sampling",
+                "path": None,
+                "started": started,
+                "duration_ms": round(seconds * 1000, 3),
+                "interval_ms": self.interval_s * 1000,
+                "samples": samples,
+                "stacks": stacks,
+            }
+        )
+
+
+sampling_profiler = SamplingProfiler()
+
+
+def save_profile(profile: dict) -> str:
+    """Write a profile to PROFILE_DIR, keeping the newest PROFILE_KEEP; returns its id."""
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(profile["started"]))
+    profile_id = f"{stamp}-{profile['kind']}-{uuid.uuid4().hex[:6]}"
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        (PROFILE_DIR / f"{profile_id}.json").write_text(
+            json.dumps({"id": profile_id, **profile}), encoding="utf-8"
+        )
+        for old in sorted(PROFILE_DIR.glob("*.json"))[:-PROFILE_KEEP]:
+            old.unlink(missing_ok=True)
+    except OSError as e:
+        print(f"Profile not saved: {e}", file=sys.stderr)
+    return profile_id
+
+
+def load_profile(profile_id: str) -> dict | None:
+    if not PROFILE_ID_PATTERN.fullmatch(profile_id):
+        return None
+    try:
+        return json.loads((PROFILE_DIR / f"{profile_id}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def list_profiles() -> list[dict]:
+    """Saved profiles, newest first, without their stacks."""
+    summaries = []
+    for path in sorted(PROFILE_DIR.glob("*.json"), reverse=True):
+        profile = load_profile(path.stem)
+        if profile is not None:
+            profile.pop("stacks", None)
+            profile.pop("spans", None)
+            summaries.append(profile)
+    return summaries
+
+
+def folded_stacks(profile: dict) -> str:
+    """The profile's stacks as `frame;frame;frame count` lines."""
+    return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].items())
+
+
+def profile_report(profile: dict, top: int = 15) -> str:
+    """A readable breakdown: stage timings, then the most sampled stacks."""
+    lines = [
+        f"{profile['id']}  {profile['path'] or profile['kind']}  "
+        f"{profile['duration_ms']:.1f} ms  {profile['samples']} samples"
+    ]
+    if profile.get("spans"):
+        lines.append("\nStages (start ms, duration ms):")
+        for span in profile["spans"]:
+            lines.append(f"  {span['name']:<24}{span['start_ms']:>10.1f}{span['duration_ms']:>10.1f}")
+        handler = next((s for s in profile["spans"] if s["name"] == "handler"), None)
+        if handler is not None and profile.get("response_start_ms") is not None:
+            after = profile["response_start_ms"] - handler["start_ms"] - handler["duration_ms"]
+            lines.append(f"  {'before handler':<24}{0:>10.1f}{handler['start_ms']:>10.1f}")
+            end = handler["start_ms"] + handler["duration_ms"]
+            lines.append(f"  {'serialization':<24}{end:>10.1f}{after:>10.1f}")
+    total = sum(profile["stacks"].values())
+    if total:
+        lines.append("\nTop stacks (innermost frames last):")
+        ranked = sorted(profile["stacks"].items(), key=lambda item: item[1], reverse=True)
+        for stack, count in ranked[:top]:
+            frames = stack.split(";")
+            lines.append(f"  {count:>6} {count / total:>6.1%}  {' > '.join(frames[-4:])}")
+    return "\n".join(lines)
+
+
+# --- Caches ---
+
+# Bounded in-process LRU caches for triage verdicts, model responses and parsed
+# citations. Instances scale to zero, so the hottest entries of every cache are
+# periodically written to a snapshot file and read back at startup: the file
+# is memory-mapped and read hottest first until CACHE_RESTORE_BUDGET_S runs
+# out, so a large snapshot never holds up the first request. The snapshot only
+# outlives an instance when CACHE_SNAPSHOT_PATH is on a mounted volume; the
+# default under BASE_DIR is for local runs. With several worker processes,
+# caches marked shared also read and write a SharedCache that all workers see.
+
+CACHE_SNAPSHOT_PATH = Path(os.environ.get("CACHE_SNAPSHOT_PATH", BASE_DIR / ".cache" / "snapshot.jsonl"))
+CACHE_SNAPSHOT_INTERVAL_S = float(os.environ.get("CACHE_SNAPSHOT_INTERVAL_S", "300"))
+CACHE_SNAPSHOT_MAX_ENTRIES = int(os.environ.get("CACHE_SNAPSHOT_MAX_ENTRIES", "2000"))
+CACHE_RESTORE_BUDGET_S = float(os.environ.get("CACHE_RESTORE_BUDGET_S", "0.5"))
+SNAPSHOT_VERSION = 1
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH")
+SHARED_CACHE_MAX_ENTRIES = int(os.environ.get("SHARED_CACHE_MAX_ENTRIES", "20000"))
+
+
+def cache_key(*parts: str) -> str:
+    """Compact digest of the parts, used as a cache key."""
+    return hashlib.blake2b("\x00".join(parts).encode(), digest_size=16).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe LRU cache of str keys with hit/miss counters.
+
+    encode and decode convert values to and from JSON for snapshots.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int,
+        encode: Callable[[object], object] = lambda value: value,
+        decode: Callable[[object], object] = lambda value: value,
+        shared: bool = False,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.encode = encode
+        self.decode = decode
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._entries: OrderedDict[str, object] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.shared and shared_cache is not None:
+            stored = shared_cache.get(self.name, key)
+            if stored is not None:
+                value = self.decode(stored)
+                with self._lock:
+                    self._store(key, value)
+                    self.hits += 1
+                    self.shared_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def put(self, key: str, value) -> None:
+        with self._lock:
+            if self.max_entries <= 0:
+                return
+            self._store(key, value)
+            self.writes += 1
+        if self.shared and shared_cache is not None:
+            shared_cache.put(self.name, key, self.encode(value))
+
+    def _store(self, key: str, value) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def restore(self, key: str, value) -> None:
+        """Add a restored entry behind everything already cached, if there is room."""
+        with self._lock:
+            if key in self._entries or len(self._entries) >= self.max_entries:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key, last=False)
+
+    def hottest(self, limit: int) -> list[tuple[str, object]]:
+        """Up to limit entries, most recently used first."""
+        with self._lock:
+            return list(islice(reversed(self._entries.items()), limit))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = self.writes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SharedCache:
+    """Cache tier shared by worker processes: SQLite in WAL mode, bounded per cache name.
+
+    Values are stored as JSON. Errors (a locked or missing database) count as
+    misses, so the shared tier can only ever make a request faster.
+    """
+
+    TRIM_EVERY = 256
+
+    def __init__(self, path: Path, max_entries: int = SHARED_CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._puts = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries (cache TEXT NOT NULL, key TEXT NOT NULL, "
+                "value TEXT NOT NULL, stored_at REAL NOT NULL, PRIMARY KEY (cache, key))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=1.0)
+
+    def get(self, cache: str, key: str):
+        """The stored value, or None."""
+        try:
+            with self._connect() as db:
+                row = db.execute(
+                    "SELECT value FROM entries WHERE cache = ? AND key = ?", (cache, key)
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        return json.loads(row[0]) if row else None
+
+    def put(self, cache: str, key: str, value) -> None:
+        self._puts += 1
+        try:
+            with self._connect() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                    (cache, key, json.dumps(value, ensure_ascii=False), time.time()),
+                )
+                if self._puts % self.TRIM_EVERY == 0:
+                    db.execute(
+                        "DELETE FROM entries WHERE cache = ? AND key NOT IN "
+                        "(SELECT key FROM entries WHERE cache = ? ORDER BY stored_at DESC LIMIT ?)",
+                        (cache, cache, self.max_entries),
+                    )
+        except sqlite3.Error:
+            pass
+
+    def delete(self, cache: str, key: str) -> None:
+        try:
+            with self._connect() as db:
+                db.execute("DELETE FROM entries WHERE cache = ? AND key = ?", (cache, key))
+        except sqlite3.Error:
+            pass
+
+
+# Set up by serve() when running several workers, or from SHARED_CACHE_PATH.
+shared_cache: SharedCache | None = SharedCache(Path(SHARED_CACHE_PATH)) if SHARED_CACHE_PATH else None
+CACHES: dict[str, LRUCache] = {}
+
+
+def register_cache(cache: LRUCache) -> LRUCache:
+    CACHES[cache.name] = cache
+    return cache
+
+
+def snapshot_caches(
+    path: Path = CACHE_SNAPSHOT_PATH,
+    caches: dict[str, LRUCache] | None = None,
+    max_entries: int = CACHE_SNAPSHOT_MAX_ENTRIES,
+) -> int:
+    """Write the hottest entries of every cache to path; returns the entry count.
+
+    Entries are interleaved by rank across caches, so a restore cut short by
+    its time budget still gets the hottest entries of each one.
+    """
+    caches = CACHES if caches is None else caches
+    ranked = {name: cache.hottest(max_entries) for name, cache in caches.items()}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    written = 0
+    with tmp.open("w", encoding="utf-8") as f:
+        f.write(json.dumps({"version": SNAPSHOT_VERSION, "model": MODEL, "written_at": time.time()}) + "\n")
+        for rank in range(max((len(entries) for entries in ranked.values()), default=0)):
+            for name, entries in ranked.items():
+                if rank < len(entries):
+                    key, value = entries[rank]
+                    record = [name, key, caches[name].encode(value)]
+                    f.write(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n")
+                    written += 1
+    os.replace(tmp, path)
+    return written
+
+
+def restore_caches(
+    path: Path = CACHE_SNAPSHOT_PATH,
+    caches: dict[str, LRUCache] | None = None,
+    budget_s: float = CACHE_RESTORE_BUDGET_S,
+) -> int:
+    """Load a snapshot written by snapshot_caches, stopping once budget_s is spent.
+
+    Returns the number of entries restored. Snapshots from another format
+    version or model are ignored, as is anything after a truncated record.
+    """
+    caches = CACHES if caches is None else caches
+    start = time.perf_counter()
+    restored = 0
+    try:
+        f = path.open("rb")
+    except FileNotFoundError:
+        return 0
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            try:
+                header = json.loads(mm.readline())
+            except ValueError:
+                return 0
+            if header.get("version") != SNAPSHOT_VERSION or header.get("model") != MODEL:
+                return 0
+            for line in iter(mm.readline, b""):
+                if time.perf_counter() - start > budget_s:
+                    break
+                try:
+                    name, key, value = json.loads(line)
+                except ValueError:
+                    break
+                cache = caches.get(name)
+                if cache is not None:
+                    cache.restore(key, cache.decode(value))
+                    restored += 1
+    return restored
+
+
+def _snapshot_periodically(stop: threading.Event) -> None:
+    written = sum(cache.writes for cache in CACHES.values())
+    while not stop.wait(CACHE_SNAPSHOT_INTERVAL_S):
+        current = sum(cache.writes for cache in CACHES.values())
+        if current != written:
+            snapshot_caches()
+            written = current
+    if sum(cache.writes for cache in CACHES.values()) != written:
+        snapshot_caches()
+
 
 # --- Safety and Backstop ---
 
@@ -42,8 +841,9 @@ SAFETY_RESPONSE = (
 # not a personal distress message.  When these appear alongside a safety
 # keyword the safety gate is skipped so the citation can be reviewed normally.
 CITATION_CONTEXT_PATTERNS = [
-    # Parenthetical year — (2023), (2019), (n.d.)
+    # Parenthetical year — (2023), (2019), (n.d.), (Smith, 2020)
     re.compile(r"\(\s*\d{4}\s*\)"),
+    re.compile(r"\([A-Z][^()]*,\s*(?:\d{4}[a-z]?|n\.d\.)\s*\)"),
     re.compile(r"\(\s*n\.d\.\s*\)", re.IGNORECASE),
     # "vol.", "pp.", "doi:", "http://", "https://"
     re.compile(r"\b(vol\.|pp\.|doi:|https?://)", re.IGNORECASE),
@@ -60,6 +860,27 @@ CITATION_CONTEXT_PATTERNS = [
 ]
 
 HAS_DIGIT_PATTERN = re.compile(r"\d")
+
+# The local pre-check answers a crisis message before any model call, but only
+# on a phrase that speaks for the writer. A generic keyword ("suicide" in a
+# thesis topic) goes to the classifier even next to "I" or "my", as does a
+# phrase that is negated ("I don't want to die"), quoted, or seen alongside a
+# citation signal.
+SELF_REFERENTIAL_SAFETY_KEYWORDS = {
+    "kill myself",
+    "end my life",
+    "want to die",
+    "want to suicide",
+    "want to end it all",
+    "hurt myself",
+    "worth living anymore",
+    "my life is not worth living",
+}
+NEGATION_PATTERN = re.compile(
+    r"\b(?:don'?t|do not|doesn'?t|does not|didn'?t|did not|won'?t|will not|"
+    r"wouldn'?t|would not|never)\s+(?:want to\s+|wanna\s+)?$"
+)
+QUOTED_TEXT_PATTERN = re.compile(r'"[^"]+"|\u201c[^\u201d]+\u201d|(?<!\w)\'[^\']+\'(?!\w)')
 SAFETY_RESPONSE_PATTERN = re.compile(r"988|crisis|not alone", re.IGNORECASE)
 
 TRIAGE_CLASSIFIER_PROMPT = """\
@@ -100,24 +921,80 @@ def _matches_keyword_safety_backstop(text: str) -> bool:
     return has_safety_keyword and not has_citation_signal
 
 
+def _affirmed(lower: str, phrase: str) -> bool:
+    """True when some occurrence of phrase in lower is not negated."""
+    start = lower.find(phrase)
+    while start != -1:
+        if not NEGATION_PATTERN.search(lower, max(0, start - 40), start):
+            return True
+        start = lower.find(phrase, start + 1)
+    return False
+
+
+def safety_precheck(text: str) -> bool:
+    """True when the message is a crisis message beyond doubt; run before any model call."""
+    text = text[:TRIAGE_MAX_CHARS]
+    lower = text.lower().replace("\u2019", "'")
+    if not any(_affirmed(lower, phrase) for phrase in SELF_REFERENTIAL_SAFETY_KEYWORDS):
+        return False
+    return not (QUOTED_TEXT_PATTERN.search(text) or _looks_like_citation(text))
+
+
+TRIAGE_CACHE_SIZE = int(os.environ.get("TRIAGE_CACHE_SIZE", "10000"))
+triage_cache = register_cache(LRUCache("triage", TRIAGE_CACHE_SIZE, shared=True))
+
+
 def classify_request(user_message: str) -> str | None:
     """Classify a request as UNSAFE, OUT_OF_SCOPE, CITATION, or None on failure."""
+    key = cache_key(user_message)
+    cached = triage_cache.get(key)
+    if cached is not None:
+        return cached
     try:
-        response = completion(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": TRIAGE_CLASSIFIER_PROMPT},
-                {"role": "user", "content": user_message},
-            ],
-        )
+        with profile_span("model"):
+            response = completion(
+                model=MODEL,
+                messages=[
+                    {"role": "system", "content": TRIAGE_CLASSIFIER_PROMPT},
+                    {"role": "user", "content": user_message},
+                ],
+            )
+        record_usage(response, stage="triage")
         verdict = response.choices[0].message.content.strip().upper()
         if verdict in TRIAGE_LABELS:
+            triage_cache.put(key, verdict)
             return verdict
     except Exception:
         pass
     return None
 
 
+def classify_message(message: str) -> str | None:
+    """Triage a message of any length.
+
+    The classifier reads the first TRIAGE_MAX_CHARS; every chunk of a longer
+    message that mentions a safety keyword is triaged too, so a crisis
+    statement deep in a long paste is still answered. A longer message whose
+    opening reads as out of scope gets a second look at a sample of its later
+    chunks, so a reference list behind a stray first sentence is still reviewed.
+    """
+    verdict = classify_request(message[:TRIAGE_MAX_CHARS])
+    if verdict == "UNSAFE" or len(message) <= TRIAGE_MAX_CHARS:
+        return verdict
+    chunks = split_into_chunks(message)
+    for chunk in chunks:
+        lower = chunk.lower()
+        if any(kw in lower for kw in SAFETY_KEYWORDS) and classify_request(chunk) == "UNSAFE":
+            return "UNSAFE"
+    if verdict == "OUT_OF_SCOPE" and len(chunks) > 1:
+        later = chunks[1:]
+        picked = later[:: max(1, len(later) // TRIAGE_SAMPLE_CHUNKS)][:TRIAGE_SAMPLE_CHUNKS]
+        share = TRIAGE_MAX_CHARS // len(picked)
+        if classify_request("\n".join(chunk[:share] for chunk in picked)) == "CITATION":
+            return "CITATION"
+    return verdict
+
+
 def check_response(
     response: str,
     user_message: str | None = None,
@@ -179,328 +1056,1988 @@ say: "I'm not certain about this case — I'd recommend checking the {style_manu
 
 # --- Citation Rules by Style ---
 
-RULES_APA = """\
-APA 7th Edition — In-Text Citations
+# Rules live in rules.json: per style its name and manual, then one record
+# per rule ID with its text, category (in_text, reference_entry, footnote,
+# bibliography), the source types it applies to, and an optional local
+# detector. The prompt text is rendered from the registry and is identical to
+# the hand-written rule blocks.
 
-APA-1 — Use author-date format. In-text citations must use (Author, Year). Not footnotes or numbered references.
+RULES_PATH = Path(os.environ.get("RULES_PATH", BASE_DIR / "rules.json"))
+RULE_CATEGORIES = ("in_text", "reference_entry", "footnote", "bibliography")
+# The styles the code knows how to check; the data files must cover exactly these
+STYLES = ("apa", "mla", "chicago")
 
-APA-2 — One or two authors: cite both names every time. Use "&" inside parentheses, "and" in narrative text.
 
-APA-3 — Three or more authors: use "et al." from the first citation. (Smith et al., 2020) — do not list all names after first use.
+def _pattern_detector(pattern: re.Pattern) -> Callable[[str], list[str]]:
+    def detect(text: str) -> list[str]:
+        return [match.group(0) for match in pattern.finditer(text)]
 
-APA-4 — Direct quotes require page numbers. (Smith, 2020, p. 15) for one page, (Smith, 2020, pp. 15-16) for a range.
+    return detect
 
-APA-5 — Block quotes: 40+ words must be freestanding, indented, no quotation marks. Citation after final period.
 
-APA-6 — No comma between author and year in narrative citation. Correct: Smith (2020) found. Wrong: Smith, (2020) found.
+RULE_DETECTORS: dict[str, Callable[[str], list[str]]] = {
+    # Smith, (2020) found ...
+    "narrative_comma_before_year": _pattern_detector(
+        re.compile(r"\b[A-Z][A-Za-z'’-]+(?: et al\.)?,\s+\((?:\d{4}|n\.d\.)\)")
+    ),
+    # (Smith and Jones, 2020)
+    "and_inside_parenthetical": _pattern_detector(
+        re.compile(r"\([^()]*\band\b[^()]*,\s*(?:\d{4}|n\.d\.)[^()]*\)")
+    ),
+    # doi:10.1037/... or https://dx.doi.org/...
+    "doi_not_hyperlink": _pattern_detector(
+        re.compile(r"\bdoi:\s*10\.\d{4,9}/\S+|https?://dx\.doi\.org/\S+", re.IGNORECASE)
+    ),
+    # (Smith, 2020, p. 45) or (Smith, p. 12)
+    "year_or_page_prefix_in_parenthetical": _pattern_detector(
+        re.compile(r"\([^()]*(?:,\s*\d{4}\b|\bpp?\.\s*\d)[^()]*\)")
+    ),
+    # (Smith, 34)
+    "comma_before_page": _pattern_detector(
+        re.compile(r"\([A-Z][A-Za-z'’-]+(?: et al\.)?,\s*\d+(?:[-–]\d+)?\)")
+    ),
+    # ... (2020): pp. 1-20.
+    "pp_in_page_range": _pattern_detector(re.compile(r"\bpp\.\s*\d+(?:[-–]\d+)?")),
+}
 
-APA-7 — Use "&" inside parentheses, "and" in narrative. (Smith & Jones, 2020) but "Smith and Jones (2020) argued."
 
-Reference List
+@dataclass(frozen=True, slots=True)
+class Rule:
+    """One citation rule from the registry."""
+
+    id: str
+    style: str
+    category: str
+    text: str
+    source_types: tuple[str, ...]
+    detector: str | None = None
+
+
+class RuleRegistry:
+    """Citation rules indexed by ID, style, and category."""
+
+    def __init__(self, data: dict):
+        self.version = data["version"]
+        self._layout = data["styles"]
+        self.names = {style: spec["name"] for style, spec in self._layout.items()}
+        self.manuals = {style: spec["manual"] for style, spec in self._layout.items()}
+        self._by_id: dict[str, Rule] = {}
+        self._by_style: dict[str, list[Rule]] = {}
+        self._by_category: dict[str, list[Rule]] = {c: [] for c in RULE_CATEGORIES}
+        for style, spec in self._layout.items():
+            self._by_style[style] = []
+            for section in spec["sections"]:
+                category = section["category"]
+                if category not in self._by_category:
+                    raise ValueError(f"Unknown rule category {category!r} in {style}")
+                for entry in section["rules"]:
+                    detector = entry.get("detector")
+                    if detector is not None and detector not in RULE_DETECTORS:
+                        raise ValueError(f"Unknown detector {detector!r} for {entry['id']}")
+                    if entry["id"] in self._by_id:
+                        raise ValueError(f"Duplicate rule ID {entry['id']!r}")
+                    rule = Rule(
+                        id=entry["id"],
+                        style=style,
+                        category=category,
+                        text=entry["text"],
+                        source_types=tuple(entry.get("source_types", ["any"])),
+                        detector=detector,
+                    )
+                    self._by_id[rule.id] = rule
+                    self._by_style[style].append(rule)
+                    self._by_category[category].append(rule)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    @property
+    def styles(self) -> list[str]:
+        return list(self._layout)
+
+    def get(self, rule_id: str) -> Rule | None:
+        return self._by_id.get(rule_id)
+
+    def for_style(self, style: str, categories: set[str] | None = None) -> list[Rule]:
+        rules = self._by_style.get(style, [])
+        if categories is None:
+            return list(rules)
+        return [rule for rule in rules if rule.category in categories]
+
+    def for_category(self, category: str) -> list[Rule]:
+        return list(self._by_category.get(category, []))
+
+    def render(self, style: str, categories: set[str] | None = None) -> str:
+        """Render the <rules> prompt block for a style, optionally limited to some categories."""
+        spec = self._layout[style]
+        blocks = [spec["heading"]]
+        for section in spec["sections"]:
+            if categories is not None and section["category"] not in categories:
+                continue
+            if section["heading"]:
+                blocks.append(section["heading"])
+            blocks.extend(f"{rule['id']} — {rule['text']}" for rule in section["rules"])
+        return "\n\n".join(blocks) + "\n"
+
+    def detect(self, style: str, text: str) -> list[tuple[str, str]]:
+        """Run the local detectors for a style; returns (rule ID, evidence) pairs."""
+        hits = []
+        for rule in self._by_style.get(style, []):
+            if rule.detector is not None:
+                hits.extend((rule.id, evidence) for evidence in RULE_DETECTORS[rule.detector](text))
+        return hits
+
+
+# --- Review Messages ---
 
-APA-R1 — Hanging indent: first line flush left, subsequent lines indented 0.5 in.
+def normalize_style(style: str | None) -> str:
+    normalized = style.lower() if style else "apa"
+    if normalized not in STYLES:
+        return "apa"
+    return normalized
 
-APA-R2 — Authors: Last, F. M. format. Invert names, use initials.
 
-APA-R3 — List up to 20 authors; 21+ use first 19, ellipsis, then last.
+def build_initial_messages(
+    style: str = "apa",
+    categories: set[str] | None = None,
+    examples: list[dict] | None = None,
+    prompts: "PromptConfig | None" = None,
+) -> list[dict]:
+    """Build the initial message list with system prompt and few-shot examples.
 
-APA-R4 — Year in parentheses immediately after authors. Smith, J. A. (2020).
+    When categories is given, only the rules and examples in those rule
+    categories are included. examples overrides the few-shot selection.
+    prompts defaults to the current PROMPTS.
+    """
+    prompts = prompts or PROMPTS
+    style = normalize_style(style)
+    system_content = prompts.system_prompt(style, None if categories is None else frozenset(categories))
+    messages = [{"role": "system", "content": system_content}]
+    if examples is None:
+        if categories is None:
+            examples = prompts.few_shot[style]
+        else:
+            examples = select_few_shot(style, categories, prompts)
+    for example in examples:
+        messages.append({"role": "user", "content": example["user"]})
+        messages.append({"role": "assistant", "content": example["assistant"]})
+    return messages
 
-APA-R5 — Sentence case for article titles; title case for journal names. Italicize journal and volume.
 
-APA-R6 — DOI as hyperlink: https://doi.org/10.1037/...
+def build_review_messages(text: str, style: str = "apa") -> list[dict]:
+    """Messages for a standalone review of text: the relevant rules and nearest examples."""
+    prompts = PROMPTS
+    if not PRUNE_PROMPTS:
+        messages = build_initial_messages(style, prompts=prompts)
+    else:
+        style = normalize_style(style)
+        categories = relevant_categories(text, style)
+        examples = prompts.example_bank.nearest(text, style, categories=categories)
+        messages = build_initial_messages(style, categories, examples, prompts)
+    messages.append({"role": "user", "content": text})
+    return messages
 
-APA-R7 — Alphabetical order by first author's last name.
 
-APA-R8 — Use "n.d." when no date is available. (Smith, n.d.)
-"""
+# --- Prompt Pruning ---
+
+# Cheap signals for the kinds of citation present in the input. Each kind maps
+# to the rule category that governs it in a given style: a parenthetical in a
+# Chicago paper is checked against the note rules, a footnote in an APA paper
+# against the in-text rules.
+INPUT_KIND_PATTERNS = {
+    "in_text": [
+        # (Smith, 2020), (Smith et al., 2020, p. 4), (Smith 2020, 45)
+        re.compile(r"\([^()]*[A-Za-z][^()]*\b(?:\d{4}|n\.d\.)[^()]*\)"),
+        # Smith (2020), Smith and Jones (2020)
+        re.compile(r"\b[A-Z][a-z'’-]+,?\s+\((?:\d{4}|n\.d\.)"),
+        # (Smith 45), (Smith and Jones 12), (qtd. in Jones 89), (45)
+        re.compile(
+            r"(?<![\w)])\((?:qtd\. in )?"
+            r"(?:[A-Z][A-Za-z'’-]+(?: et al\.| and [A-Z][A-Za-z'’-]+)?,? \d+|\d{1,3})(?:[-–]\d+)?\)"
+        ),
+        # Direct quotations (four words or more, so short quoted titles don't count)
+        re.compile(r"[\"“][^\"”]*(?:\s[^\"”\s]+){3,}[\"”]"),
+    ],
+    "footnote": [
+        re.compile(r"[¹²³⁴⁵⁶⁷⁸⁹⁰]"),
+        re.compile(r"^\s*\d{1,3}\.\s+[A-Z]", re.MULTILINE),
+        re.compile(r"\bIbid\.", re.IGNORECASE),
+    ],
+    "reference_entry": [
+        re.compile(r"^\s*(?:references?|works cited)\b", re.IGNORECASE | re.MULTILINE),
+        # Smith, J. A. (2020).
+        re.compile(r"^\s*[A-Z][A-Za-z'’-]+, (?:[A-Z]\.\s?)+.*\((?:\d{4}|n\.d\.)\)", re.MULTILINE),
+        # Smith, John. Title.
+        re.compile(r"^\s*[A-Z][A-Za-z'’-]+, [A-Z][a-z]+\.", re.MULTILINE),
+    ],
+    "bibliography": [
+        re.compile(r"^\s*bibliography\b", re.IGNORECASE | re.MULTILINE),
+        re.compile(r"^\s*[A-Z][A-Za-z'’-]+, [A-Z][a-z]+\.", re.MULTILINE),
+    ],
+}
 
-RULES_MLA = """\
-MLA 9th Edition — In-Text Citations
+KIND_TO_CATEGORY = {
+    "apa": {
+        "in_text": "in_text",
+        "footnote": "in_text",
+        "reference_entry": "reference_entry",
+        "bibliography": "reference_entry",
+    },
+    "mla": {
+        "in_text": "in_text",
+        "footnote": "in_text",
+        "reference_entry": "reference_entry",
+        "bibliography": "reference_entry",
+    },
+    "chicago": {
+        "in_text": "footnote",
+        "footnote": "footnote",
+        "reference_entry": "bibliography",
+        "bibliography": "bibliography",
+    },
+}
 
-MLA-1 — Author-page format. (Smith 45) — no comma, no "p." or "pp.", no year. Page number only.
 
-MLA-2 — Multiple authors: two authors (Smith and Jones 12); three+ use et al. (Smith et al. 34).
+def classify_input_kinds(text: str) -> set[str]:
+    """Return the citation kinds (in_text, footnote, reference_entry, bibliography) in text."""
+    return {
+        kind
+        for kind, patterns in INPUT_KIND_PATTERNS.items()
+        if any(pat.search(text) for pat in patterns)
+    }
+
+
+def relevant_categories(text: str, style: str) -> set[str] | None:
+    """Rule categories that can apply to text, or None when unsure (send everything)."""
+    kinds = classify_input_kinds(text)
+    if not kinds:
+        return None
+    return {KIND_TO_CATEGORY[normalize_style(style)][kind] for kind in kinds}
+
+
+def select_few_shot(style: str, categories: set[str], prompts: "PromptConfig | None" = None) -> list[dict]:
+    """Few-shot examples whose inputs exercise at least one of categories."""
+    examples = (prompts or PROMPTS).few_shot[style]
+    selected = [
+        example
+        for example in examples
+        if (relevant_categories(example["user"], style) or categories) & categories
+    ]
+    return selected or examples[:1]
+
+
+# --- Few-Shot Example Bank ---
+
+# Standalone reviews pick the k examples most similar to the input from a bank
+# seeded with the few-shot examples and extended by the rest of examples.json.
+# Similarity is cosine over TF-IDF weighted character trigrams, served from an
+# inverted index so a lookup touches only the postings of the query's trigrams.
+
+EXAMPLE_BANK_PATH = Path(os.environ.get("EXAMPLE_BANK_PATH", BASE_DIR / "examples.json"))
+FEW_SHOT_K = 3
+NGRAM_SIZE = 3
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _char_ngrams(text: str) -> dict[str, int]:
+    padded = f" {_normalize_text(text)} "
+    counts: dict[str, int] = {}
+    for i in range(len(padded) - NGRAM_SIZE + 1):
+        gram = padded[i:i + NGRAM_SIZE]
+        counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+@dataclass(frozen=True, slots=True)
+class Example:
+    """One few-shot example in the bank."""
+
+    style: str
+    user: str
+    assistant: str
+    categories: frozenset[str] | None
+
+
+class ExampleBank:
+    """Few-shot examples indexed for nearest-neighbour lookup by style."""
+
+    def __init__(self, examples: list[Example]):
+        self.examples = examples
+        doc_freq: dict[str, int] = {}
+        grams = [_char_ngrams(example.user) for example in examples]
+        for counts in grams:
+            for gram in counts:
+                doc_freq[gram] = doc_freq.get(gram, 0) + 1
+        total = len(examples)
+        self._idf = {gram: math.log((1 + total) / (1 + df)) + 1 for gram, df in doc_freq.items()}
+        self._postings: dict[str, dict[str, list[tuple[int, float]]]] = {}
+        self._normalized = [_normalize_text(example.user) for example in examples]
+        for index, (example, counts) in enumerate(zip(examples, grams)):
+            weights = {gram: count * self._idf[gram] for gram, count in counts.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            postings = self._postings.setdefault(example.style, {})
+            for gram, weight in weights.items():
+                postings.setdefault(gram, []).append((index, weight / norm))
+
+    def __len__(self) -> int:
+        return len(self.examples)
+
+    def nearest(
+        self,
+        text: str,
+        style: str,
+        k: int = FEW_SHOT_K,
+        categories: set[str] | None = None,
+    ) -> list[dict]:
+        """The k examples for style most similar to text, as few-shot dicts.
+
+        Examples outside categories are skipped when any remain, and an example
+        whose input is the query itself is never returned.
+        """
+        postings = self._postings.get(style, {})
+        scores: dict[int, float] = {}
+        for gram, count in _char_ngrams(text).items():
+            idf = self._idf.get(gram)
+            if idf is None or gram not in postings:
+                continue
+            weight = count * idf
+            for index, doc_weight in postings[gram]:
+                scores[index] = scores.get(index, 0.0) + weight * doc_weight
+        query = _normalize_text(text)
+        ranked = sorted(
+            (i for i in scores if self._normalized[i] != query),
+            key=scores.__getitem__,
+            reverse=True,
+        )
+        if categories is not None:
+            matching = [
+                i
+                for i in ranked
+                if self.examples[i].categories is None or self.examples[i].categories & categories
+            ]
+            ranked = matching or ranked
+        return [
+            {"user": self.examples[i].user, "assistant": self.examples[i].assistant}
+            for i in ranked[:k]
+        ]
+
+
+def build_example_bank(few_shot: dict[str, list[dict]], extra: list[dict]) -> ExampleBank:
+    """Seed the bank with the few-shot examples and add extra, skipping duplicates."""
+    entries = [
+        {"style": style, "user": example["user"], "assistant": example["assistant"]}
+        for style, examples in few_shot.items()
+        for example in examples
+    ]
+    entries.extend(extra)
+    examples = []
+    seen = set()
+    for entry in entries:
+        key = (entry["style"], _normalize_text(entry["user"]))
+        if key in seen:
+            continue
+        seen.add(key)
+        categories = relevant_categories(entry["user"], entry["style"])
+        examples.append(
+            Example(
+                style=entry["style"],
+                user=entry["user"],
+                assistant=entry["assistant"],
+                categories=frozenset(categories) if categories is not None else None,
+            )
+        )
+    return ExampleBank(examples)
+
+
+# --- Prompt Configuration ---
+
+# Rules, style names and manuals (rules.json) and few-shot examples
+# (examples.json) load into one immutable PromptConfig, versioned by the files'
+# contents. A watcher thread checks the files every PROMPT_RELOAD_INTERVAL_S
+# (0 turns it off); after a change it builds and renders the new config in
+# the background and swaps it in with a single assignment, so a request never
+# waits for a reload or sees half of one, and a bad file leaves the current
+# config in place. Point RULES_PATH and EXAMPLE_BANK_PATH at a mounted volume
+# to change rules without a deploy. A session's history keeps the config it
+# started with for all of its turns.
+
+PROMPT_RELOAD_INTERVAL_S = float(os.environ.get("PROMPT_RELOAD_INTERVAL_S", "5"))
+
+
+@dataclass(frozen=True, eq=False)
+class PromptConfig:
+    """One version of everything prompts are built from."""
+
+    version: str
+    registry: RuleRegistry
+    rules: dict[str, str]
+    style_names: dict[str, str]
+    style_manuals: dict[str, str]
+    few_shot: dict[str, list[dict]]
+    example_bank: ExampleBank
+    _system_prompts: dict = field(default_factory=dict, repr=False)
+    _prefixes: dict = field(default_factory=dict, repr=False)
+
+    def system_prompt(self, style: str, categories: frozenset[str] | None = None) -> str:
+        key = (style, categories)
+        prompt = self._system_prompts.get(key)
+        if prompt is None:
+            if categories is None:
+                rules_text = self.rules[style]
+            else:
+                rules_text = self.registry.render(style, categories)
+            prompt = self._system_prompts[key] = SYSTEM_PROMPT_TEMPLATE.format(
+                style_name=self.style_names[style],
+                style_manual=self.style_manuals[style],
+                rules=rules_text,
+            )
+        return prompt
+
+    def session_prefix(self, style: str) -> tuple[dict, ...]:
+        """The system prompt and few-shot messages every session of style starts with."""
+        prefix = self._prefixes.get(style)
+        if prefix is None:
+            prefix = self._prefixes[style] = tuple(build_initial_messages(style, prompts=self))
+        return prefix
+
+    def prebuild(self) -> None:
+        """Render every system prompt and session prefix ahead of the requests that need them."""
+        for style in STYLES:
+            self.session_prefix(style)
+            for size in range(1, len(RULE_CATEGORIES) + 1):
+                for categories in combinations(RULE_CATEGORIES, size):
+                    self.system_prompt(style, frozenset(categories))
+
+
+def load_prompt_config(
+    rules_path: Path = RULES_PATH, examples_path: Path = EXAMPLE_BANK_PATH
+) -> PromptConfig:
+    """Load and check the data files; raises OSError or ValueError when they are unusable."""
+    rules_data = rules_path.read_bytes()
+    examples_data = examples_path.read_bytes()
+    try:
+        registry = RuleRegistry(json.loads(rules_data))
+        examples = json.loads(examples_data)
+        few_shot = examples["few_shot"]
+        extra = examples["examples"]
+    except KeyError as e:
+        raise ValueError(f"Missing {e} in prompt data") from None
+    if set(registry.styles) != set(STYLES) or set(few_shot) != set(STYLES):
+        raise ValueError(f"Rules and few-shot examples must cover exactly {', '.join(STYLES)}")
+    return PromptConfig(
+        version=hashlib.blake2b(rules_data + b"\0" + examples_data, digest_size=6).hexdigest(),
+        registry=registry,
+        rules={style: registry.render(style) for style in STYLES},
+        style_names=registry.names,
+        style_manuals=registry.manuals,
+        few_shot=few_shot,
+        example_bank=build_example_bank(few_shot, extra),
+    )
 
-MLA-3 — No comma between author and page number. (Smith 22) not (Smith, 22).
 
-MLA-4 — Indirect sources: use "qtd. in" in the parenthetical. (qtd. in Jones 89).
+PROMPTS = load_prompt_config()
+# Older configs stay reachable while a session still uses them, so a session
+# picked up from another worker can keep its version
+PROMPT_VERSIONS: weakref.WeakValueDictionary[str, PromptConfig] = weakref.WeakValueDictionary(
+    {PROMPTS.version: PROMPTS}
+)
+_reload_lock = threading.Lock()
+
+
+def reload_prompts() -> bool:
+    """Swap in the data files' current contents; False when unchanged or unusable."""
+    global PROMPTS
+    with _reload_lock:
+        try:
+            config = load_prompt_config(RULES_PATH, EXAMPLE_BANK_PATH)
+        except (OSError, ValueError) as e:
+            print(f"Prompt reload skipped: {e}", file=sys.stderr, flush=True)
+            return False
+        if config.version == PROMPTS.version:
+            return False
+        config.prebuild()
+        PROMPT_VERSIONS[config.version] = config
+        PROMPTS = config
+        return True
+
+
+def _prompt_files_stamp() -> tuple | None:
+    try:
+        stats = [os.stat(path) for path in (RULES_PATH, EXAMPLE_BANK_PATH)]
+    except OSError:
+        return None
+    return tuple((stat.st_mtime_ns, stat.st_size) for stat in stats)
+
+
+def _watch_prompt_files(stop: threading.Event) -> None:
+    stamp = _prompt_files_stamp()
+    while not stop.wait(PROMPT_RELOAD_INTERVAL_S):
+        current = _prompt_files_stamp()
+        if current is not None and current != stamp:
+            stamp = current
+            reload_prompts()
+
+
+# --- Citation Parser ---
+
+# A fast local parser that turns citations into ParsedCitation records. In-text
+# citations are scanned anywhere in the text; reference, works-cited and
+# bibliography entries and footnotes are parsed one line at a time with the
+# grammar for the style. Fields that can't be found are left as None.
+
+SUPERSCRIPT_DIGITS = str.maketrans("¹²³⁴⁵⁶⁷⁸⁹⁰", "1234567890")
+YEAR = r"\d{4}[a-z]?|n\.d\."
+PAGES = r"\d+(?:\s*[-–]\s*\d+)?"
+NAME = r"[A-Z][A-Za-z'’-]+"
+
+# A DOI written bare, after "doi:", or as a doi.org link; never a path inside another URL
+DOI_PATTERN = re.compile(
+    r"(?:https?://(?:dx\.)?doi\.org/|\bdoi:\s*|(?<![\w/.:%-]))(10\.\d{4,9}/[^\s\"<>]+?)"
+    r"(?=[.,;]?(?:\s|$))",
+    re.IGNORECASE,
+)
+URL_PATTERN = re.compile(r"https?://[^\s\"<>]+?(?=[.,;]?(?:\s|$))")
+ENTRY_LABEL_PATTERN = re.compile(r"^\s*(?:references?|works cited|bibliography)\s*:?\s*", re.IGNORECASE)
+NOTE_NUMBER_PATTERN = re.compile(r"^\s*(?:([¹²³⁴⁵⁶⁷⁸⁹⁰]+)|(\d{1,3})\.)\s*(?=\S)")
 
-MLA-5 — Block quotes: four or more lines of prose, indented 0.5 in, no quotation marks.
+# (Smith, 2020, p. 4), (Smith & Jones, 2020), (Smith et al., n.d.)
+PARENTHETICAL_AUTHOR_DATE = re.compile(
+    rf"\((?P<authors>[^()]*?[A-Za-z][^()]*?),?\s+(?P<year>{YEAR})(?:,\s*(?:pp?\.\s*)?(?P<pages>{PAGES}))?\)"
+)
+# Smith (2020), Smith and Jones (2020, p. 4)
+NARRATIVE_AUTHOR_DATE = re.compile(
+    rf"(?P<authors>{NAME}(?: et al\.|(?:,? {NAME})*,? (?:and|&) {NAME})?),?\s+"
+    rf"\((?P<year>{YEAR})(?:,\s*pp?\.\s*(?P<pages>{PAGES}))?\)"
+)
+# (Smith 45), (Smith and Jones 12-14), (qtd. in Jones 89), (45)
+PARENTHETICAL_AUTHOR_PAGE = re.compile(
+    rf"(?<![\w)])\((?:qtd\. in )?(?:(?P<authors>{NAME}(?: et al\.| and {NAME})?),?\s+)?(?P<pages>{PAGES})\)"
+)
 
-MLA-6 — When author named in text, page number alone in parentheses. Smith argues that ... (45).
+# Smith, J. A., & Jones, B. (2020). Title. Journal, 105(3), 234-250. https://doi.org/...
+APA_REFERENCE = re.compile(
+    rf"^(?P<authors>.+?)\s*\((?P<year>{YEAR})\)\.\s*(?P<title>.+?[.?!])(?:\s+(?P<rest>.*))?$"
+)
+APA_CONTAINER = re.compile(
+    rf"^(?P<container>[^,]+?(?=,|\.\s|\.?$))(?:,\s*(?P<volume>\d+)(?:\((?P<issue>[^)]+)\))?)?"
+    rf"(?:,\s*(?:pp?\.\s*)?(?P<pages>{PAGES}))?[.,]?(?:\s|$)"
+)
+# Smith, John. "Article." Journal, vol. 1, no. 2, 2020, pp. 3-4.  /  Smith, John. Book. Publisher, 2020.
+MLA_ENTRY = re.compile(
+    r"^(?P<authors>[A-Z][^.\"“()]+?(?:\s[A-Z]\.)*)\.\s+"
+    r"(?P<title>\"[^\"]+\"|“[^”]+”|[^.]+\.)\s*(?P<rest>.*)$"
+)
+# Smith, John. Book. New York: Norton, 2020.  /  Smith, John. "Article." Journal 10, no. 2 (2020): 1–20.
+CHICAGO_PUBLICATION = re.compile(r"^(?P<place>[^:.]+):\s*(?P<publisher>[^,]+),\s*(?P<year>\d{4})")
+CHICAGO_JOURNAL = re.compile(
+    rf"^(?P<container>[^,\d]+?)\s+(?P<volume>\d+)(?:,\s*no\.\s*(?P<issue>\d+))?"
+    rf"\s*\((?P<year>[^)]*\d{{4}})\)(?::\s*(?P<pages>{PAGES}))?"
+)
+# Notes: John Smith, Title (Place: Publisher, 2020), 45.  /  Smith, Short Title, 45.  /  Ibid., 45.
+NOTE_FULL = re.compile(
+    rf"^(?P<authors>[^,(]+),\s*(?P<title>[^(]+?)\s*"
+    rf"\((?P<place>[^:()]+):\s*(?P<publisher>[^,()]+),\s*(?P<year>\d{{4}})\)(?:,\s*(?P<pages>{PAGES}))?"
+)
+NOTE_SHORT = re.compile(rf"^(?P<authors>[^,]+),\s*(?P<title>[^,]+),\s*(?P<pages>{PAGES})\.?$")
+NOTE_IBID = re.compile(rf"^Ibid\.(?:,\s*(?P<pages>{PAGES}))?", re.IGNORECASE)
+
+MLA_VOLUME = re.compile(r"\bvol\.\s*(\d+)", re.IGNORECASE)
+MLA_ISSUE = re.compile(r"\bno\.\s*(\d+)", re.IGNORECASE)
+MLA_PAGES = re.compile(rf"\bpp?\.\s*({PAGES})")
+BARE_YEAR = re.compile(r"\b(\d{4})\b")
+AUTHOR_SEPARATOR = re.compile(r"(?<=\.),\s*(?:&\s*)?|,?\s+(?:and|&)\s+")
+
+
+@dataclass(slots=True)
+class ParsedCitation:
+    """A citation parsed into its parts."""
+
+    kind: str
+    style: str
+    raw: str
+    authors: tuple[str, ...] = ()
+    year: str | None = None
+    title: str | None = None
+    container: str | None = None
+    volume: str | None = None
+    issue: str | None = None
+    pages: str | None = None
+    publisher: str | None = None
+    place: str | None = None
+    doi: str | None = None
+    url: str | None = None
+    note_number: int | None = None
+
+    def key(self) -> tuple:
+        """Whitespace- and case-insensitive identity, usable as a cache key."""
+        return (self.kind, self.style, _normalize_text(self.raw))
+
+
+def _split_authors(text: str) -> tuple[str, ...]:
+    text = text.strip().rstrip(",").strip()
+    if not text:
+        return ()
+    return tuple(a.strip().rstrip(",") for a in AUTHOR_SEPARATOR.split(text) if a.strip())
+
+
+def _strip_title(title: str) -> str:
+    return title.strip().strip("\"“”").rstrip(".").rstrip(",").strip()
+
+
+def _links(citation: ParsedCitation, text: str) -> None:
+    doi = DOI_PATTERN.search(text)
+    if doi:
+        citation.doi = doi.group(1)
+    url = URL_PATTERN.search(text)
+    if url:
+        citation.url = url.group(0)
+
+
+def _parse_apa_reference(line: str, kind: str) -> ParsedCitation | None:
+    match = APA_REFERENCE.match(line)
+    if not match:
+        return None
+    citation = ParsedCitation(
+        kind=kind,
+        style="apa",
+        raw=line,
+        authors=_split_authors(match.group("authors")),
+        year=match.group("year"),
+        title=_strip_title(match.group("title")),
+    )
+    rest = match.group("rest") or ""
+    container = APA_CONTAINER.match(rest)
+    if container and not rest.lower().startswith(("http", "doi")):
+        citation.container = container.group("container").strip()
+        citation.volume = container.group("volume")
+        citation.issue = container.group("issue")
+        citation.pages = container.group("pages")
+    _links(citation, rest)
+    return citation
+
+
+def _parse_mla_or_chicago_entry(line: str, style: str, kind: str) -> ParsedCitation | None:
+    match = MLA_ENTRY.match(line)
+    if not match:
+        return None
+    citation = ParsedCitation(
+        kind=kind,
+        style=style,
+        raw=line,
+        authors=_split_authors(match.group("authors")),
+        title=_strip_title(match.group("title")),
+    )
+    rest = match.group("rest")
+    if style == "chicago":
+        journal = CHICAGO_JOURNAL.match(rest)
+        publication = CHICAGO_PUBLICATION.match(rest)
+        if journal:
+            citation.container = journal.group("container").strip()
+            citation.volume = journal.group("volume")
+            citation.issue = journal.group("issue")
+            citation.year = BARE_YEAR.search(journal.group("year")).group(1)
+            citation.pages = journal.group("pages")
+        elif publication:
+            citation.place = publication.group("place").strip()
+            citation.publisher = publication.group("publisher").strip()
+            citation.year = publication.group("year")
+    else:
+        # Book: Publisher, Year.  Container: Container, Publisher, Year. / Journal, vol. 1, ...
+        parts = [p.strip().rstrip(".") for p in rest.split(",") if p.strip()]
+        volume, issue, pages = MLA_VOLUME.search(rest), MLA_ISSUE.search(rest), MLA_PAGES.search(rest)
+        citation.volume = volume.group(1) if volume else None
+        citation.issue = issue.group(1) if issue else None
+        citation.pages = pages.group(1) if pages else None
+        if len(parts) == 2 and not volume:
+            citation.publisher = parts[0]
+        elif parts:
+            citation.container = parts[0]
+            if not volume and len(parts) > 2:
+                citation.publisher = parts[1]
+    if citation.year is None:
+        year = BARE_YEAR.search(rest)
+        citation.year = year.group(1) if year else None
+    _links(citation, rest)
+    return citation
+
+
+def _parse_note(body: str, style: str, number: int) -> ParsedCitation:
+    citation = ParsedCitation(kind="footnote", style=style, raw=body, note_number=number)
+    if ibid := NOTE_IBID.match(body):
+        citation.title = "Ibid."
+        citation.pages = ibid.group("pages")
+    elif full := NOTE_FULL.match(body):
+        citation.authors = _split_authors(full.group("authors"))
+        citation.title = _strip_title(full.group("title"))
+        citation.place = full.group("place").strip()
+        citation.publisher = full.group("publisher").strip()
+        citation.year = full.group("year")
+        citation.pages = full.group("pages")
+    elif short := NOTE_SHORT.match(body):
+        citation.authors = _split_authors(short.group("authors"))
+        citation.title = _strip_title(short.group("title"))
+        citation.pages = short.group("pages")
+    _links(citation, body)
+    return citation
+
+
+def _parse_in_text(text: str, style: str) -> list[ParsedCitation]:
+    found: list[tuple[int, ParsedCitation]] = []
+    taken: list[tuple[int, int]] = []
+
+    def add(match: re.Match, citation: ParsedCitation) -> None:
+        start, end = match.span()
+        if any(start < t_end and t_start < end for t_start, t_end in taken):
+            return
+        taken.append((start, end))
+        found.append((start, citation))
+
+    for pattern in (NARRATIVE_AUTHOR_DATE, PARENTHETICAL_AUTHOR_DATE, PARENTHETICAL_AUTHOR_PAGE):
+        for match in pattern.finditer(text):
+            groups = match.groupdict()
+            add(
+                match,
+                ParsedCitation(
+                    kind="in_text",
+                    style=style,
+                    raw=match.group(0),
+                    authors=_split_authors(groups.get("authors") or ""),
+                    year=groups.get("year"),
+                    pages=groups.get("pages"),
+                ),
+            )
+    return [citation for _, citation in sorted(found, key=lambda item: item[0])]
+
+
+PARSE_CACHE_SIZE = int(os.environ.get("PARSE_CACHE_SIZE", "5000"))
+
+
+def _encode_citations(citations: tuple[ParsedCitation, ...]) -> list:
+    return [astuple(citation) for citation in citations]
+
+
+def _decode_citations(rows: list) -> tuple[ParsedCitation, ...]:
+    return tuple(ParsedCitation(*row[:3], tuple(row[3]), *row[4:]) for row in rows)
+
+
+parse_cache = register_cache(
+    LRUCache("parse", PARSE_CACHE_SIZE, encode=_encode_citations, decode=_decode_citations)
+)
 
-Works Cited
 
-MLA-W1 — Author: Last, First. Invert first author only for multi-author entries.
+def parse_citations(text: str, style: str = "apa") -> list[ParsedCitation]:
+    """Parse every citation in text: entries and notes line by line, then in-text citations.
 
-MLA-W2 — Container model: Title of Source. Title of Container, Publisher, Year.
+    Results are cached and shared between callers; treat them as read-only.
+    """
+    style = normalize_style(style)
+    key = cache_key(style, text)
+    citations = parse_cache.get(key)
+    if citations is None:
+        citations = tuple(_parse_citations(text, style))
+        parse_cache.put(key, citations)
+    return list(citations)
+
+
+def _parse_citations(text: str, style: str) -> list[ParsedCitation]:
+    entry_kind = "bibliography" if style == "chicago" else "reference_entry"
+    citations: list[ParsedCitation] = []
+    prose: list[str] = []
+    for raw_line in text.splitlines():
+        line = ENTRY_LABEL_PATTERN.sub("", raw_line).strip()
+        if not line:
+            continue
+        note = NOTE_NUMBER_PATTERN.match(line)
+        if note and (note.group(1) or style == "chicago"):
+            number = int((note.group(1) or note.group(2)).translate(SUPERSCRIPT_DIGITS))
+            citations.append(_parse_note(line[note.end():], style, number))
+            continue
+        if style == "apa":
+            entry = _parse_apa_reference(line, entry_kind)
+        else:
+            entry = _parse_mla_or_chicago_entry(line, style, entry_kind)
+        if entry is not None and (entry.year or entry.container or entry.publisher or entry.url):
+            citations.append(entry)
+            continue
+        prose.append(line)
+    citations.extend(_parse_in_text("\n".join(prose), style))
+    return citations
+
+
+# --- Link Checks ---
+
+# A local stage for APA-R6 (DOIs as https://doi.org/ links) and CHI-B5 (access
+# dates for undated online sources). DOI syntax and form are checked locally;
+# DOI metadata can optionally be fetched through a resolver, with results kept
+# in an on-disk cache. Resolution never holds a request for longer than
+# LINK_CHECK_BUDGET_S: lookups still running then finish in the background and
+# land in the cache for the next request.
+
+DOI_SYNTAX_PATTERN = re.compile(r"^10\.\d{4,9}/[-._;()/:A-Za-z0-9<>\[\]]+$")
+CANONICAL_DOI_PREFIX = "https://doi.org/"
+ACCESS_DATE_PATTERN = re.compile(r"\baccessed\b", re.IGNORECASE)
+LINK_CHECK_BUDGET_S = float(os.environ.get("LINK_CHECK_BUDGET_S", "0.5"))
+DOI_CACHE_PATH = Path(os.environ.get("DOI_CACHE_PATH", BASE_DIR / ".cache" / "doi.sqlite3"))
+DOI_CACHE_TTL_S = 7 * 24 * 3600
+DOI_CACHE_TIMEOUT_S = 0.05
+DOI_RESOLVE_TIMEOUT_S = 5.0
+
+# A resolver maps a DOI to its metadata ({"title": ..., "year": ...}), returns
+# None when the DOI is not registered, and raises on transport errors (which
+# are not cached).
+DoiResolver = Callable[[str], dict | None]
+
+
+def resolve_doi_org(doi: str) -> dict | None:
+    """Fetch CSL-JSON metadata for a DOI from doi.org content negotiation."""
+    request = urllib.request.Request(
+        CANONICAL_DOI_PREFIX + urllib.parse.quote(doi, safe="/:;()"),
+        headers={"Accept": "application/vnd.citationstyles.csl+json"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=DOI_RESOLVE_TIMEOUT_S) as response:
+            data = json.load(response)
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            return None
+        raise
+    date_parts = (data.get("issued") or {}).get("date-parts") or [[None]]
+    year = date_parts[0][0]
+    return {"title": data.get("title"), "year": str(year) if year else None}
 
-MLA-W3 — Italicize book and journal titles; quotation marks for article and chapter titles.
 
-MLA-W4 — Hanging indent for each entry.
+DOI_RESOLVERS: dict[str, DoiResolver] = {"doi.org": resolve_doi_org}
+DOI_RESOLVER = DOI_RESOLVERS.get(os.environ.get("DOI_RESOLVER", ""))
 
-MLA-W5 — Alphabetical order by author's last name.
 
-MLA-W6 — Publisher and publication date required when available.
-"""
+_CACHE_MISS = object()
 
-RULES_CHICAGO = """\
-Chicago 17th Edition — Notes and Bibliography
 
-Notes (footnotes/endnotes)
+class DoiCache:
+    """Persistent DOI metadata cache (SQLite) with a time-to-live.
 
-CHI-1 — Use superscript numbers in text. Full citation in first note; shortened form in subsequent notes.
+    Errors (a locked or corrupt database) count as misses, and a lock is
+    waited on for at most timeout_s, so the cache can't hold up a request.
+    """
 
-CHI-2 — Footnote number after punctuation (comma, period). Place at end of clause or sentence.
+    def __init__(
+        self, path: Path, ttl_s: float = DOI_CACHE_TTL_S, timeout_s: float = DOI_CACHE_TIMEOUT_S
+    ):
+        self.path = Path(path)
+        self.ttl_s = ttl_s
+        self.timeout_s = timeout_s
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with self._connect() as db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS doi_metadata "
+                    "(doi TEXT PRIMARY KEY, metadata TEXT, fetched_at REAL NOT NULL)"
+                )
+        except sqlite3.Error:
+            pass
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=self.timeout_s)
+
+    def get(self, doi: str):
+        """Cached metadata (None for unregistered DOIs), or _CACHE_MISS."""
+        try:
+            with self._connect() as db:
+                row = db.execute(
+                    "SELECT metadata, fetched_at FROM doi_metadata WHERE doi = ?", (doi.lower(),)
+                ).fetchone()
+        except sqlite3.Error:
+            return _CACHE_MISS
+        if row is None or time.time() - row[1] > self.ttl_s:
+            return _CACHE_MISS
+        return json.loads(row[0]) if row[0] is not None else None
+
+    def put(self, doi: str, metadata: dict | None) -> None:
+        try:
+            with self._connect() as db:
+                stored = json.dumps(metadata) if metadata is not None else None
+                db.execute(
+                    "INSERT OR REPLACE INTO doi_metadata VALUES (?, ?, ?)",
+                    (doi.lower(), stored, time.time()),
+                )
+        except sqlite3.Error:
+            pass
+
+
+@dataclass(frozen=True, slots=True)
+class LinkFinding:
+    """One problem found by the link checks."""
+
+    rule_id: str
+    evidence: str
+    message: str
 
-CHI-3 — First note: full citation. Author First Last, Title (Place: Publisher, Year), page.
+    def render(self) -> str:
+        return f'- {self.rule_id}: "{self.evidence}" — {self.message}'
+
+
+_link_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="doi-resolve")
+_doi_cache: DoiCache | None = None
+
+
+def _default_doi_cache() -> DoiCache:
+    global _doi_cache
+    if _doi_cache is None:
+        _doi_cache = DoiCache(DOI_CACHE_PATH)
+    return _doi_cache
+
+
+def _resolve_and_cache(doi: str, resolver: DoiResolver, cache: DoiCache) -> dict | None:
+    metadata = resolver(doi)
+    cache.put(doi, metadata)
+    return metadata
+
+
+def _doi_form_findings(text: str) -> tuple[list[LinkFinding], list[str]]:
+    findings = []
+    dois = []
+    for match in DOI_PATTERN.finditer(text):
+        written, doi = match.group(0), match.group(1)
+        if not DOI_SYNTAX_PATTERN.match(doi):
+            findings.append(LinkFinding("APA-R6", written, "this is not a valid DOI."))
+            continue
+        dois.append(doi)
+        if not written.startswith(CANONICAL_DOI_PREFIX):
+            findings.append(
+                LinkFinding(
+                    "APA-R6",
+                    written,
+                    f"write the DOI as a hyperlink: {CANONICAL_DOI_PREFIX}{doi}",
+                )
+            )
+    return findings, dois
+
+
+def check_links(
+    text: str,
+    style: str = "apa",
+    resolver: DoiResolver | None = None,
+    cache: DoiCache | None = None,
+    budget_s: float = LINK_CHECK_BUDGET_S,
+) -> list[LinkFinding]:
+    """Check the DOIs and URLs in text; resolution is bounded by budget_s."""
+    style = normalize_style(style)
+    findings: list[LinkFinding] = []
+    dois: list[str] = []
+    if style == "apa":
+        findings, dois = _doi_form_findings(text)
+    elif style == "chicago":
+        for citation in parse_citations(text, style):
+            if (
+                citation.kind == "bibliography"
+                and citation.url
+                and citation.year is None
+                and not ACCESS_DATE_PATTERN.search(citation.raw)
+            ):
+                findings.append(
+                    LinkFinding(
+                        "CHI-B5",
+                        citation.raw,
+                        "online source with no publication date needs an access date.",
+                    )
+                )
+    resolver = resolver if resolver is not None else DOI_RESOLVER
+    if resolver is None or not dois:
+        return findings
+
+    deadline = time.monotonic() + budget_s
+    cache = cache if cache is not None else _default_doi_cache()
+    years = {c.doi: c.year for c in parse_citations(text, style) if c.doi}
+    resolved: dict[str, dict | None] = {}
+    pending = {}
+    for doi in dict.fromkeys(dois):
+        if time.monotonic() >= deadline:
+            break
+        cached = cache.get(doi)
+        if cached is _CACHE_MISS:
+            pending[_link_pool.submit(_resolve_and_cache, doi, resolver, cache)] = doi
+        else:
+            resolved[doi] = cached
+    if pending:
+        done, _ = wait(pending, timeout=max(0.0, deadline - time.monotonic()))
+        for future in done:
+            if future.exception() is None:
+                resolved[pending[future]] = future.result()
+    for doi, metadata in resolved.items():
+        if metadata is None:
+            findings.append(LinkFinding("APA-R6", doi, "this DOI is not registered; check it for typos."))
+        elif metadata.get("year") and years.get(doi) and metadata["year"] != years[doi][:4]:
+            findings.append(
+                LinkFinding(
+                    "APA-R4",
+                    doi,
+                    f"the DOI is registered with publication year {metadata['year']}, "
+                    f"not {years[doi]}.",
+                )
+            )
+    return findings
+
+
+def append_link_findings(response: str, findings: list[LinkFinding]) -> str:
+    """Add link findings the review doesn't already report."""
+    new = [f for f in findings if not (f.rule_id in response and f.evidence in response)]
+    if not new:
+        return response
+    return response + "\n\nLink checks:\n" + "\n".join(f.render() for f in new)
 
-CHI-4 — Shortened form after first use: Author, Shortened Title, page. Or Ibid. when same source, same page.
 
-CHI-5 — Ibid. only when citing the same source and page as the immediately preceding note.
+# --- LLM Call ---
 
-CHI-6 — Use "Ibid." for same source same page; "Ibid., 45" for same source different page.
 
-Bibliography
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "2000"))
+response_cache = register_cache(LRUCache("response", RESPONSE_CACHE_SIZE, shared=True))
 
-CHI-B1 — Hanging indent. Alphabetical by author's last name.
+# A failed model call is answered with this prefix and the error; callers that
+# keep or merge reviews check for it with is_model_error.
+MODEL_ERROR_PREFIX = "Something went wrong: "
 
-CHI-B2 — Author: Last, First. First author inverted; additional authors First Last.
 
-CHI-B3 — Book: Author. Title. Place: Publisher, Year.
+class StreamClosed(Exception):
+    """The client went away while a response was streaming to it."""
 
-CHI-B4 — Article: Author. "Article Title." Journal Title volume, no. issue (Year): page range.
 
-CHI-B5 — Include access date for online sources when no fixed publication date.
+def generate_response(messages: list[dict], on_delta: Callable[[str], None] | None = None) -> str:
+    """Generate a response using LiteLLM, reusing the response to an identical prompt.
 
-CHI-B6 — Page ranges: use en dash, no "pp." in bibliography.
-"""
+    With on_delta, the response is streamed and on_delta gets each piece as it
+    arrives; it may block to slow the stream down or raise StreamClosed to end it.
+    """
+    key = cache_key(MODEL, json.dumps(messages, ensure_ascii=False))
+    cached = response_cache.get(key)
+    if cached is not None:
+        if on_delta is not None:
+            on_delta(cached)
+        return cached
+    try:
+        with profile_span("model"):
+            if on_delta is None:
+                response = completion(model=MODEL, messages=messages)
+                record_usage(response)
+                text = response.choices[0].message.content
+            else:
+                text = _stream_completion(messages, on_delta)
+        if text:
+            response_cache.put(key, text)
+        return text
+    except StreamClosed:
+        raise
+    except Exception as e:
+        return f"{MODEL_ERROR_PREFIX}{e}"
 
-RULES = {
-    "apa": RULES_APA,
-    "mla": RULES_MLA,
-    "chicago": RULES_CHICAGO,
-}
 
-STYLE_NAMES = {
-    "apa": "APA 7th Edition",
-    "mla": "MLA 9th Edition",
-    "chicago": "Chicago 17th Edition (Notes and Bibliography)",
-}
+def is_model_error(response: str | None) -> bool:
+    """True for what generate_response returns when the model call failed."""
+    return not response or response.startswith(MODEL_ERROR_PREFIX)
 
-STYLE_MANUALS = {
-    "apa": "Publication Manual of the American Psychological Association (7th ed.)",
-    "mla": "MLA Handbook (9th ed.)",
-    "chicago": "Chicago Manual of Style (17th ed.)",
-}
 
+def _stream_completion(messages: list[dict], on_delta: Callable[[str], None]) -> str:
+    parts = []
+    stream = completion(
+        model=MODEL, messages=messages, stream=True, stream_options={"include_usage": True}
+    )
+    for chunk in stream:
+        if getattr(chunk, "usage", None):
+            record_usage(chunk)
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            parts.append(delta)
+            on_delta(delta)
+    return "".join(parts)
+
+
+# --- Chunked Review ---
+
+ENTRY_BOUNDARY_PATTERN = re.compile(r"\n+")
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"(?<=[.!?])\s+(?=[A-Z(\"“¹²³⁴⁵⁶⁷⁸⁹])")
+VIOLATION_LINE_PATTERN = re.compile(r"^\s*[-*•]\s*((?:APA|MLA|CHI)-[A-Z]?\d+)\b")
+QUOTED_EVIDENCE_PATTERN = re.compile(r"[\"“]([^\"”]+)[\"”]")
+CORRECTED_MARKER = "Corrected citation:"
+NO_VIOLATIONS = "No violations found."
+UNREVIEWED_SECTIONS = "sections could not be reviewed"
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate; close enough to keep prompts under budget."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _split_units(text: str, token_budget: int) -> list[str]:
+    """Split text into entries (lines), then sentences, then hard slices."""
+    max_chars = token_budget * CHARS_PER_TOKEN
+    units = []
+    for entry in ENTRY_BOUNDARY_PATTERN.split(text):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if len(entry) <= max_chars:
+            units.append(entry)
+            continue
+        for sentence in SENTENCE_BOUNDARY_PATTERN.split(entry):
+            for start in range(0, len(sentence), max_chars):
+                units.append(sentence[start:start + max_chars])
+    return units
+
+
+def split_into_chunks(
+    text: str,
+    token_budget: int = CHUNK_TOKEN_BUDGET,
+    overlap_units: int = CHUNK_OVERLAP_UNITS,
+) -> list[str]:
+    """Split text on citation boundaries into overlapping chunks under token_budget.
+
+    The last overlap_units entries of each chunk are repeated at the start of
+    the next one so notes such as "Ibid." keep the entry they refer to.
+    """
+    chunks: list[list[str]] = []
+    current: list[str] = []
+    current_tokens = 0
+    for unit in _split_units(text, token_budget):
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > token_budget:
+            chunks.append(current)
+            carried = current[-overlap_units:] if overlap_units else []
+            carried_tokens = sum(estimate_tokens(u) for u in carried)
+            if carried_tokens + unit_tokens > token_budget:
+                carried, carried_tokens = [], 0
+            current, current_tokens = list(carried), carried_tokens
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append(current)
+    return ["\n".join(chunk) for chunk in chunks]
+
+
+def merge_reviews(reviews: list[str]) -> str:
+    """Merge per-chunk reviews, deduplicating violations by rule ID and evidence.
+
+    Failed chunks are reported rather than counted as clean, prose answers
+    are kept as they are, and a crisis response from any chunk is the answer.
+    """
+    violations: list[str] = []
+    seen: set[tuple[str, str]] = set()
+    corrected: list[str] = []
+    seen_corrected: set[str] = set()
+    failed = [review for review in reviews if is_model_error(review)]
+    if len(failed) == len(reviews):
+        return failed[0]
+    notes = []
+    if failed:
+        notes.append(f"{len(failed)} of {len(reviews)} {UNREVIEWED_SECTIONS}. Please resubmit them.")
+    for review in reviews:
+        if is_model_error(review):
+            continue
+        if SAFETY_RESPONSE_PATTERN.search(review):
+            return SAFETY_RESPONSE
+        head, _, tail = review.partition(CORRECTED_MARKER)
+        matches = [(line, VIOLATION_LINE_PATTERN.match(line)) for line in head.splitlines()]
+        prose = not review.startswith(NO_VIOLATIONS) and not any(match for _, match in matches)
+        if prose and head.strip() not in notes:
+            notes.append(head.strip())
+        for line, match in matches:
+            if not match:
+                continue
+            evidence = QUOTED_EVIDENCE_PATTERN.search(line)
+            key_text = evidence.group(1) if evidence else line[match.end():]
+            key = (match.group(1), " ".join(key_text.lower().split()))
+            if key in seen:
+                continue
+            seen.add(key)
+            violations.append(line.strip())
+        for line in tail.splitlines():
+            line = line.strip()
+            if line and line not in seen_corrected:
+                seen_corrected.add(line)
+                corrected.append(line)
+    if not violations and not notes:
+        return f"{NO_VIOLATIONS} All {len(reviews)} sections of your text are correctly formatted."
+    if not violations and failed:
+        reviewed = len(reviews) - len(failed)
+        notes.append(f"No violations found in the {reviewed} other section{'s' * (reviewed != 1)}.")
+    if violations:
+        notes.append("\n".join(violations))
+    merged = "\n\n".join(notes)
+    if corrected:
+        merged += f"\n\n{CORRECTED_MARKER}\n" + "\n".join(corrected)
+    return merged
+
+
+def review_in_chunks(text: str, style: str) -> str:
+    """Review each chunk concurrently against a fresh prompt and merge the results."""
+    chunks = split_into_chunks(text)
+
+    def review(chunk: str) -> str:
+        return generate_response(build_review_messages(chunk, style))
+
+    with usage_labels(stage="chunk_review"):
+        with ThreadPoolExecutor(max_workers=min(CHUNK_MAX_WORKERS, len(chunks))) as pool:
+            futures = [submit_with_labels(pool, review, chunk) for chunk in chunks]
+            reviews = [future.result() for future in futures]
+    return merge_reviews(reviews)
+
+
+# --- Style Comparison ---
+
+
+def review_standalone(text: str, style: str, triage_failed: bool = False) -> str:
+    """Review text with no session history, applying the backstop and link checks."""
+    if estimate_tokens(text) > CHUNK_TOKEN_BUDGET:
+        response = review_in_chunks(text, style)
+    else:
+        response = generate_response(build_review_messages(text, style))
+    response = check_response(response, user_message=text, triage_failed=triage_failed)
+    if response != SAFETY_RESPONSE:
+        response = append_link_findings(response, check_links(text, style))
+    return response
 
-# --- Few-Shot Examples ---
 
-FEW_SHOT_APA = [
-    {
-        "user": (
-            'According to Smith (2020), "the results were significant" and '
-            "the study confirmed earlier findings (Jones & Lee, 2019)."
-        ),
-        "assistant": (
-            '- APA-4 (page number required): "the results were significant" '
-            "is a direct quote but lacks a page number.\n\n"
-            "Corrected citation:\n"
-            'According to Smith (2020, p. XX), "the results were significant" and '
-            "the study confirmed earlier findings (Jones & Lee, 2019)."
-        ),
-    },
-    {
-        "user": (
-            "Smith and Jones (2020) found that sleep deprivation impairs "
-            "memory. This aligns with earlier work (Lee et al., 2018)."
-        ),
-        "assistant": (
-            "No violations found. The writing is correctly formatted: "
-            "narrative citation uses 'and' correctly, parenthetical uses "
-            "'et al.' for 3+ authors, and both include years."
-        ),
-    },
-    {
-        "user": (
-            "The research (Smith, Jones, Lee, & Park, 2021) showed that "
-            '"cognitive load theory explains most variance." '
-            "Earlier, Smith, Jones, Lee, and Park (2021) had hypothesized this."
-        ),
-        "assistant": (
-            '- APA-3 (et al. for 3+ authors): "(Smith, Jones, Lee, & '
-            'Park, 2021)" — APA 7th requires "et al." from the first citation.\n'
-            '- APA-3: "Smith, Jones, Lee, and Park (2021)" in narrative — '
-            "should also use et al. form.\n\n"
-            "Corrected citation:\n"
-            'The research (Smith et al., 2021) showed that "cognitive load theory '
-            'explains most variance." Earlier, Smith et al. (2021) had hypothesized this.'
-        ),
-    },
-    {
-        "user": (
-            "Can you rewrite this reference list for me? "
-            "Smith, J. (2020). Effects Of Sleep. journal of psychology, 105(3), 234."
-        ),
-        "assistant": (
-            '- APA-R5 (title capitalization): "Effects Of Sleep" should use sentence case.\n'
-            '- APA-R5 (journal capitalization): "journal of psychology" should be in title case '
-            "and italicized.\n\n"
-            "Corrected citation:\n"
-            "Smith, J. (2020). Effects of sleep. Journal of Psychology, 105(3), 234."
-        ),
-    },
-]
+def compare_styles(text: str, triage_failed: bool = False) -> dict[str, str]:
+    """Review text against every style concurrently."""
+    styles = list(STYLES)
 
-FEW_SHOT_MLA = [
-    {
-        "user": (
-            "Smith argues that memory declines with age (Smith, 2020, p. 45)."
-        ),
-        "assistant": (
-            '- MLA-1 (author-page, no year): MLA uses author and page only — '
-            'remove the year and "p."\n'
-            "- MLA-3 (no comma): Do not use a comma between author and page.\n\n"
-            "Corrected citation:\n"
-            "Smith argues that memory declines with age (Smith 45)."
-        ),
-    },
-    {
-        "user": (
-            "Recent studies confirm this (Jones 22). The data show a clear "
-            "trend (Jones 22)."
-        ),
-        "assistant": (
-            "No violations found. Author-page format is correct; no comma, "
-            "no 'p.,' no year. Correctly formatted for MLA."
-        ),
-    },
-    {
-        "user": (
-            "According to Lee, the effect was significant (Lee, 34). "
-            "Smith wrote that \"results were positive\" (Smith, p. 12)."
-        ),
-        "assistant": (
-            '- MLA-3 (no comma): "(Lee, 34)" — remove the comma.\n'
-            '- MLA-1 (no "p."): "(Smith, p. 12)" — MLA omits "p." Remove the '
-            "page prefix and comma.\n\n"
-            "Corrected citation:\n"
-            "According to Lee, the effect was significant (Lee 34). "
-            'Smith wrote that "results were positive" (Smith 12).'
-        ),
-    },
-]
+    def review(style: str) -> str:
+        with usage_labels(style=style, stage="compare"):
+            return review_standalone(text, style, triage_failed)
 
-FEW_SHOT_CHICAGO = [
-    {
-        "user": (
-            "The study found strong effects (Smith 2020, 45). "
-            "Later work confirmed this (Jones 2019)."
-        ),
-        "assistant": (
-            "- CHI-1 (footnote format): Chicago Notes-Bibliography uses "
-            "superscript numbers and footnotes, not parenthetical author-date.\n\n"
-            "Corrected citation:\n"
-            "The study found strong effects.¹ Later work confirmed this.²\n"
-            "¹ John Smith, [Title] ([Place]: [Publisher], 2020), 45.\n"
-            "² Jane Jones, [Title] ([Place]: [Publisher], 2019)."
-        ),
-    },
-    {
-        "user": (
-            "Smith argues that the method was flawed.¹ "
-            "¹Smith, Research Methods, 45."
-        ),
-        "assistant": (
-            "No violations found. Superscript number is placed after punctuation; "
-            "shortened note form (author, short title, page) is appropriate for "
-            "a subsequent citation. Correctly formatted for Chicago."
-        ),
-    },
-    {
-        "user": (
-            "Bibliography: Smith, John. Introduction to Statistics. "
-            "New York: Norton, 2020."
-        ),
-        "assistant": (
-            "No violations found. The bibliography entry uses correct author "
-            "order and book-entry formatting for Chicago."
-        ),
-    },
-    {
-        "user": (
-            "The data support the hypothesis.² "
-            "² Smith, John. Introduction to Statistics (New York: Norton, 2020), 78."
-        ),
-        "assistant": (
-            '- CHI-3 (first note format): In notes, first citations use "First Last," '
-            'so "Smith, John" should be "John Smith."\n\n'
-            "Corrected citation:\n"
-            "The data support the hypothesis.²\n"
-            "² John Smith, Introduction to Statistics (New York: Norton, 2020), 78."
-        ),
-    },
-]
+    with ThreadPoolExecutor(max_workers=len(styles)) as pool:
+        futures = [submit_with_labels(pool, review, style) for style in styles]
+        return dict(zip(styles, (future.result() for future in futures)))
 
-FEW_SHOT = {
-    "apa": FEW_SHOT_APA,
-    "mla": FEW_SHOT_MLA,
-    "chicago": FEW_SHOT_CHICAGO,
-}
 
+def _violation_ids(review: str) -> list[str]:
+    head = review.partition(CORRECTED_MARKER)[0]
+    matches = (VIOLATION_LINE_PATTERN.match(line) for line in head.splitlines())
+    return list(dict.fromkeys(match.group(1) for match in matches if match))
 
-def normalize_style(style: str | None) -> str:
-    normalized = style.lower() if style else "apa"
-    if normalized not in RULES:
-        return "apa"
-    return normalized
 
+def summarize_comparison(reviews: dict[str, str]) -> str:
+    """One line per style with its violations, plus the style(s) the text fits best."""
+    counts = {style: _violation_ids(review) for style, review in reviews.items()}
+    style_names = PROMPTS.style_names
+    lines = []
+    for style, ids in counts.items():
+        if ids:
+            noun = "violation" if len(ids) == 1 else "violations"
+            lines.append(f"{style_names[style]}: {len(ids)} {noun} ({', '.join(ids)})")
+        else:
+            lines.append(f"{style_names[style]}: {NO_VIOLATIONS}")
+    fewest = min(len(ids) for ids in counts.values())
+    closest = [style_names[style] for style, ids in counts.items() if len(ids) == fewest]
+    lines.append(f"Closest match: {' / '.join(closest)}")
+    return "\n".join(lines)
+
+
+def _history_text(text: str) -> str:
+    """Bound what a single oversized turn contributes to later prompts."""
+    limit = TRIAGE_MAX_CHARS
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f"\n[... {len(text) - limit} more characters reviewed in chunks]"
+
+
+# --- Speculative Drafts ---
+
+# When the local detectors find violations in a first-turn review, the model
+# verifies and amends a draft built from them instead of writing a review from
+# scratch: the prompt is a short verifier role plus the relevant rules, with
+# no few-shot examples, and a correct draft is confirmed with one word.
+# SPECULATIVE_DRAFTS=1 turns it on; compare eval runs with and without it
+# (python evals/results.py) before making it the default.
 
-def build_initial_messages(style: str = "apa") -> list[dict]:
-    """Build the initial message list with system prompt and few-shot examples."""
+SPECULATIVE_DRAFTS = os.environ.get("SPECULATIVE_DRAFTS") == "1"
+DRAFT_CONFIRMED = "CONFIRMED"
+
+VERIFY_SYSTEM_TEMPLATE = """\
+<role>
+You verify citation reviews for {style_name}, written for students formatting academic papers.
+</role>
+
+<task>
+The user's text is followed by a <draft> review written by automatic pattern checks.
+Check the draft against <rules>: drop any listed violation that is not real, add any
+violation it missed, and make sure the corrected citation fixes every violation.
+If the draft is correct and complete, reply with exactly: CONFIRMED
+Otherwise reply with the complete amended review: one line per violation giving the rule ID,
+the quoted citation and a brief explanation, then a "Corrected citation:" block with the
+fully corrected text.
+</task>
+
+<rules>
+{rules}
+</rules>"""
+
+# Corrected form of each detector's evidence
+DRAFT_FIXES: dict[str, Callable[[str], str]] = {
+    # Smith, (2020) -> Smith (2020)
+    "narrative_comma_before_year": lambda evidence: re.sub(r",\s+\(", " (", evidence),
+    # (Smith and Jones, 2020) -> (Smith & Jones, 2020)
+    "and_inside_parenthetical": lambda evidence: re.sub(r"\s+and\s+", " & ", evidence),
+    # doi:10.1037/abc -> https://doi.org/10.1037/abc
+    "doi_not_hyperlink": lambda evidence: re.sub(
+        r"^(?:doi:\s*|https?://dx\.doi\.org/)", CANONICAL_DOI_PREFIX, evidence, flags=re.IGNORECASE
+    ),
+    # (Smith, 2020, p. 45) -> (Smith 45)
+    "year_or_page_prefix_in_parenthetical": lambda evidence: re.sub(
+        r",\s*(?=\d)", " ", re.sub(r"\bpp?\.\s*", "", re.sub(r",\s*\d{4}\b", "", evidence))
+    ),
+    # (Smith, 34) -> (Smith 34)
+    "comma_before_page": lambda evidence: re.sub(r",\s*(?=\d)", " ", evidence),
+    # pp. 1-20 -> 1–20
+    "pp_in_page_range": lambda evidence: re.sub(r"pp\.\s*", "", evidence).replace("-", "–"),
+}
+
+
+def draft_review(text: str, style: str) -> str | None:
+    """A review of text built from the local detectors, or None when they find nothing."""
+    registry = PROMPTS.registry
+    hits = list(dict.fromkeys(registry.detect(style, text)))
+    if not hits:
+        return None
+    violations = []
+    corrected = text
+    for rule_id, evidence in hits:
+        rule = registry.get(rule_id)
+        violations.append(f'- {rule_id}: "{evidence}" — {rule.text}')
+        fix = DRAFT_FIXES.get(rule.detector)
+        if fix is not None:
+            corrected = corrected.replace(evidence, fix(evidence))
+    return "\n".join(violations) + f"\n\n{CORRECTED_MARKER}\n{corrected}"
+
+
+def build_verification_messages(text: str, style: str, draft: str) -> list[dict]:
+    """Messages asking the model to confirm or amend draft: the relevant rules, no examples."""
+    prompts = PROMPTS
     style = normalize_style(style)
-    style_name = STYLE_NAMES[style]
-    style_manual = STYLE_MANUALS[style]
-    rules_text = RULES[style]
-    system_content = SYSTEM_PROMPT_TEMPLATE.format(
-        style_name=style_name,
-        style_manual=style_manual,
-        rules=rules_text,
+    categories = relevant_categories(text, style) if PRUNE_PROMPTS else None
+    system = VERIFY_SYSTEM_TEMPLATE.format(
+        style_name=prompts.style_names[style],
+        rules=prompts.registry.render(style, categories),
     )
-    messages = [{"role": "system", "content": system_content}]
-    for example in FEW_SHOT[style]:
-        messages.append({"role": "user", "content": example["user"]})
-        messages.append({"role": "assistant", "content": example["assistant"]})
-    return messages
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": f"{text}\n\n<draft>\n{draft}\n</draft>"},
+    ]
 
 
-# --- LLM Call ---
+def resolve_draft(draft: str, reply: str) -> str:
+    """The review a verification reply stands for."""
+    return draft if reply.strip().rstrip(".").upper() == DRAFT_CONFIRMED else reply
+
+
+def speculative_review(text: str, style: str) -> str | None:
+    """Review text by verifying a local draft; None when there is no draft."""
+    draft = draft_review(text, style)
+    if draft is None:
+        return None
+    with usage_labels(stage="verify"):
+        reply = generate_response(build_verification_messages(text, style, draft))
+    return resolve_draft(draft, reply)
+
+
+# --- Incremental Review ---
+
+# Users typically paste a reference list, fix a few entries and paste it again.
+# Each review of a list is split into per-entry results kept with the session;
+# the next submission is diffed against them and only new or edited entries go
+# back to the model. List order is the one property that spans entries, so it
+# is re-checked locally on every pass. Only lines with a citation signal are
+# entries; a submission that also carries a question goes to a full review.
+
+INCREMENTAL_MIN_ENTRIES = 3
+# A year, "n.d.", "Surname, I.", a link or DOI, or "Ibid."
+ENTRY_SIGNAL_PATTERN = re.compile(
+    r"\b(?:1[5-9]|20)\d\d[a-z]?\b|\bn\.d\.|[A-Z][A-Za-z'’-]+,\s+[A-Z]\."
+    r"|https?://|\bdoi:|\b(?i:ibid)\b"
+)
+CORRECTED_MATCH_THRESHOLD = 0.5
+ORDER_RULES = {"apa": "APA-R7", "mla": "MLA-W5", "chicago": "CHI-B1"}
+
+
+@dataclass(frozen=True, slots=True)
+class EntryReview:
+    """What the last review said about one entry of a submitted list."""
+
+    violations: tuple[str, ...]
+    corrected: str
+
+
+def _is_entry(line: str) -> bool:
+    return not line.endswith("?") and ENTRY_SIGNAL_PATTERN.search(line) is not None
+
+
+def _submission_lines(text: str) -> list[str]:
+    """The non-empty lines of a submission, without "References"-style headings."""
+    lines = (line.strip() for line in ENTRY_BOUNDARY_PATTERN.split(text))
+    return [line for line in lines if line and ENTRY_LABEL_PATTERN.sub("", line)]
+
+
+def split_entries(text: str) -> list[str]:
+    """The lines of a submission that are citations or notes, one per line."""
+    return [line for line in _submission_lines(text) if _is_entry(line)]
+
+
+def _entry_key(entry: str) -> str:
+    return " ".join(entry.split())
+
+
+def _similarity(a: dict[str, int], b: dict[str, int]) -> float:
+    dot = sum(count * b.get(gram, 0) for gram, count in a.items())
+    if not dot:
+        return 0.0
+    return dot / math.sqrt(sum(c * c for c in a.values()) * sum(c * c for c in b.values()))
+
 
+def is_complete_review(review: str) -> bool:
+    """A review that can be split into entries: a clean verdict, or violations and corrections.
 
-def generate_response(messages: list[dict]) -> str:
-    """Generate a response using LiteLLM."""
+    Anything ahead of the first violation (prose, a note about sections that
+    could not be reviewed) means some entries were not judged line by line.
+    """
+    if review.startswith(NO_VIOLATIONS):
+        return True
+    head, marker, _ = review.partition(CORRECTED_MARKER)
+    lines = [line for line in head.splitlines() if line.strip()]
+    return bool(marker) and bool(lines) and VIOLATION_LINE_PATTERN.match(lines[0]) is not None
+
+
+def attribute_review(entries: list[str], review: str, style: str) -> dict[str, EntryReview]:
+    """Split a review of entries into per-entry results, keyed by entry text.
+
+    Violations go to the one entry containing their quoted evidence and
+    corrected lines to the most similar entry. Only unambiguous results are
+    returned: a flagged entry needs its corrected line, and clean entries are
+    trusted only when every violation found its entry. Order violations are
+    left out; they are re-checked locally. A failed or malformed review
+    yields nothing.
+    """
+    if not is_complete_review(review):
+        return {}
+    order_rule = ORDER_RULES.get(style)
+    head, _, tail = review.partition(CORRECTED_MARKER)
+    corrected_lines = [line.strip() for line in tail.splitlines() if line.strip()]
+    if len(entries) == 1:
+        violations = tuple(
+            line.strip()
+            for line in head.splitlines()
+            if (match := VIOLATION_LINE_PATTERN.match(line)) and match.group(1) != order_rule
+        )
+        corrected = "\n".join(corrected_lines) if violations and corrected_lines else entries[0]
+        return {_entry_key(entries[0]): EntryReview(violations, corrected)}
+
+    keys = [_entry_key(entry) for entry in entries]
+    lowered = [key.lower() for key in keys]
+    flagged: dict[int, list[str]] = {}
+    unassigned = False
+    for line in head.splitlines():
+        match = VIOLATION_LINE_PATTERN.match(line)
+        if not match or match.group(1) == order_rule:
+            continue
+        evidence = QUOTED_EVIDENCE_PATTERN.search(line)
+        quote = _entry_key(evidence.group(1)).lower() if evidence else ""
+        owners = [i for i, entry in enumerate(lowered) if quote and quote in entry]
+        if len(owners) == 1:
+            flagged.setdefault(owners[0], []).append(line.strip())
+        else:
+            unassigned = True
+
+    grams = [_char_ngrams(entry) for entry in entries]
+    corrected: dict[int, str] = {}
+    for line in corrected_lines:
+        line_grams = _char_ngrams(line)
+        scores = [(_similarity(line_grams, g), i) for i, g in enumerate(grams) if i not in corrected]
+        if not scores:
+            break
+        score, best = max(scores)
+        if score >= CORRECTED_MATCH_THRESHOLD:
+            corrected[best] = line
+
+    results = {}
+    for i, key in enumerate(keys):
+        if i in flagged:
+            if i in corrected:
+                results[key] = EntryReview(tuple(flagged[i]), corrected[i])
+        elif not unassigned:
+            results[key] = EntryReview((), entries[i])
+    return results
+
+
+def _order_violation(entries: list[str], style: str) -> str | None:
+    rule_id = ORDER_RULES.get(style)
+    if rule_id is None:
+        return None
+    entry_kind = "bibliography" if style == "chicago" else "reference_entry"
+    surnames = [
+        citation.authors[0].split(",")[0].strip().lower()
+        for citation in parse_citations("\n".join(entries), style)
+        if citation.kind == entry_kind and citation.authors
+    ]
+    if len(surnames) < 2 or surnames == sorted(surnames):
+        return None
+    return f"- {rule_id}: entries are not in alphabetical order by author's last name."
+
+
+def compose_review(entries: list[str], results: dict[str, EntryReview], style: str) -> str:
+    """Assemble a whole-list review from per-entry results, in submission order."""
+    reviews = [results[_entry_key(entry)] for entry in entries]
+    violations = list(dict.fromkeys(line for review in reviews for line in review.violations))
+    order = _order_violation(entries, style)
+    if order:
+        violations.append(order)
+    if not violations:
+        return f"{NO_VIOLATIONS} All {len(entries)} entries are correctly formatted."
+    corrected = "\n".join(review.corrected for review in reviews)
+    return "\n".join(violations) + f"\n\n{CORRECTED_MARKER}\n" + corrected
+
+
+def _review_entries(entries: list[str], style: str) -> dict[str, EntryReview]:
+    """Review entries in one pass, then one by one for any it cannot attribute."""
+    text = "\n".join(entries)
+    if estimate_tokens(text) > CHUNK_TOKEN_BUDGET:
+        review = review_in_chunks(text, style)
+    else:
+        review = generate_response(build_review_messages(text, style))
+    results = attribute_review(entries, review, style)
+    missing = [entry for entry in entries if _entry_key(entry) not in results]
+    if not missing or len(entries) == 1:
+        return results
+
+    def review_one(entry: str) -> dict[str, EntryReview]:
+        return attribute_review([entry], generate_response(build_review_messages(entry, style)), style)
+
+    with ThreadPoolExecutor(max_workers=min(CHUNK_MAX_WORKERS, len(missing))) as pool:
+        for future in [submit_with_labels(pool, review_one, entry) for entry in missing]:
+            results.update(future.result())
+    return results
+
+
+def review_incrementally(
+    text: str, style: str, previous: dict[str, EntryReview]
+) -> tuple[str, dict[str, EntryReview]] | None:
+    """Re-review only the entries of text missing from previous.
+
+    Returns the composed review and the per-entry results for text, or None
+    when text is not a list, has lines besides its entries (a follow-up
+    question), shares no entries with the previous turn, or an edited entry
+    could not be reviewed.
+    """
+    lines = _submission_lines(text)
+    entries = [line for line in lines if _is_entry(line)]
+    if len(entries) < INCREMENTAL_MIN_ENTRIES or len(entries) < len(lines):
+        return None
+    keys = [_entry_key(entry) for entry in entries]
+    results = {key: previous[key] for key in keys if key in previous}
+    if not results:
+        return None
+    changed = list(dict.fromkeys(entry for entry, key in zip(entries, keys) if key not in previous))
+    if changed:
+        with usage_labels(stage="incremental_review"):
+            results.update(_review_entries(changed, style))
+        if any(key not in results for key in keys):
+            return None
+    return compose_review(entries, results, style), results
+
+
+# --- Static Assets ---
+
+STATIC_CACHE_CONTROL = "public, max-age=60, must-revalidate"
+
+
+@dataclass(frozen=True)
+class StaticAsset:
+    """A UI asset held in memory with its precompressed variants."""
+
+    media_type: str
+    etag: str
+    bodies: dict[str, bytes]
+
+
+def load_static_asset(path: Path, media_type: str) -> StaticAsset:
+    """Read an asset once and precompress it; encodings that don't shrink it are dropped."""
+    body = path.read_bytes()
+    bodies = {"identity": body}
+    compressed = {
+        "gzip": gzip.compress(body, compresslevel=9, mtime=0),
+        "br": brotli.compress(body, quality=11),
+    }
+    for encoding, data in compressed.items():
+        if len(data) < len(body):
+            bodies[encoding] = data
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    return StaticAsset(media_type=media_type, etag=etag, bodies=bodies)
+
+
+def _choose_encoding(asset: StaticAsset, accept_encoding: str) -> str:
+    accepted = {
+        part.split(";")[0].strip().lower()
+        for part in accept_encoding.split(",")
+        if not part.strip().endswith(";q=0")
+    }
+    for encoding in ("br", "gzip"):
+        if encoding in asset.bodies and encoding in accepted:
+            return encoding
+    return "identity"
+
+
+def serve_static_asset(asset: StaticAsset, request: Request) -> Response:
+    """Serve an in-memory asset with a per-encoding strong ETag, answering 304 on a match."""
+    encoding = _choose_encoding(asset, request.headers.get("accept-encoding", ""))
+    etag = f'"{asset.etag}"' if encoding == "identity" else f'"{asset.etag}-{encoding}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": STATIC_CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(asset.bodies[encoding], media_type=asset.media_type, headers=headers)
+
+
+INDEX_ASSET = load_static_asset(BASE_DIR / "index.html", "text/html; charset=utf-8")
+
+
+# --- Admission Control ---
+
+# Every model-bound request takes a token from its client IP's bucket and, when
+# it names a session, from that session's bucket too, then passes an admission
+# gate that caps concurrent reviews. Session IDs are chosen by the client, so
+# they only ever narrow the IP limit; an address may carry several users (a
+# campus NAT), so its bucket holds RATE_LIMIT_IP_FACTOR times a session's. The
+# client IP is the one uvicorn takes from X-Forwarded-For when the peer is in
+# FORWARDED_ALLOW_IPS (the Cloud Run front end; see the Dockerfile).
+# Requests waiting for a slot queue by input length, shortest first; when the
+# queue is full, or a request has waited too long, it gets a 429 with
+# Retry-After instead of holding a worker until it times out.
+
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", "20"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "5"))
+RATE_LIMIT_IP_FACTOR = float(os.environ.get("RATE_LIMIT_IP_FACTOR", "3"))
+MAX_CONCURRENT_REVIEWS = int(os.environ.get("MAX_CONCURRENT_REVIEWS", "8"))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", "24"))
+ADMISSION_TIMEOUT_S = float(os.environ.get("ADMISSION_TIMEOUT_S", "30"))
+RATE_LIMIT_MAX_CLIENTS = 10_000
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after_s: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+
+class RateLimiter:
+    """Token bucket per client: rate_per_minute sustained, burst at once."""
+
+    def __init__(
+        self,
+        rate_per_minute: float = RATE_LIMIT_PER_MINUTE,
+        burst: float = RATE_LIMIT_BURST,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate_per_s = rate_per_minute / 60
+        self.burst = burst
+        self.clock = clock
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def check(self, client: str, scale: float = 1.0) -> None:
+        """Take one token for client or raise AdmissionRejected; scale multiplies rate and burst."""
+        burst, rate_per_s = self.burst * scale, self.rate_per_s * scale
+        with self._lock:
+            now = self.clock()
+            tokens, last = self._buckets.get(client, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate_per_s)
+            if tokens < 1:
+                self._buckets[client] = (tokens, now)
+                raise AdmissionRejected("rate_limited", (1 - tokens) / rate_per_s)
+            self._buckets[client] = (tokens - 1, now)
+            if len(self._buckets) > RATE_LIMIT_MAX_CLIENTS:
+                self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        refill_s = self.burst / self.rate_per_s
+        self._buckets = {
+            client: state for client, state in self._buckets.items() if now - state[1] < refill_s
+        }
+
+
+class AdmissionController:
+    """Caps concurrent reviews; waiting requests are served shortest input first."""
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT_REVIEWS,
+        max_queue: int = ADMISSION_QUEUE_SIZE,
+        timeout_s: float = ADMISSION_TIMEOUT_S,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout_s = timeout_s
+        self._cond = threading.Condition()
+        self._queue: list[tuple[int, int]] = []
+        self._sequence = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = {"rate_limited": 0, "queue_full": 0, "timeout": 0}
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+        self.total_service_s = 0.0
+        self.completed = 0
+
+    def _retry_after(self) -> float:
+        average_s = self.total_service_s / self.completed if self.completed else 5.0
+        return average_s * (len(self._queue) + 1) / self.max_concurrent
+
+    def acquire(self, cost: int) -> None:
+        """Wait for a slot; cost (input length) orders the queue."""
+        start = time.monotonic()
+        with self._cond:
+            if self.in_flight < self.max_concurrent and not self._queue:
+                self._admit(0.0)
+                return
+            if len(self._queue) >= self.max_queue:
+                self.rejected["queue_full"] += 1
+                raise AdmissionRejected("queue_full", self._retry_after())
+            self._sequence += 1
+            ticket = (cost, self._sequence)
+            heapq.heappush(self._queue, ticket)
+            deadline = start + self.timeout_s
+            while not (self._queue[0] == ticket and self.in_flight < self.max_concurrent):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                    self.rejected["timeout"] += 1
+                    self._cond.notify_all()
+                    raise AdmissionRejected("timeout", self._retry_after())
+                self._cond.wait(remaining)
+            heapq.heappop(self._queue)
+            self._admit(time.monotonic() - start)
+            self._cond.notify_all()
+
+    def _admit(self, waited_s: float) -> None:
+        self.in_flight += 1
+        self.admitted += 1
+        self.total_wait_s += waited_s
+        self.max_wait_s = max(self.max_wait_s, waited_s)
+
+    def record_rejection(self, reason: str) -> None:
+        with self._cond:
+            self.rejected[reason] += 1
+
+    def release(self, service_s: float) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_service_s += service_s
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "in_flight": self.in_flight,
+                "queue_depth": len(self._queue),
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "avg_wait_s": self.total_wait_s / self.admitted if self.admitted else 0.0,
+                "max_wait_s": self.max_wait_s,
+            }
+
+
+rate_limiter = RateLimiter()
+admission = AdmissionController()
+
+
+@contextmanager
+def admit(http_request: HTTPConnection, session_id: str | None, message: str):
+    """Apply the rate limit and admission gate around a model-bound request."""
+    check_rate_limit(http_request, session_id)
     try:
-        response = completion(model=MODEL, messages=messages)
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Something went wrong: {e}"
+        with profile_span("admission_wait"):
+            admission.acquire(len(message))
+    except AdmissionRejected as e:
+        raise _too_many_requests(e) from None
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        admission.release(time.monotonic() - start)
+
+
+def check_rate_limit(http_request: HTTPConnection, session_id: str | None) -> None:
+    """Take a token from the session's bucket, if any, and the client IP's, or raise a 429."""
+    client = http_request.client.host if http_request.client else "unknown"
+    try:
+        if session_id:
+            rate_limiter.check(f"session:{session_id}")
+        rate_limiter.check(f"ip:{client}", scale=RATE_LIMIT_IP_FACTOR)
+    except AdmissionRejected as e:
+        admission.record_rejection(e.reason)
+        raise _too_many_requests(e) from None
+
+
+def _too_many_requests(rejection: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=f"Too many requests ({rejection.reason.replace('_', ' ')}). Please try again shortly.",
+        headers={"Retry-After": str(max(1, math.ceil(rejection.retry_after_s)))},
+    )
 
 
 # --- Session Management ---
 
-sessions: dict[str, list[dict]] = {}
+# Every session of a style opens with the same system prompt and few-shot
+# exchange, so a history refers to the prefix its PromptConfig keeps per style
+# rather than holding its own copy, and stores only the session's own turns,
+# as __slots__ records. Turns older than the last SESSION_HOT_TURNS are kept
+# zlib-compressed. A history becomes litellm messages only when a call is made.
+
+SESSION_HOT_TURNS = int(os.environ.get("SESSION_HOT_TURNS", "4"))
+SESSION_COMPRESS_MIN_CHARS = 256
+
+
+class Turn:
+    """One message of a session's own history."""
+
+    __slots__ = ("role", "_text")
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self._text: str | bytes = content
+
+    @property
+    def content(self) -> str:
+        text = self._text
+        return zlib.decompress(text).decode() if isinstance(text, bytes) else text
+
+    def compress(self) -> None:
+        if isinstance(self._text, str) and len(self._text) >= SESSION_COMPRESS_MIN_CHARS:
+            packed = zlib.compress(self._text.encode())
+            if len(packed) < len(self._text):
+                self._text = packed
+
+
+class SessionHistory:
+    """A session's conversation: the shared prefix for its style, then its turns."""
+
+    __slots__ = ("prompts", "style", "turns")
+
+    def __init__(self, style: str, prompts: PromptConfig | None = None):
+        self.prompts = prompts or PROMPTS
+        self.style = style
+        self.turns: list[Turn] = []
+
+    @property
+    def prefix(self) -> tuple[dict, ...]:
+        return self.prompts.session_prefix(self.style)
+
+    def append(self, role: str, content: str) -> None:
+        self.turns.append(Turn(role, content))
+        if len(self.turns) > SESSION_HOT_TURNS:
+            self.turns[-SESSION_HOT_TURNS - 1].compress()
+
+    def messages(self) -> list[dict]:
+        """The history in litellm message format, freshly built for one call."""
+        return [dict(message) for message in self.prefix] + [
+            {"role": turn.role, "content": turn.content} for turn in self.turns
+        ]
+
+    def to_json(self) -> list[list[str]]:
+        return [[turn.role, turn.content] for turn in self.turns]
+
+    @classmethod
+    def from_json(
+        cls, style: str, turns: list[list[str]], prompts: PromptConfig | None = None
+    ) -> "SessionHistory":
+        history = cls(style, prompts)
+        for role, content in turns:
+            history.append(role, content)
+        return history
+
+
+sessions: dict[str, SessionHistory] = {}
 session_styles: dict[str, str] = {}
+session_entry_reviews: dict[str, dict[str, EntryReview]] = {}
+
+
+def load_shared_session(session_id: str) -> None:
+    """With several workers, pick up the history another worker may have added."""
+    if shared_cache is None:
+        return
+    stored = shared_cache.get("session", session_id)
+    if stored is not None:
+        prompts = PROMPT_VERSIONS.get(stored["version"])
+        sessions[session_id] = SessionHistory.from_json(stored["style"], stored["turns"], prompts)
+        session_styles[session_id] = stored["style"]
+
+
+def drop_session(session_id: str) -> None:
+    """Forget everything held for a session."""
+    sessions.pop(session_id, None)
+    session_styles.pop(session_id, None)
+    session_entry_reviews.pop(session_id, None)
+    usage_ledger.forget_session(session_id)
+    if shared_cache is not None:
+        shared_cache.delete("session", session_id)
+
+
+def share_session(session_id: str) -> None:
+    if shared_cache is None or session_id not in sessions:
+        return
+    history = sessions[session_id]
+    shared_cache.put(
+        "session",
+        session_id,
+        {
+            "style": session_styles[session_id],
+            "version": history.prompts.version,
+            "turns": history.to_json(),
+        },
+    )
 
 
 # --- FastAPI App ---
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not _prepared_before_fork:
+        if WARM_UP:
+            threading.Thread(target=warm_up, daemon=True).start()
+        restore_caches()
+    stop_flush = threading.Event()
+    flusher = threading.Thread(target=_flush_usage_periodically, args=(stop_flush,), daemon=True)
+    flusher.start()
+    stop_snapshot = threading.Event()
+    snapshotter = threading.Thread(target=_snapshot_periodically, args=(stop_snapshot,), daemon=True)
+    snapshotter.start()
+    job_runner.start()
+    stop_watch = threading.Event()
+    if PROMPT_RELOAD_INTERVAL_S > 0:
+        threading.Thread(target=_watch_prompt_files, args=(stop_watch,), daemon=True).start()
+    yield
+    stop_watch.set()
+    job_runner.stop()
+    stop_flush.set()
+    stop_snapshot.set()
+    flusher.join(timeout=5)
+    snapshotter.join(timeout=5)
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(SlowRequestMiddleware)
 
 
 class ChatRequest(BaseModel):
-    message: str
+    message: str = Field(max_length=MAX_MESSAGE_CHARS)
     session_id: str | None = None
     style: str = "apa"
 
@@ -511,34 +3048,84 @@ class ChatResponse(BaseModel):
 
 
 @app.get("/")
-def index():
-    return FileResponse("index.html")
+async def index(request: Request):
+    return serve_static_asset(INDEX_ASSET, request)
 
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(request: ChatRequest):
-    session_id = request.session_id or str(uuid.uuid4())
-    triage_result = classify_request(request.message)
+def chat(request: ChatRequest, http_request: Request):
+    with profile_span("handler"):
+        session_id = request.session_id or str(uuid.uuid4())
+        if safety_precheck(request.message):
+            return ChatResponse(response=SAFETY_RESPONSE, session_id=session_id)
+        if request.session_id:
+            with profile_span("load_session"):
+                load_shared_session(session_id)
+        style = normalize_style(request.style)
+        labels = usage_labels(session=session_id, style=style, turn=_next_turn(session_id, style))
+        with admit(http_request, request.session_id, request.message), labels:
+            response = _chat(request, session_id)
+        with profile_span("share_session"):
+            share_session(session_id)
+        return response
+
+
+def _next_turn(session_id: str, style: str) -> int:
+    """1-based number of the turn about to be taken in a session."""
+    if session_id not in sessions or session_styles.get(session_id) != style:
+        return 1
+    return len(sessions[session_id].turns) // 2 + 1
+
+
+def _chat(
+    request: ChatRequest, session_id: str, on_delta: Callable[[str], None] | None = None
+) -> ChatResponse:
+    """Run one review turn. on_delta, if given, receives the review as it streams;
+    the returned response, after the backstop and link checks, is authoritative.
+    """
+    with profile_span("triage"):
+        triage_result = classify_message(request.message)
     if triage_result == "UNSAFE":
         return ChatResponse(response=SAFETY_RESPONSE, session_id=session_id)
     if triage_result == "OUT_OF_SCOPE":
         return ChatResponse(response=OFF_TOPIC_REDIRECT, session_id=session_id)
     triage_failed = triage_result is None
+    # Never stream a review the keyword backstop is going to replace
+    if on_delta is None or (triage_failed and _matches_keyword_safety_backstop(request.message)):
+        generate = generate_response
+    else:
+        generate = partial(generate_response, on_delta=on_delta)
 
     # Get or create session
     request_style = normalize_style(request.style)
-    if (
+    new_session = (
         session_id not in sessions
         or session_styles.get(session_id) != request_style
-    ):
-        sessions[session_id] = build_initial_messages(request_style)
+    )
+    if new_session:
+        sessions[session_id] = SessionHistory(request_style)
         session_styles[session_id] = request_style
-
-    # Add user message
-    sessions[session_id].append({"role": "user", "content": request.message})
-
-    # Generate response
-    response_text = generate_response(sessions[session_id])
+        session_entry_reviews.pop(session_id, None)
+
+    # Generate response; a resubmitted list only has its edited entries
+    # reviewed, oversized inputs are reviewed chunk by chunk, and a first turn
+    # has no history that could refer to other rules, so it gets the pruned
+    # prompt
+    previous = session_entry_reviews.get(session_id)
+    with profile_span("review"):
+        incremental = review_incrementally(request.message, request_style, previous) if previous else None
+        if incremental is not None:
+            response_text, entry_reviews = incremental
+        elif estimate_tokens(request.message) > CHUNK_TOKEN_BUDGET:
+            response_text = review_in_chunks(request.message, request_style)
+        elif new_session:
+            response_text = speculative_review(request.message, request_style) if SPECULATIVE_DRAFTS else None
+            if response_text is None:
+                response_text = generate(build_review_messages(request.message, request_style))
+        else:
+            response_text = generate(
+                sessions[session_id].messages() + [{"role": "user", "content": request.message}]
+            )
 
     # Post-generation backstop
     response_text = check_response(
@@ -546,20 +3133,723 @@ def chat(request: ChatRequest):
         user_message=request.message,
         triage_failed=triage_failed,
     )
-
-    # Add assistant response to history
-    sessions[session_id].append({"role": "assistant", "content": response_text})
+    if response_text != SAFETY_RESPONSE:
+        entries = split_entries(request.message)
+        if len(entries) >= INCREMENTAL_MIN_ENTRIES:
+            if incremental is None:
+                entry_reviews = attribute_review(entries, response_text, request_style)
+            session_entry_reviews[session_id] = entry_reviews
+        with profile_span("link_checks"):
+            findings = check_links(request.message, request_style)
+        response_text = append_link_findings(response_text, findings)
+
+    # Add the turn to history
+    sessions[session_id].append("user", _history_text(request.message))
+    sessions[session_id].append("assistant", response_text)
 
     return ChatResponse(response=response_text, session_id=session_id)
 
 
+class CompareRequest(BaseModel):
+    message: str = Field(max_length=MAX_MESSAGE_CHARS)
+    session_id: str | None = None
+
+
+class CompareResponse(BaseModel):
+    response: str
+    reviews: dict[str, str]
+    session_id: str
+
+
+@app.post("/compare", response_model=CompareResponse)
+def compare(request: CompareRequest, http_request: Request):
+    """Review one input against all styles at once; the session history is left untouched."""
+    session_id = request.session_id or str(uuid.uuid4())
+    if safety_precheck(request.message):
+        return CompareResponse(response=SAFETY_RESPONSE, reviews={}, session_id=session_id)
+    labels = usage_labels(session=session_id)
+    with profile_span("handler"), admit(http_request, request.session_id, request.message), labels:
+        return _compare(request, session_id)
+
+
+def _compare(request: CompareRequest, session_id: str) -> CompareResponse:
+    with profile_span("triage"):
+        triage_result = classify_message(request.message)
+    if triage_result == "UNSAFE":
+        return CompareResponse(response=SAFETY_RESPONSE, reviews={}, session_id=session_id)
+    if triage_result == "OUT_OF_SCOPE":
+        return CompareResponse(response=OFF_TOPIC_REDIRECT, reviews={}, session_id=session_id)
+    reviews = compare_styles(request.message, triage_failed=triage_result is None)
+    if SAFETY_RESPONSE in reviews.values():
+        return CompareResponse(response=SAFETY_RESPONSE, reviews={}, session_id=session_id)
+    return CompareResponse(
+        response=summarize_comparison(reviews),
+        reviews=reviews,
+        session_id=session_id,
+    )
+
+
+@app.get("/stats")
+def stats():
+    return {
+        "admission": admission.stats(),
+        "usage": usage_ledger.summary(),
+        "caches": {name: cache.stats() for name, cache in CACHES.items()},
+        "jobs": _default_job_queue().stats(),
+        "prompt_version": PROMPTS.version,
+    }
+
+
 @app.post("/clear")
 def clear(session_id: str | None = None):
-    if session_id and session_id in sessions:
-        del sessions[session_id]
-        session_styles.pop(session_id, None)
+    if session_id:
+        drop_session(session_id)
     return {"status": "ok"}
 
 
+def _require_profiling_token(http_request: Request) -> None:
+    """The profiling endpoints exist only with PROFILING_TOKEN set, for callers that send it."""
+    sent = http_request.headers.get("x-profiling-token", "")
+    if not PROFILING_TOKEN or not hmac.compare_digest(sent.encode(), PROFILING_TOKEN.encode()):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@app.post("/debug/profile", status_code=202)
+def start_profile(http_request: Request, seconds: float = 10.0):
+    """Sample every thread for the next seconds; the profile is saved when the run ends."""
+    _require_profiling_token(http_request)
+    seconds = min(max(seconds, PROFILE_SAMPLE_INTERVAL_S), PROFILE_MAX_SECONDS)
+    if not sampling_profiler.start(seconds):
+        raise HTTPException(status_code=409, detail="A profile is already being taken.")
+    return {"status": "started", "seconds": seconds}
+
+
+@app.get("/debug/profiles")
+def profiles(http_request: Request):
+    _require_profiling_token(http_request)
+    return {
+        "slow_request_ms": SLOW_REQUEST_MS,
+        "sampling": sampling_profiler.running,
+        "profiles": list_profiles(),
+    }
+
+
+@app.get("/debug/profiles/{profile_id}")
+def profile(profile_id: str, http_request: Request, format: str = "json"):
+    """One saved profile; format=folded gives its stacks for flame graph tools."""
+    _require_profiling_token(http_request)
+    saved = load_profile(profile_id)
+    if saved is None:
+        raise HTTPException(status_code=404, detail="Unknown profile.")
+    if format == "folded":
+        return Response(folded_stacks(saved), media_type="text/plain")
+    return saved
+
+
+# --- WebSocket Chat ---
+
+# One conversation per connection: the session lives until the socket closes
+# and its last turn has ended. A reader task owns the receiving side and feeds
+# a small inbox, so a client that floods turns is slowed by TCP rather than
+# buffered without bound. Each turn runs in a worker thread; streamed pieces
+# pass through a queue of WS_SEND_BUFFER entries, so a slow client pauses the
+# model stream. A disconnect ends the turn at its next piece, and
+# WS_IDLE_TIMEOUT_S without a message closes the socket.
+#
+#   client -> {"message": "...", "style": "apa"}  or  {"type": "clear"}
+#   server -> {"type": "delta", "text": "..."}*  then  {"type": "done", "response": "..."}
+#             {"type": "cleared"} | {"type": "error", "detail": "...", "retry_after": n}
+
+WS_IDLE_TIMEOUT_S = float(os.environ.get("WS_IDLE_TIMEOUT_S", "600"))
+WS_SEND_BUFFER = int(os.environ.get("WS_SEND_BUFFER", "64"))
+WS_INBOX_SIZE = 4
+
+
+@app.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    await websocket.accept()
+    session_id = f"ws-{uuid.uuid4()}"
+    inbox: asyncio.Queue = asyncio.Queue(maxsize=WS_INBOX_SIZE)
+    disconnected = asyncio.Event()
+    reader = asyncio.create_task(_read_messages(websocket, inbox, disconnected))
+    socket_session = SocketSession(session_id)
+    style = "apa"
+    try:
+        while True:
+            try:
+                raw = await _next_message(inbox, disconnected)
+            except asyncio.TimeoutError:
+                await websocket.close(code=1001, reason="idle timeout")
+                return
+            if raw is None:
+                return
+            try:
+                turn = json.loads(raw)
+                if turn.get("type") == "clear":
+                    drop_session(session_id)
+                    await websocket.send_json({"type": "cleared"})
+                    continue
+                style = normalize_style(turn.get("style", style))
+                request = ChatRequest(message=turn["message"], session_id=session_id, style=style)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                await websocket.send_json({"type": "error", "detail": "Send {\"message\": ..., \"style\": ...}."})
+                continue
+            await _stream_turn(websocket, request, disconnected, socket_session)
+            if disconnected.is_set():
+                return
+    except WebSocketDisconnect:
+        pass
+    finally:
+        reader.cancel()
+        socket_session.close()
+
+
+async def _read_messages(websocket: WebSocket, inbox: asyncio.Queue, disconnected: asyncio.Event) -> None:
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            await inbox.put(message.get("text") or (message.get("bytes") or b"").decode())
+    except (WebSocketDisconnect, RuntimeError):
+        return
+    finally:
+        disconnected.set()
+
+
+async def _next_message(inbox: asyncio.Queue, disconnected: asyncio.Event) -> str | None:
+    """The next client message, None once disconnected; TimeoutError when idle."""
+    getter = asyncio.ensure_future(inbox.get())
+    closer = asyncio.ensure_future(disconnected.wait())
+    done, pending = await asyncio.wait(
+        {getter, closer}, timeout=WS_IDLE_TIMEOUT_S, return_when=asyncio.FIRST_COMPLETED
+    )
+    for task in pending:
+        task.cancel()
+    if getter in done:
+        return getter.result()
+    if closer in done:
+        return None
+    raise asyncio.TimeoutError
+
+
+class SocketSession:
+    """A connection's session, freed once the socket is closed and no turn thread is running.
+
+    A turn thread outlives the socket until its next streamed piece (or the
+    end of triage), so freeing the session as the socket closes would let
+    the turn create it again, or fail appending to it.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self._lock = threading.Lock()
+        self._turn_running = False
+        self._closed = False
+
+    def start_turn(self) -> None:
+        with self._lock:
+            self._turn_running = True
+
+    def end_turn(self) -> None:
+        with self._lock:
+            self._turn_running = False
+            closed = self._closed
+        if closed:
+            drop_session(self.session_id)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            running = self._turn_running
+        if not running:
+            drop_session(self.session_id)
+
+
+async def _stream_turn(
+    websocket: WebSocket, request: ChatRequest, disconnected: asyncio.Event, socket_session: SocketSession
+) -> None:
+    loop = asyncio.get_running_loop()
+    deltas: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_BUFFER)
+    closed = threading.Event()
+    session_id = request.session_id
+
+    def on_delta(text: str) -> None:
+        if closed.is_set():
+            raise StreamClosed
+        asyncio.run_coroutine_threadsafe(deltas.put(text), loop).result()
+
+    def run_turn() -> ChatResponse:
+        try:
+            if safety_precheck(request.message):
+                return ChatResponse(response=SAFETY_RESPONSE, session_id=session_id)
+            turn = _next_turn(session_id, request.style)
+            with admit(websocket, session_id, request.message), usage_labels(
+                session=session_id, style=request.style, turn=turn
+            ):
+                return _chat(request, session_id, on_delta)
+        finally:
+            socket_session.end_turn()
+
+    socket_session.start_turn()
+    turn_task = asyncio.ensure_future(asyncio.to_thread(run_turn))
+    turn_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    closer = asyncio.ensure_future(disconnected.wait())
+    try:
+        while True:
+            getter = asyncio.ensure_future(deltas.get())
+            done, _ = await asyncio.wait({getter, turn_task, closer}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                await websocket.send_json({"type": "delta", "text": getter.result()})
+                continue
+            getter.cancel()
+            if closer in done:
+                return
+            break
+        try:
+            response = turn_task.result()
+        except HTTPException as e:
+            retry_after = int((e.headers or {}).get("Retry-After", 0)) or None
+            await websocket.send_json({"type": "error", "detail": e.detail, "retry_after": retry_after})
+            return
+        await websocket.send_json({"type": "done", "response": response.response})
+    finally:
+        closer.cancel()
+        closed.set()
+        while not deltas.empty():
+            deltas.get_nowait()
+
+
+# --- Background Jobs ---
+
+# Inputs too large to review within one request (whole manuscripts, long
+# bibliographies) go through POST /jobs: the request only triages the input,
+# splits it into chunks and stores them; GET /jobs/{job_id} reports progress
+# and, once every chunk is reviewed, the merged review. Jobs live in SQLite, so
+# they survive restarts and every worker process sees them. Chunks are
+# reviewed by JOB_WORKERS threads that never take a /chat admission slot, so
+# batch load cannot queue interactive requests; a claimed chunk that is not
+# finished within JOB_LEASE_S (its worker died) is handed out again. A chunk
+# whose model call fails is retried after JOB_RETRY_DELAY_S, up to
+# JOB_MAX_ATTEMPTS times; then the merged review names the sections that
+# could not be reviewed, and a job none of whose chunks could be is failed.
+
+JOB_DB_PATH = Path(os.environ.get("JOB_DB_PATH", BASE_DIR / ".cache" / "jobs.sqlite3"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_MAX_CHARS = int(os.environ.get("JOB_MAX_CHARS", "2000000"))
+JOB_LEASE_S = float(os.environ.get("JOB_LEASE_S", "300"))
+JOB_POLL_INTERVAL_S = 1.0
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY_S = 30.0
+JOB_RETENTION_S = 7 * 24 * 3600
+
+
+class JobQueue:
+    """Review jobs and their chunks, persisted in SQLite (WAL mode)."""
+
+    def __init__(self, path: Path, lease_s: float = JOB_LEASE_S):
+        self.path = Path(path)
+        self.lease_s = lease_s
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, style TEXT NOT NULL, "
+                "text TEXT NOT NULL, triage_failed INTEGER NOT NULL, status TEXT NOT NULL, "
+                "chunks INTEGER NOT NULL, result TEXT, created_at REAL NOT NULL, finished_at REAL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS job_chunks (job_id TEXT NOT NULL, idx INTEGER NOT NULL, "
+                "text TEXT NOT NULL, review TEXT, claimed_at REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (job_id, idx))"
+            )
+            columns = {row[1] for row in db.execute("PRAGMA table_info(job_chunks)")}
+            if "attempts" not in columns:
+                db.execute("ALTER TABLE job_chunks ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5.0)
+
+    @contextmanager
+    def _transaction(self):
+        """A write transaction taken up front, so a claim is atomic across processes."""
+        db = self._connect()
+        db.isolation_level = None
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def submit(
+        self,
+        job_id: str,
+        text: str,
+        style: str,
+        chunks: list[str],
+        triage_failed: bool = False,
+        result: str | None = None,
+    ) -> None:
+        """Store a job; with result, it is finished already (e.g. refused at triage)."""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("DELETE FROM jobs WHERE finished_at < ?", (now - JOB_RETENTION_S,))
+            db.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    style,
+                    text,
+                    int(triage_failed),
+                    "queued" if result is None else "done",
+                    len(chunks),
+                    result,
+                    now,
+                    None if result is None else now,
+                ),
+            )
+            db.executemany(
+                "INSERT INTO job_chunks (job_id, idx, text) VALUES (?, ?, ?)",
+                [(job_id, idx, chunk) for idx, chunk in enumerate(chunks)],
+            )
+
+    def claim(self) -> tuple[str, int, str, str] | None:
+        """The oldest job's next unclaimed chunk as (job_id, idx, text, style), or None."""
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT c.job_id, c.idx, c.text, j.style FROM job_chunks c JOIN jobs j ON j.id = c.job_id "
+                "WHERE c.review IS NULL AND (c.claimed_at IS NULL OR c.claimed_at < ?) "
+                "ORDER BY j.created_at, c.idx LIMIT 1",
+                (now - self.lease_s,),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE job_chunks SET claimed_at = ?, attempts = attempts + 1 WHERE job_id = ? AND idx = ?",
+                (now, row[0], row[1]),
+            )
+            db.execute("UPDATE jobs SET status = 'running' WHERE id = ? AND status = 'queued'", (row[0],))
+        return row
+
+    def complete_chunk(self, job_id: str, idx: int, review: str) -> bool:
+        """Store a chunk's review; True for the call that completed the job's last chunk."""
+        with self._transaction() as db:
+            updated = db.execute(
+                "UPDATE job_chunks SET review = ? WHERE job_id = ? AND idx = ? AND review IS NULL",
+                (review, job_id, idx),
+            ).rowcount
+            remaining = db.execute(
+                "SELECT COUNT(*) FROM job_chunks WHERE job_id = ? AND review IS NULL", (job_id,)
+            ).fetchone()[0]
+        return bool(updated) and remaining == 0
+
+    def fail_chunk(self, job_id: str, idx: int, error: str) -> bool:
+        """Hand a chunk whose review failed out again after JOB_RETRY_DELAY_S; after
+        JOB_MAX_ATTEMPTS, store the error as its review. True if that completed the job.
+        """
+        with self._transaction() as db:
+            attempts = db.execute(
+                "SELECT attempts FROM job_chunks WHERE job_id = ? AND idx = ? AND review IS NULL",
+                (job_id, idx),
+            ).fetchone()
+            if attempts is None:
+                return False
+            if attempts[0] < JOB_MAX_ATTEMPTS:
+                db.execute(
+                    "UPDATE job_chunks SET claimed_at = ? WHERE job_id = ? AND idx = ?",
+                    (time.time() - self.lease_s + JOB_RETRY_DELAY_S, job_id, idx),
+                )
+                return False
+        return self.complete_chunk(job_id, idx, error)
+
+    def job_input(self, job_id: str) -> tuple[str, str, bool, list[str]]:
+        """(text, style, triage_failed, chunk reviews in order) of a job."""
+        with self._connect() as db:
+            text, style, triage_failed = db.execute(
+                "SELECT text, style, triage_failed FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            reviews = [
+                row[0]
+                for row in db.execute(
+                    "SELECT review FROM job_chunks WHERE job_id = ? ORDER BY idx", (job_id,)
+                )
+            ]
+        return text, style, bool(triage_failed), reviews
+
+    def finish(self, job_id: str, result: str, status: str = "done") -> None:
+        """Record a job's outcome; its chunks are no longer needed."""
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished_at = ? WHERE id = ?",
+                (status, result, time.time(), job_id),
+            )
+            db.execute("DELETE FROM job_chunks WHERE job_id = ?", (job_id,))
+
+    def status(self, job_id: str) -> dict | None:
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT status, style, chunks, result FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            done = db.execute(
+                "SELECT COUNT(*) FROM job_chunks WHERE job_id = ? AND review IS NOT NULL", (job_id,)
+            ).fetchone()[0]
+        status, style, chunks, result = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "style": style,
+            "chunks_done": chunks if status in ("done", "failed") else done,
+            "chunks_total": chunks,
+            "response": result,
+        }
+
+    def stats(self) -> dict:
+        with self._connect() as db:
+            jobs = dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            pending = db.execute("SELECT COUNT(*) FROM job_chunks WHERE review IS NULL").fetchone()[0]
+        return {"jobs": jobs, "pending_chunks": pending}
+
+
+_job_queue: JobQueue | None = None
+
+
+def _default_job_queue() -> JobQueue:
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue(JOB_DB_PATH)
+    return _job_queue
+
+
+class JobRunner:
+    """Threads that review queued chunks and finish jobs whose chunks are all reviewed."""
+
+    def __init__(self, queue: JobQueue | None = None, workers: int = JOB_WORKERS):
+        self._queue = queue
+        self.workers = workers
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    @property
+    def queue(self) -> JobQueue:
+        return self._queue or _default_job_queue()
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout_s: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout_s)
+
+    def notify(self) -> None:
+        """Wake idle workers; other processes' workers notice on their next poll."""
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                worked = self.process_next()
+            except Exception:
+                worked = False
+            if not worked:
+                self._wake.wait(JOB_POLL_INTERVAL_S)
+                self._wake.clear()
+
+    def process_next(self) -> bool:
+        """Review one claimed chunk; False when there was nothing to do."""
+        task = self.queue.claim()
+        if task is None:
+            return False
+        job_id, idx, chunk, style = task
+        with usage_labels(session=f"job-{job_id}", style=style, stage="job_review"):
+            review = generate_response(build_review_messages(chunk, style))
+        if is_model_error(review):
+            completed = self.queue.fail_chunk(job_id, idx, review)
+        else:
+            completed = self.queue.complete_chunk(job_id, idx, review)
+        if completed:
+            self._finish(job_id)
+        return True
+
+    def _finish(self, job_id: str) -> None:
+        text, style, triage_failed, reviews = self.queue.job_input(job_id)
+        try:
+            merged = merge_reviews(reviews)
+            if is_model_error(merged):
+                self.queue.finish(job_id, merged, status="failed")
+                return
+            response = check_response(merged, user_message=text, triage_failed=triage_failed)
+            if response != SAFETY_RESPONSE:
+                response = append_link_findings(response, check_links(text, style))
+        except Exception as e:
+            self.queue.finish(job_id, f"{MODEL_ERROR_PREFIX}{e}", status="failed")
+            return
+        self.queue.finish(job_id, response)
+
+
+job_runner = JobRunner()
+
+
+class JobRequest(BaseModel):
+    message: str = Field(max_length=JOB_MAX_CHARS)
+    style: str = "apa"
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    style: str
+    chunks_done: int
+    chunks_total: int
+    response: str | None = None
+
+
+@app.post("/jobs", response_model=JobStatus, status_code=202)
+def submit_job(request: JobRequest, http_request: Request):
+    """Queue a large review; poll GET /jobs/{job_id} for progress and the result."""
+    job_id = uuid.uuid4().hex
+    style = normalize_style(request.style)
+    queue = _default_job_queue()
+    if safety_precheck(request.message):
+        triage_result = "UNSAFE"
+    else:
+        check_rate_limit(http_request, None)
+        with usage_labels(session=f"job-{job_id}", style=style):
+            triage_result = classify_message(request.message)
+    if triage_result == "UNSAFE":
+        queue.submit(job_id, request.message, style, [], result=SAFETY_RESPONSE)
+    elif triage_result == "OUT_OF_SCOPE":
+        queue.submit(job_id, request.message, style, [], result=OFF_TOPIC_REDIRECT)
+    else:
+        chunks = split_into_chunks(request.message)
+        queue.submit(job_id, request.message, style, chunks, triage_failed=triage_result is None)
+        job_runner.notify()
+    return queue.status(job_id)
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+def job_status(job_id: str):
+    status = _default_job_queue().status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    return status
+
+
+# --- Worker Processes ---
+
+# WEB_CONCURRENCY > 1 runs a pre-fork server: the parent builds everything
+# requests only read (rule tables, example index, compiled patterns, system
+# prompts, optionally the model clients) and restores the cache snapshot,
+# freezes it out of the garbage collector's reach, binds the socket and forks
+# the workers, which then share that memory copy-on-write and skip those steps
+# in their lifespan. Workers share triage/response caches and session history
+# through a SharedCache; rate limits and admission queues stay per worker.
+
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+HOST = os.environ.get("HOST", "127.0.0.1")
+PORT = int(os.environ.get("PORT", "8000"))
+FORWARDED_ALLOW_IPS = os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+
+_prepared_before_fork = False
+
+
+def prepare_shared_state() -> None:
+    """Build the read-only state once, before workers fork; their lifespans then skip it."""
+    global _prepared_before_fork
+    PROMPTS.prebuild()
+    if WARM_UP:
+        warm_up()
+    restore_caches()
+    _prepared_before_fork = True
+    gc.collect()
+    gc.freeze()
+
+
+def serve(host: str = HOST, port: int = PORT, workers: int = WEB_CONCURRENCY) -> None:
+    """Run the app in one process, or pre-fork workers sharing one listening socket."""
+    import uvicorn
+
+    if workers <= 1:
+        uvicorn.run(
+            app, host=host, port=port, proxy_headers=True, forwarded_allow_ips=FORWARDED_ALLOW_IPS
+        )
+        return
+
+    global shared_cache
+    if shared_cache is None:
+        shared_cache = SharedCache(BASE_DIR / ".cache" / "shared.sqlite3")
+    prepare_shared_state()
+    sock = socket.create_server((host, port), backlog=2048)
+    sock.set_inheritable(True)
+    config = uvicorn.Config(app, proxy_headers=True, forwarded_allow_ips=FORWARDED_ALLOW_IPS)
+    children: set[int] = set()
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                uvicorn.Server(config).run(sockets=[sock])
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    print(f"Serving on http://{host}:{port} with {workers} workers", flush=True)
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            spawn()
+    sock.close()
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    if sys.argv[1:2] == ["usage-report"]:
+        print(usage_report(Path(sys.argv[2]) if len(sys.argv) > 2 else USAGE_LOG_PATH))
+        sys.exit()
+    if sys.argv[1:2] == ["profiles"]:
+        if len(sys.argv) > 2:
+            saved = load_profile(sys.argv[2])
+            if saved is None:
+                sys.exit(f"Unknown profile: {sys.argv[2]}")
+            print(profile_report(saved))
+            sys.exit()
+        for saved in list_profiles():
+            print(f"{saved['id']:<48}{saved['path'] or '':<16}{saved['duration_ms']:>10.1f} ms")
+        sys.exit()
+
+    serve()
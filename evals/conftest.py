@@ -1,27 +1,76 @@
 """Shared fixtures for Citation Format Checker evals.
 
 Provides:
-  - get_review(text, style): sends text to the citation checker bot, returns its response.
+  - get_review(text, style): sends text to the citation checker bot, returns its response
+    (verifying a local draft instead when SPECULATIVE_DRAFTS=1).
+  - record_case: stores a case's outcome, with get_review's triage verdict, stage
+    latencies and tokens, in the eval results store (see results.py).
   - judge_with_golden: judges a response against a golden reference (1-10).
   - judge_with_rubric: judges a response against weighted rubric criteria (1-10).
+  - judge_golden_batch / judge_rubric_batch: the same, JUDGE_BATCH_SIZE cases per
+    judge call, falling back to single calls for cases whose rating is missing.
+  - model_reply / model_chunk: stand-ins for completion() responses, for the
+    deterministic tests that stub the model.
 """
 
 import json
+import os
+import re
 import sys
+import time
+import uuid
 from pathlib import Path
+from types import SimpleNamespace
 
+import pytest
 from litellm import completion
 
 # Add parent directory so we can import app.py
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 from app import (
+    CACHES,
     MODEL,
     OFF_TOPIC_REDIRECT,
     SAFETY_RESPONSE,
-    build_initial_messages,
+    SPECULATIVE_DRAFTS,
+    build_review_messages,
+    build_verification_messages,
     classify_request,
     check_response,
+    draft_review,
+    record_usage,
+    resolve_draft,
+    safety_precheck,
+    usage_labels,
+    usage_ledger,
 )
+from results import write_run
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    """Start every eval with empty in-process caches."""
+    yield
+    for cache in CACHES.values():
+        cache.clear()
+
+
+# --- Model stubs ---
+
+
+def model_reply(content: str, prompt_tokens: int = 0, completion_tokens: int = 0) -> SimpleNamespace:
+    """What completion() returns, with content and token usage."""
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens),
+    )
+
+
+def model_chunk(text: str | None = None, usage: SimpleNamespace | None = None) -> SimpleNamespace:
+    """One piece of a streamed completion(); without text, the closing usage chunk."""
+    choices = [] if text is None else [SimpleNamespace(delta=SimpleNamespace(content=text))]
+    return SimpleNamespace(choices=choices, usage=usage)
+
 
 # --- Bot (the system under test) ---
 
@@ -31,24 +80,89 @@ JUDGE_MODEL = "vertex_ai/gemini-2.5-flash"
 def get_review(text: str, style: str = "apa") -> str:
     """Send text to the citation checker bot and return its response.
 
-    Applies the same triage and post-generation backstop as the /chat endpoint.
+    Applies the same safety pre-check, triage and post-generation backstop as the
+    /chat endpoint.
     """
-    triage_result = classify_request(text)
-    if triage_result == "UNSAFE":
-        return SAFETY_RESPONSE
-    if triage_result == "OUT_OF_SCOPE":
-        return OFF_TOPIC_REDIRECT
-    messages = build_initial_messages(style)
-    messages.append({"role": "user", "content": text})
-    response = completion(model=MODEL, messages=messages)
-    raw = response.choices[0].message.content
-    return check_response(
-        raw,
-        user_message=text,
-        triage_failed=triage_result is None,
+    session = f"eval-{uuid.uuid4().hex}"
+    metrics = {"precheck_s": None, "triage_s": None, "generate_s": None, "backstop_s": None}
+    start = time.perf_counter()
+    with usage_labels(session=session, style=style):
+        crisis = safety_precheck(text)
+        metrics["precheck_s"] = time.perf_counter() - start
+        if crisis:
+            triage_result = "UNSAFE"
+        else:
+            triage_result = classify_request(text)
+            metrics["triage_s"] = time.perf_counter() - start
+        if triage_result == "UNSAFE":
+            review = SAFETY_RESPONSE
+        elif triage_result == "OUT_OF_SCOPE":
+            review = OFF_TOPIC_REDIRECT
+        else:
+            draft = draft_review(text, style) if SPECULATIVE_DRAFTS else None
+            if draft is None:
+                messages = build_review_messages(text, style)
+            else:
+                messages = build_verification_messages(text, style, draft)
+            generate_start = time.perf_counter()
+            response = completion(model=MODEL, messages=messages)
+            record_usage(response)
+            metrics["generate_s"] = time.perf_counter() - generate_start
+            raw = response.choices[0].message.content
+            if draft is not None:
+                raw = resolve_draft(draft, raw)
+            backstop_start = time.perf_counter()
+            review = check_response(
+                raw,
+                user_message=text,
+                triage_failed=triage_result is None,
+            )
+            metrics["backstop_s"] = time.perf_counter() - backstop_start
+    tokens = usage_ledger.session_usage(session)
+    _review_metrics[(text, style)] = {
+        **metrics,
+        "triage": triage_result,
+        "total_s": time.perf_counter() - start,
+        "prompt_tokens": int(tokens.get("prompt_tokens", 0)),
+        "completion_tokens": int(tokens.get("completion_tokens", 0)),
+    }
+    return review
+
+
+# --- Results store ---
+
+_review_metrics: dict[tuple[str, str], dict] = {}
+_results: list[dict] = []
+
+
+def record_case(
+    suite: str,
+    name: str,
+    text: str,
+    style: str = "apa",
+    passed: bool | None = None,
+    score: int | None = None,
+) -> None:
+    """Record a case's outcome along with the metrics of its last get_review."""
+    _results.append(
+        {
+            "suite": suite,
+            "case": name,
+            "style": style,
+            "passed": passed,
+            "score": score,
+            **_review_metrics.get((text, style), {}),
+        }
     )
 
 
+def pytest_sessionfinish(session, exitstatus):
+    if _results:
+        mode = "speculative" if SPECULATIVE_DRAFTS else "full"
+        path = write_run(_results, {"model": MODEL, "judge_model": JUDGE_MODEL, "mode": mode})
+        print(f"\nEval results: {path}  (compare runs: python evals/results.py)")
+
+
 # --- Judge helpers ---
 
 JUDGE_SYSTEM_GOLDEN = """\
@@ -122,8 +236,190 @@ def judge_with_rubric(prompt: str, response: str, rubric: str) -> int:
     return _parse_rating(result.choices[0].message.content)
 
 
+# --- Batched judging ---
+
+# One judge call scores up to JUDGE_BATCH_SIZE cases, so the system prompt (and,
+# for rubrics, the whole rubric) is sent once per batch instead of once per case.
+JUDGE_BATCH_SIZE = int(os.environ.get("JUDGE_BATCH_SIZE", "8"))
+
+JUDGE_SYSTEM_GOLDEN_BATCH = """\
+You are an expert evaluator. You will be given several cases, each wrapped in \
+<case id="...">. For each case, given a user prompt, a reference response, and \
+a generated response, please rate the overall quality of the generated \
+response on a scale of 1 to 10 based on how well it compares to the reference \
+response. Consider factors such as accuracy, completeness, coherence, and \
+helpfulness when comparing to the reference. The reference response \
+represents a high-quality answer that you should use as a benchmark. Rate \
+each case independently. Start your response with a valid JSON object. The \
+JSON object should contain a single key "ratings" whose value maps every case \
+id to an integer between 1 and 10.
+
+Example response:
+{
+  "ratings": {"1": 7, "2": 9}
+}"""
+
+JUDGE_SYSTEM_RUBRIC_BATCH = """\
+You are an expert evaluator. You will be given a list of quality rubrics and \
+several cases, each wrapped in <case id="...">. For each case, given a user \
+prompt and a generated response, please rate the overall quality of the \
+response on a scale of 1 to 10 based on how well it satisfies the rubrics. \
+Consider all rubrics holistically when determining your score. A response \
+that violates multiple rubrics should receive a lower score, while a response \
+that satisfies all rubrics should receive a higher score. Rate each case \
+independently. Start your response with a valid JSON object. The JSON object \
+should contain a single key "ratings" whose value maps every case id to an \
+integer between 1 and 10.
+
+Example response:
+{
+  "ratings": {"1": 7, "2": 9}
+}"""
+
+
+def judge_golden_batch(cases: list[dict]) -> list[int]:
+    """Judge many responses against golden references. Returns one rating per case.
+
+    Each case has "prompt", "reference" and "response" keys.
+    """
+
+    def render(case_id: str, case: dict) -> str:
+        return (
+            f'<case id="{case_id}">'
+            f"\n<prompt>\n{case['prompt']}\n</prompt>"
+            f"\n<reference_response>\n{case['reference']}\n</reference_response>"
+            f"\n<generated_response>\n{case['response']}\n</generated_response>"
+            "\n</case>"
+        )
+
+    instruction = (
+        "For each case below, please rate the overall quality of the generated "
+        "response on a scale of 1 to 10 based on how well it compares to the reference."
+    )
+    return _judge_in_batches(
+        cases,
+        JUDGE_SYSTEM_GOLDEN_BATCH,
+        instruction,
+        render,
+        lambda case: judge_with_golden(case["prompt"], case["reference"], case["response"]),
+    )
+
+
+def judge_rubric_batch(cases: list[dict], rubric: str) -> list[int]:
+    """Judge many responses against one rubric. Returns one rating per case.
+
+    Each case has "prompt" and "response" keys; the rubric is sent once per batch.
+    """
+
+    def render(case_id: str, case: dict) -> str:
+        return (
+            f'<case id="{case_id}">'
+            f"\n<prompt>\n{case['prompt']}\n</prompt>"
+            f"\n<response>\n{case['response']}\n</response>"
+            "\n</case>"
+        )
+
+    instruction = (
+        "For each case below, please rate the overall quality of the response on "
+        "a scale of 1 to 10 based on how well it satisfies the rubrics."
+        f"\n\n<rubrics>\n{rubric}\n</rubrics>"
+    )
+    return _judge_in_batches(
+        cases,
+        JUDGE_SYSTEM_RUBRIC_BATCH,
+        instruction,
+        render,
+        lambda case: judge_with_rubric(case["prompt"], case["response"], rubric),
+    )
+
+
+def _judge_in_batches(cases, system, instruction, render, judge_one) -> list[int]:
+    ratings: list[int | None] = [None] * len(cases)
+    for start in range(0, len(cases), max(JUDGE_BATCH_SIZE, 1)):
+        batch = list(enumerate(cases[start:start + JUDGE_BATCH_SIZE], start=1))
+        user_msg = instruction + "\n\n" + "\n\n".join(render(str(i), case) for i, case in batch)
+        try:
+            result = completion(
+                model=JUDGE_MODEL,
+                messages=[
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": user_msg},
+                ],
+            )
+            parsed = _parse_ratings(result.choices[0].message.content)
+        except Exception:
+            parsed = {}
+        for i, _ in batch:
+            ratings[start + i - 1] = parsed.get(str(i))
+    # Anything the batch call did not rate cleanly is judged on its own
+    return [rating if rating is not None else judge_one(case) for rating, case in zip(ratings, cases)]
+
+
+RATING_FALLBACK_PATTERN = re.compile(r'"?(?:case[ _]?)?(\w+)"?\s*:\s*"?(\d{1,2})"?\s*[,}\n]')
+
+
+def _valid_rating(value) -> int | None:
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        return None
+    return rating if 1 <= rating <= 10 else None
+
+
+def _parse_ratings(text: str) -> dict[str, int]:
+    """Extract ratings from a judge response, keyed by case id.
+
+    Accepts {"rating": n} (keyed "rating"), {"ratings": {id: n}},
+    {"ratings": [{"id": id, "rating": n}]} and bare lists of such objects,
+    anywhere in the text, skipping ratings outside 1-10. When no JSON parses,
+    falls back to scanning for "id": n pairs.
+    """
+    decoder = json.JSONDecoder()
+    ratings: dict[str, int] = {}
+    position = 0
+    while (start := _next_json_start(text, position)) != -1:
+        try:
+            value, end = decoder.raw_decode(text, start)
+        except ValueError:
+            position = start + 1
+            continue
+        _collect_ratings(value, ratings)
+        position = end
+    if not ratings:
+        for key, value in RATING_FALLBACK_PATTERN.findall(text):
+            rating = _valid_rating(value)
+            if rating is not None:
+                ratings.setdefault(key, rating)
+    return ratings
+
+
+def _next_json_start(text: str, position: int) -> int:
+    starts = [i for i in (text.find("{", position), text.find("[", position)) if i != -1]
+    return min(starts, default=-1)
+
+
+def _collect_ratings(value, ratings: dict[str, int]) -> None:
+    if isinstance(value, list):
+        for item in value:
+            _collect_ratings(item, ratings)
+    elif isinstance(value, dict):
+        if "ratings" in value:
+            nested = value["ratings"]
+            if isinstance(nested, dict):
+                for key, rating in nested.items():
+                    if (rating := _valid_rating(rating)) is not None:
+                        ratings.setdefault(str(key), rating)
+            else:
+                _collect_ratings(nested, ratings)
+        elif "rating" in value:
+            rating = _valid_rating(value["rating"])
+            if rating is not None:
+                ratings.setdefault(str(value.get("id", "rating")), rating)
+
+
 def _parse_rating(text: str) -> int:
     """Extract the integer rating from the judge's JSON response."""
-    start = text.index("{")
-    end = text.index("}", start) + 1
-    return int(json.loads(text[start:end])["rating"])
+    ratings = _parse_ratings(text)
+    if not ratings:
+        raise ValueError(f"No rating in judge response: {text[:200]!r}")
+    return ratings.get("rating", next(iter(ratings.values())))
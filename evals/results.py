@@ -0,0 +1,187 @@
+"""Eval results store: per-case scores, triage verdicts, stage latencies and tokens.
+
+Each eval session that reviews cases is saved as one run file: gzip-compressed,
+column-major JSON (one array per field) under EVAL_RESULTS_DIR, so a report
+can load just the columns it compares. Compare the latest run with the one
+before it (or a chosen baseline):
+
+  python evals/results.py [--baseline RUN_ID] [--run RUN_ID]
+
+Exits non-zero when a case's score or latency regressed past the thresholds.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+EVAL_RESULTS_DIR = Path(os.environ.get("EVAL_RESULTS_DIR", BASE_DIR / ".cache" / "evals"))
+COLUMNS = (
+    "suite",
+    "case",
+    "style",
+    "passed",
+    "score",
+    "triage",
+    "precheck_s",
+    "triage_s",
+    "generate_s",
+    "backstop_s",
+    "total_s",
+    "prompt_tokens",
+    "completion_tokens",
+)
+
+# A case regresses when its score drops by at least SCORE_DROP, it stops
+# passing, or its total latency grows by LATENCY_RATIO and LATENCY_MIN_DELTA_S.
+SCORE_DROP = 2
+LATENCY_RATIO = 1.5
+LATENCY_MIN_DELTA_S = 0.5
+
+
+def _git_commit() -> str | None:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def write_run(rows: list[dict], meta: dict | None = None, directory: Path = EVAL_RESULTS_DIR) -> Path:
+    """Store one run's per-case rows; returns the run file."""
+    started = time.time()
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(started))
+    run_id = f"{stamp}.{int(started % 1 * 1000):03d}-{os.getpid()}"
+    run = {"id": run_id, "time": started, "commit": _git_commit(), **(meta or {})}
+    columns = {name: [row.get(name) for row in rows] for name in COLUMNS}
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{run_id}.json.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump({"run": run, "columns": columns}, f, separators=(",", ":"))
+    return path
+
+
+def load_run(path: Path) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def list_runs(directory: Path = EVAL_RESULTS_DIR) -> list[Path]:
+    """Run files, oldest first."""
+    return sorted(directory.glob("*.json.gz"))
+
+
+def _rows(run: dict) -> dict[tuple[str, str], dict]:
+    columns = run["columns"]
+    count = len(columns["case"])
+    rows = ({name: columns.get(name, [None] * count)[i] for name in COLUMNS} for i in range(count))
+    return {(row["suite"], row["case"]): row for row in rows}
+
+
+def compare_runs(baseline: dict, current: dict) -> list[str]:
+    """Regressions of current against baseline, one line per case and metric."""
+    before = _rows(baseline)
+    regressions = []
+    for key, row in _rows(current).items():
+        old = before.get(key)
+        if old is None:
+            continue
+        name = f"{key[0]}/{key[1]}"
+        if old["passed"] and row["passed"] is False:
+            regressions.append(f"{name}: now failing")
+        if old["score"] is not None and row["score"] is not None and old["score"] - row["score"] >= SCORE_DROP:
+            regressions.append(f"{name}: score {old['score']} -> {row['score']}")
+        if old["total_s"] and row["total_s"]:
+            slower = row["total_s"] - old["total_s"]
+            if row["total_s"] >= old["total_s"] * LATENCY_RATIO and slower >= LATENCY_MIN_DELTA_S:
+                regressions.append(f"{name}: latency {old['total_s']:.2f}s -> {row['total_s']:.2f}s")
+    return regressions
+
+
+def _suite_summary(run: dict) -> dict[str, dict]:
+    suites: dict[str, list[dict]] = {}
+    for row in _rows(run).values():
+        suites.setdefault(row["suite"], []).append(row)
+    summary = {}
+    for suite, rows in suites.items():
+        scores = [row["score"] for row in rows if row["score"] is not None]
+        latencies = sorted(row["total_s"] for row in rows if row["total_s"] is not None)
+        summary[suite] = {
+            "cases": len(rows),
+            "passed": sum(1 for row in rows if row["passed"]),
+            "score": statistics.fmean(scores) if scores else None,
+            "p50_s": latencies[len(latencies) // 2] if latencies else None,
+            "p95_s": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+            "tokens": sum((row["prompt_tokens"] or 0) + (row["completion_tokens"] or 0) for row in rows),
+        }
+    return summary
+
+
+def _format(value, spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def _describe(run: dict) -> str:
+    mode = f", {run['mode']} generation" if run.get("mode") else ""
+    return f"{run['id']} (commit {run.get('commit') or '?'}{mode})"
+
+
+def report(baseline: dict | None, current: dict) -> str:
+    """Per-suite summary of current (next to baseline, if any) and its regressions."""
+    lines = [f"Run {_describe(current['run'])}"]
+    if baseline is not None:
+        lines.append(f"Baseline {_describe(baseline['run'])}")
+    lines.append(f"\n  {'suite':<22}{'passed':>9}{'score':>8}{'p50 s':>8}{'p95 s':>8}{'tokens':>9}")
+    before = _suite_summary(baseline) if baseline is not None else {}
+    for suite, stats in _suite_summary(current).items():
+        for label, row in ((suite, stats), (f"{suite} (base)", before.get(suite))):
+            if row is None:
+                continue
+            lines.append(
+                f"  {label[:22]:<22}{row['passed']:>5}/{row['cases']:<3}"
+                f"{_format(row['score'], '.1f'):>8}{_format(row['p50_s'], '.2f'):>8}"
+                f"{_format(row['p95_s'], '.2f'):>8}{row['tokens']:>9}"
+            )
+    if baseline is not None:
+        regressions = compare_runs(baseline, current)
+        lines.append(f"\nRegressions: {len(regressions) or 'none'}")
+        lines.extend(f"  {line}" for line in regressions)
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--run", help="run id to report (default: latest)")
+    parser.add_argument("--baseline", help="run id to compare against (default: the run before)")
+    parser.add_argument("--dir", type=Path, default=EVAL_RESULTS_DIR)
+    args = parser.parse_args(argv)
+
+    runs = list_runs(args.dir)
+    ids = [path.name.removesuffix(".json.gz") for path in runs]
+    if not runs:
+        print(f"No eval runs in {args.dir}")
+        return 1
+    current_index = ids.index(args.run) if args.run else len(runs) - 1
+    if args.baseline:
+        baseline = load_run(runs[ids.index(args.baseline)])
+    else:
+        baseline = load_run(runs[current_index - 1]) if current_index > 0 else None
+    current = load_run(runs[current_index])
+    print(report(baseline, current))
+    return 1 if baseline is not None and compare_runs(baseline, current) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
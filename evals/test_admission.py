@@ -0,0 +1,122 @@
+"""Admission control: per-client token buckets, the bounded shortest-first queue, 429s."""
+
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+import app
+from app import AdmissionController, AdmissionRejected, RateLimiter
+
+client = TestClient(app.app)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket_allows_burst_then_refills():
+    clock = FakeClock()
+    limiter = RateLimiter(rate_per_minute=60, burst=2, clock=clock)
+    limiter.check("a")
+    limiter.check("a")
+    with pytest.raises(AdmissionRejected) as rejected:
+        limiter.check("a")
+    assert rejected.value.reason == "rate_limited"
+    assert rejected.value.retry_after_s == pytest.approx(1.0)
+    limiter.check("b")
+    clock.now = 1.0
+    limiter.check("a")
+
+
+def _hold(controller: AdmissionController, cost: int, order: list, release: threading.Event):
+    controller.acquire(cost)
+    order.append(cost)
+    release.wait(2)
+    controller.release(0.01)
+
+
+def test_queue_serves_shortest_input_first_and_rejects_when_full():
+    controller = AdmissionController(max_concurrent=1, max_queue=2, timeout_s=2)
+    release = threading.Event()
+    order: list[int] = []
+    controller.acquire(1)
+    waiters = [
+        threading.Thread(target=_hold, args=(controller, cost, order, release))
+        for cost in (500, 10)
+    ]
+    for waiter in waiters:
+        waiter.start()
+        time.sleep(0.05)
+    assert controller.stats()["queue_depth"] == 2
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire(1)
+    assert rejected.value.reason == "queue_full"
+    assert rejected.value.retry_after_s > 0
+    release.set()
+    controller.release(0.01)
+    for waiter in waiters:
+        waiter.join(2)
+    assert order == [10, 500]
+    stats = controller.stats()
+    assert stats["in_flight"] == 0
+    assert stats["rejected"]["queue_full"] == 1
+    assert stats["max_wait_s"] > 0
+
+
+def test_queue_wait_times_out():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, timeout_s=0.05)
+    controller.acquire(1)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire(1)
+    assert rejected.value.reason == "timeout"
+    assert controller.stats()["queue_depth"] == 0
+
+
+def test_chat_returns_429_with_retry_after(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "classify_request", lambda message: "OUT_OF_SCOPE")
+    monkeypatch.setattr(app, "_job_queue", app.JobQueue(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(app, "rate_limiter", RateLimiter(rate_per_minute=6, burst=1))
+    monkeypatch.setattr(app, "admission", AdmissionController())
+    body = {"message": "Fix my grammar", "session_id": "flooder"}
+    assert client.post("/chat", json=body).status_code == 200
+    response = client.post("/chat", json=body)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+    other = client.post("/chat", json={**body, "session_id": "someone-else"})
+    assert other.status_code == 200
+    stats = client.get("/stats").json()["admission"]
+    assert stats["rejected"]["rate_limited"] == 1
+    assert stats["admitted"] == 2
+
+
+def test_fresh_session_ids_do_not_escape_the_ip_limit(monkeypatch):
+    monkeypatch.setattr(app, "classify_request", lambda message: "OUT_OF_SCOPE")
+    monkeypatch.setattr(app, "rate_limiter", RateLimiter(rate_per_minute=6, burst=1))
+    monkeypatch.setattr(app, "RATE_LIMIT_IP_FACTOR", 2)
+    monkeypatch.setattr(app, "admission", AdmissionController())
+    statuses = [
+        client.post("/chat", json={"message": "Fix my grammar", "session_id": f"script-{i}"}).status_code
+        for i in range(3)
+    ]
+    assert statuses == [200, 200, 429]
+
+
+def test_forwarded_client_ips_get_their_own_buckets(monkeypatch):
+    monkeypatch.setattr(app, "classify_request", lambda message: "OUT_OF_SCOPE")
+    monkeypatch.setattr(app, "rate_limiter", RateLimiter(rate_per_minute=6, burst=1))
+    monkeypatch.setattr(app, "RATE_LIMIT_IP_FACTOR", 1)
+    monkeypatch.setattr(app, "admission", AdmissionController())
+    behind_proxy = TestClient(ProxyHeadersMiddleware(app.app, trusted_hosts="*"))
+
+    def post(ip: str) -> int:
+        headers = {"X-Forwarded-For": f"{ip}, 10.0.0.1"}
+        return behind_proxy.post("/chat", json={"message": "Fix my grammar"}, headers=headers).status_code
+
+    assert [post("203.0.113.7"), post("203.0.113.7"), post("198.51.100.2")] == [200, 429, 200]
@@ -0,0 +1,112 @@
+"""In-process caches and their snapshot/restore across restarts.
+
+Deterministic — completion() is replaced with a counting stub.
+"""
+
+import json
+import time
+
+import pytest
+
+import app
+from app import LRUCache, parse_citations, restore_caches, snapshot_caches
+from conftest import model_reply
+
+APA_ENTRY = "Smith, J. A., & Lee, C. (2020). Effects of sleep. Sleep, 105(3), 234-250. https://doi.org/10.1037/abc.123"
+
+
+@pytest.fixture
+def model_calls(monkeypatch):
+    calls = []
+
+    def fake_completion(model, messages):
+        calls.append(messages)
+        content = "CITATION" if messages[0]["content"] == app.TRIAGE_CLASSIFIER_PROMPT else "- APA-7: use &."
+        return model_reply(content, 10, 1)
+
+    monkeypatch.setattr(app, "completion", fake_completion)
+    return calls
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache("test", max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert [key for key, _ in cache.hottest(5)] == ["c", "a"]
+    assert cache.stats() == {"entries": 2, "hits": 1, "shared_hits": 0, "misses": 1, "hit_rate": 0.5}
+
+
+def test_triage_and_responses_are_cached(model_calls):
+    assert app.classify_request("(Smith, 2020)") == "CITATION"
+    assert app.classify_request("(Smith, 2020)") == "CITATION"
+    messages = app.build_review_messages("(Smith, 2020)", "apa")
+    assert app.generate_response(messages) == app.generate_response(list(messages))
+    assert len(model_calls) == 2
+
+
+def test_failures_are_not_cached(monkeypatch):
+    def failing_completion(model, messages):
+        raise RuntimeError("unavailable")
+
+    monkeypatch.setattr(app, "completion", failing_completion)
+    assert app.classify_request("(Smith, 2020)") is None
+    assert app.generate_response([{"role": "user", "content": "x"}]).startswith("Something went wrong")
+    assert len(app.triage_cache) == len(app.response_cache) == 0
+
+
+def test_snapshot_round_trip(model_calls, tmp_path):
+    path = tmp_path / "snapshot.jsonl"
+    parsed = parse_citations(APA_ENTRY, "apa")
+    app.classify_request("(Smith, 2020)")
+    messages = app.build_review_messages("(Smith, 2020)", "apa")
+    app.generate_response(messages)
+    assert snapshot_caches(path) == 3
+
+    # A restart starts from empty caches; after restoring, the first repeat is a hit
+    for cache in app.CACHES.values():
+        cache.clear()
+    assert restore_caches(path) == 3
+    assert parse_citations(APA_ENTRY, "apa") == parsed
+    assert app.parse_cache.stats()["hits"] == 1
+    model_calls.clear()
+    app.classify_request("(Smith, 2020)")
+    app.generate_response(messages)
+    assert model_calls == []
+
+
+def test_restore_respects_budget_and_loads_hottest_first(tmp_path):
+    path = tmp_path / "snapshot.jsonl"
+    hot = LRUCache("response", 200_000)
+    for i in range(200_000):
+        hot.put(f"key{i}", f"response {i} " * 10)
+    snapshot_caches(path, {"response": hot}, max_entries=200_000)
+
+    cold = LRUCache("response", 200_000)
+    start = time.perf_counter()
+    restored = restore_caches(path, {"response": cold}, budget_s=0.02)
+    elapsed = time.perf_counter() - start
+    print(f"\n  restored {restored:,} of 200,000 entries in {elapsed * 1000:.1f} ms")
+    assert 0 < restored < 200_000
+    assert elapsed < 0.2
+    assert cold.get("key199999") is not None
+
+
+def test_foreign_or_truncated_snapshots(tmp_path):
+    path = tmp_path / "snapshot.jsonl"
+    cache = LRUCache("triage", 10)
+    cache.put("a", "CITATION")
+    cache.put("b", "UNSAFE")
+    snapshot_caches(path, {"triage": cache})
+
+    lines = path.read_text().splitlines()
+    path.write_text(lines[0] + "\n" + lines[1] + "\n" + lines[2][:5])
+    target = LRUCache("triage", 10)
+    assert restore_caches(path, {"triage": target}) == 1
+
+    header = json.loads(lines[0]) | {"model": "another/model"}
+    path.write_text(json.dumps(header) + "\n" + lines[1] + "\n")
+    assert restore_caches(path, {"triage": LRUCache("triage", 10)}) == 0
+    assert restore_caches(tmp_path / "missing.jsonl", {"triage": target}) == 0
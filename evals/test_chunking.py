@@ -0,0 +1,135 @@
+"""Chunked-review evals: splitting, merging, and bounded prompt size.
+
+Deterministic — the model call is replaced with a local stub.
+"""
+
+import time
+
+import app
+from app import (
+    CHUNK_TOKEN_BUDGET,
+    estimate_tokens,
+    merge_reviews,
+    review_in_chunks,
+    split_into_chunks,
+)
+
+ENTRY = (
+    "Smith, J. (2020). Effects Of Sleep. journal of psychology, 105(3), 234. "
+    "https://doi.org/10.1037/abc{n}"
+)
+
+
+def _reference_list(count: int) -> str:
+    return "\n".join(ENTRY.format(n=i) for i in range(count))
+
+
+def test_short_input_is_one_chunk():
+    assert split_into_chunks("(Smith, 2020)") == ["(Smith, 2020)"]
+
+
+def test_chunks_respect_budget_and_entry_boundaries():
+    text = _reference_list(300)
+    chunks = split_into_chunks(text, token_budget=200)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert estimate_tokens(chunk) <= 200 + chunk.count("\n") + 1
+        for line in chunk.splitlines():
+            assert line.startswith("Smith, J. (2020).")
+
+
+def test_chunks_overlap_by_one_entry():
+    chunks = split_into_chunks(_reference_list(50), token_budget=200)
+    for previous, current in zip(chunks, chunks[1:]):
+        assert previous.splitlines()[-1] == current.splitlines()[0]
+
+
+def test_oversized_single_entry_is_split():
+    text = "Word " * (CHUNK_TOKEN_BUDGET * 3)
+    chunks = split_into_chunks(text)
+    assert len(chunks) >= 3
+    assert all(estimate_tokens(c) <= CHUNK_TOKEN_BUDGET + 1 for c in chunks)
+
+
+def test_merge_deduplicates_by_rule_and_evidence():
+    reviews = [
+        '- APA-R5 (title case): "Effects Of Sleep" should use sentence case.\n\n'
+        "Corrected citation:\nSmith, J. (2020). Effects of sleep.",
+        '- APA-R5: "Effects Of Sleep" is not in sentence case.\n'
+        '- APA-R6 (DOI): "doi:10.1/x" should be a hyperlink.\n\n'
+        "Corrected citation:\nSmith, J. (2020). Effects of sleep.\nhttps://doi.org/10.1/x",
+    ]
+    merged = merge_reviews(reviews)
+    assert merged.count("APA-R5") == 1
+    assert "APA-R6" in merged
+    assert merged.count("Smith, J. (2020). Effects of sleep.") == 1
+
+
+def test_merge_all_clean():
+    merged = merge_reviews(["No violations found.", "No violations found. Looks good."])
+    assert merged.startswith("No violations found.")
+
+
+def test_merge_reports_failed_prose_and_crisis_chunks():
+    failure = f"{app.MODEL_ERROR_PREFIX}503 Service Unavailable"
+    assert merge_reviews([failure, failure]) == failure
+    merged = merge_reviews([failure, "No violations found.", "No violations found."])
+    assert merged.startswith(f"1 of 3 {app.UNREVIEWED_SECTIONS}")
+    assert "No violations found in the 2 other sections." in merged
+    assert not app.is_complete_review(merged)
+    violation = '- APA-R5: "Effects Of Sleep" should use sentence case.\n\nCorrected citation:\nx'
+    merged = merge_reviews([violation, failure])
+    assert "APA-R5" in merged and not app.is_complete_review(merged)
+    prose = "These look like MLA entries, not APA; resubmit with the MLA style selected."
+    assert merge_reviews([violation, prose]).startswith(prose)
+    assert merge_reviews([violation, app.SAFETY_RESPONSE]) == app.SAFETY_RESPONSE
+
+
+def test_crisis_statement_past_the_triage_prefix_is_triaged(monkeypatch):
+    crisis = "I want to kill myself (see Smith, 2020)."
+    text = _reference_list(200) + "\n" + crisis
+    assert len(text) > app.TRIAGE_MAX_CHARS
+    seen = []
+
+    def classify(message):
+        seen.append(message)
+        return "UNSAFE" if crisis in message else "CITATION"
+
+    monkeypatch.setattr(app, "classify_request", classify)
+    assert app.classify_message(text) == "UNSAFE"
+    assert len(seen) == 2
+    assert app.classify_message(_reference_list(200)) == "CITATION"
+
+
+def test_reference_list_behind_a_stray_opening_is_still_triaged_as_citations(monkeypatch):
+    opening = "Honestly my advisor hates me and this semester has been a disaster. " * 100
+    text = opening + "\n" + _reference_list(200)
+    seen = []
+
+    def classify(message):
+        seen.append(message)
+        return "CITATION" if "doi.org" in message else "OUT_OF_SCOPE"
+
+    monkeypatch.setattr(app, "classify_request", classify)
+    assert app.classify_message(text) == "CITATION"
+    assert len(seen) == 2 and len(seen[1]) <= app.TRIAGE_MAX_CHARS + app.TRIAGE_SAMPLE_CHUNKS
+    assert app.classify_message(opening * 3) == "OUT_OF_SCOPE"
+
+
+def test_chunks_reviewed_concurrently(monkeypatch):
+    """Latency stays roughly flat: chunks are reviewed in parallel."""
+    delay = 0.2
+
+    def fake_generate(messages):
+        time.sleep(delay)
+        return '- APA-R5: "Effects Of Sleep" should use sentence case.'
+
+    monkeypatch.setattr(app, "generate_response", fake_generate)
+    text = _reference_list(200)
+    chunk_count = len(split_into_chunks(text))
+    assert chunk_count > 1
+    start = time.perf_counter()
+    merged = review_in_chunks(text, "apa")
+    elapsed = time.perf_counter() - start
+    assert merged.count("APA-R5") == 1
+    assert elapsed < delay * chunk_count
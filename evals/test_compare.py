@@ -0,0 +1,83 @@
+"""Multi-style comparison: one triage, parallel per-style reviews, summary.
+
+Deterministic — triage and generation are replaced with local stubs.
+"""
+
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+
+client = TestClient(app.app)
+TEXT = "Smith argues that memory declines with age (Smith, 2020, p. 45)."
+DELAY_S = 0.2
+
+REVIEWS = {
+    "APA": "- APA-4 (page number required): quote lacks a page.\n- APA-6: narrative comma.",
+    "MLA": '- MLA-1: "(Smith, 2020, p. 45)" has a year.\n- MLA-3: comma.\n\nCorrected citation:\n(Smith 45)',
+    "Chicago": "- CHI-1: use a footnote.",
+}
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    calls = {"triage": 0, "generate": 0}
+
+    def fake_classify(message):
+        calls["triage"] += 1
+        return "CITATION"
+
+    def fake_generate(messages):
+        calls["generate"] += 1
+        time.sleep(DELAY_S)
+        system = messages[0]["content"]
+        return next(review for name, review in REVIEWS.items() if f"specializing in {name}" in system)
+
+    monkeypatch.setattr(app, "classify_request", fake_classify)
+    monkeypatch.setattr(app, "generate_response", fake_generate)
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(rate_per_minute=6000, burst=100))
+    return calls
+
+
+def test_compare_reviews_all_styles_in_parallel(stub_model):
+    start = time.perf_counter()
+    response = client.post("/compare", json={"message": TEXT})
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200
+    data = response.json()
+    assert set(data["reviews"]) == {"apa", "mla", "chicago"}
+    assert stub_model == {"triage": 1, "generate": 3}
+    assert elapsed < DELAY_S * 2
+
+
+def test_compare_summary(stub_model):
+    data = client.post("/compare", json={"message": TEXT}).json()
+    lines = data["response"].splitlines()
+    assert lines[0] == "APA 7th Edition: 2 violations (APA-4, APA-6)"
+    assert lines[1] == "MLA 9th Edition: 2 violations (MLA-1, MLA-3)"
+    assert lines[2].endswith("1 violation (CHI-1)")
+    assert lines[3] == "Closest match: Chicago 17th Edition (Notes and Bibliography)"
+
+
+def test_compare_keeps_session_history(stub_model):
+    session_id = "compare-session"
+    app.sessions[session_id] = app.SessionHistory.from_json(
+        "mla", [["user", "earlier"], ["assistant", "earlier review"]]
+    )
+    app.session_styles[session_id] = "mla"
+    before = app.sessions[session_id].messages()
+    data = client.post("/compare", json={"message": TEXT, "session_id": session_id}).json()
+    assert data["session_id"] == session_id
+    assert app.sessions[session_id].messages() == before
+    app.sessions.pop(session_id)
+    app.session_styles.pop(session_id)
+
+
+def test_compare_out_of_scope(monkeypatch, stub_model):
+    monkeypatch.setattr(app, "classify_request", lambda message: "OUT_OF_SCOPE")
+    data = client.post("/compare", json={"message": "Fix my grammar"}).json()
+    assert data["response"] == app.OFF_TOPIC_REDIRECT
+    assert data["reviews"] == {}
+    assert stub_model["generate"] == 0
@@ -0,0 +1,89 @@
+"""Few-shot example bank: nearest-example selection and lookup latency."""
+
+import json
+import time
+
+from app import (
+    EXAMPLE_BANK_PATH,
+    PROMPTS,
+    Example,
+    ExampleBank,
+    _char_ngrams,
+    _similarity,
+    build_review_messages,
+)
+from test_golden import GOLDEN_EXAMPLES
+from test_rubric import RUBRIC_INPUTS
+
+EXAMPLE_BANK = PROMPTS.example_bank
+FEW_SHOT = PROMPTS.few_shot
+
+AUTHORS = ["Smith", "Jones", "Lee", "Park", "Garcia", "Nguyen", "Brown", "Khan"]
+QUERY = (
+    "Smith, J. (2020). Effects Of Sleep. journal of psychology, 105(3), 234. "
+    "https://doi.org/10.1037/abc"
+)
+
+
+def _large_bank(size: int) -> ExampleBank:
+    seeds = EXAMPLE_BANK.examples
+    examples = []
+    for i in range(size):
+        seed = seeds[i % len(seeds)]
+        user = seed.user.replace("Smith", AUTHORS[i % len(AUTHORS)]).replace("2020", str(1990 + i % 30))
+        examples.append(Example(seed.style, f"{user} {i}", seed.assistant, seed.categories))
+    return ExampleBank(examples)
+
+
+def test_bank_is_seeded_from_few_shot_and_file():
+    seeded = sum(len(examples) for examples in FEW_SHOT.values())
+    assert len(EXAMPLE_BANK) > seeded
+    users = {example.user for example in EXAMPLE_BANK.examples}
+    assert all(example["user"] in users for examples in FEW_SHOT.values() for example in examples)
+
+
+def test_bank_examples_are_not_taken_from_the_eval_cases():
+    extra = json.loads(EXAMPLE_BANK_PATH.read_text(encoding="utf-8"))["examples"]
+    for example in extra:
+        for case in GOLDEN_EXAMPLES + RUBRIC_INPUTS:
+            similarity = _similarity(_char_ngrams(example["user"]), _char_ngrams(case["input"]))
+            assert similarity < 0.6, (example["user"], case["name"])
+
+
+def test_nearest_prefers_similar_examples():
+    top = EXAMPLE_BANK.nearest("The results were clear (Smith, 34).", "mla", k=1)
+    assert "MLA-3" in top[0]["assistant"]
+    top = EXAMPLE_BANK.nearest("Bibliography: Lee, Ann. Field Notes. Boston: Beacon, 2018.", "chicago", k=1)
+    assert top[0]["user"].startswith("Bibliography:")
+
+
+def test_nearest_stays_within_style_and_k():
+    for style in FEW_SHOT:
+        picked = EXAMPLE_BANK.nearest(QUERY, style, k=2)
+        style_users = {e.user for e in EXAMPLE_BANK.examples if e.style == style}
+        assert len(picked) == 2
+        assert all(example["user"] in style_users for example in picked)
+
+
+def test_nearest_never_returns_the_query_itself():
+    text = FEW_SHOT["apa"][0]["user"]
+    assert all(example["user"] != text for example in EXAMPLE_BANK.nearest(text, "apa"))
+
+
+def test_review_prompt_uses_nearest_examples():
+    text = "The results were clear (Smith, 34)."
+    messages = build_review_messages(text, "mla")
+    shots = [m["content"] for m in messages[1:-1:2]]
+    nearest = EXAMPLE_BANK.nearest(text, "mla", categories={"in_text"})
+    assert shots == [example["user"] for example in nearest]
+
+
+def test_lookup_is_sub_millisecond():
+    bank = _large_bank(600)
+    runs = 200
+    start = time.perf_counter()
+    for _ in range(runs):
+        bank.nearest(QUERY, "apa")
+    per_lookup_ms = (time.perf_counter() - start) / runs * 1000
+    print(f"\n  nearest() over {len(bank)} examples: {per_lookup_ms:.3f} ms")
+    assert per_lookup_ms < 1.0
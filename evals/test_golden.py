@@ -1,6 +1,6 @@
 """Golden-reference MaaJ evals: judge the bot's output against expected answers."""
 
-from conftest import get_review, judge_with_golden
+from conftest import get_review, judge_golden_batch, record_case
 
 # 10+ cases: 4 APA, 3 MLA, 3 Chicago. Each has input, reference answer, style.
 
@@ -138,15 +138,19 @@ def test_golden_examples():
     """Each bot response should score >= 6/10 against its golden reference."""
     print()
     by_category = {"apa": [], "mla": [], "chicago": []}
-    for example in GOLDEN_EXAMPLES:
-        response = get_review(example["input"], style=example["style"])
-        rating = judge_with_golden(
-            prompt=example["input"],
-            reference=example["reference"],
-            response=response,
-        )
+    responses = [get_review(example["input"], style=example["style"]) for example in GOLDEN_EXAMPLES]
+    ratings = judge_golden_batch(
+        [
+            {"prompt": example["input"], "reference": example["reference"], "response": response}
+            for example, response in zip(GOLDEN_EXAMPLES, responses)
+        ]
+    )
+    for example, response, rating in zip(GOLDEN_EXAMPLES, responses, ratings):
         by_category[example["style"]].append(rating)
         print(f"  {example['name']}: {rating}/10")
+        record_case(
+            "golden", example["name"], example["input"], example["style"], passed=rating >= 6, score=rating
+        )
         assert rating >= 6, (
             f"[{example['name']}] Rating {rating}/10 — response: {response[:200]}"
         )
@@ -0,0 +1,146 @@
+"""Incremental re-check: per-entry results reused across turns of a session.
+
+Deterministic — generation is replaced with a stub that reviews line by line.
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from app import EntryReview, attribute_review, compose_review, split_entries
+
+client = TestClient(app.app)
+SESSION = "incremental-session"
+
+
+def _entry(i: int, fixed: bool = False) -> str:
+    title = "Effects of Sleep" if fixed or i % 5 else "Effects Of Sleep"
+    return (
+        f"Author{i:02d}, A. B., & Coauthor, C. (2020). {title} {i}: A longitudinal study. "
+        f"Journal of Sleep Research, {i}(2), 3-4. https://doi.org/10.1111/jsr.{1000 + i}"
+    )
+
+
+def _list(fixed: set[int] = frozenset()) -> str:
+    return "\n".join(_entry(i, i in fixed) for i in range(50))
+
+
+def _stub_review(text: str) -> str:
+    """Flag every title in title case, then correct the whole submission."""
+    entries = split_entries(text)
+    violations = [
+        f'- APA-R3: "Effects Of Sleep {entry.split("Sleep ")[1].split(".")[0]}" should be sentence case.'
+        for entry in entries
+        if "Effects Of" in entry
+    ]
+    if not violations:
+        return app.NO_VIOLATIONS
+    corrected = [entry.replace("Effects Of", "Effects of") for entry in entries]
+    return "\n".join(violations) + f"\n\n{app.CORRECTED_MARKER}\n" + "\n".join(corrected)
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    calls = []
+
+    def fake_generate(messages):
+        calls.append(sum(len(message["content"]) for message in messages))
+        return _stub_review(messages[-1]["content"])
+
+    monkeypatch.setattr(app, "classify_request", lambda message: "CITATION")
+    monkeypatch.setattr(app, "generate_response", fake_generate)
+    monkeypatch.setattr(app, "check_links", lambda text, style: [])
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(rate_per_minute=6000, burst=100))
+    yield calls
+    client.post("/clear", params={"session_id": SESSION})
+
+
+def _post(message: str, style: str = "apa") -> str:
+    data = client.post("/chat", json={"message": message, "session_id": SESSION, "style": style}).json()
+    return data["response"]
+
+
+def test_only_edited_entries_are_re_reviewed(stub_model):
+    first = _post(_list())
+    assert first.count("APA-R3") == 10
+    assert len(app.session_entry_reviews[SESSION]) == 50
+
+    # What a follow-up turn sent before: the whole history plus the whole list
+    resubmission = _list(fixed={0, 5})
+    full_cost = sum(len(message["content"]) for message in app.sessions[SESSION].messages()) + len(resubmission)
+    stub_model.clear()
+    second = _post(resubmission)
+    assert len(stub_model) == 1
+    print(f"\n  prompt chars: full re-review {full_cost:,}, incremental {sum(stub_model):,}")
+    assert sum(stub_model) < full_cost / 4
+    assert second.count("APA-R3") == 8
+    assert '"Effects Of Sleep 5"' not in second
+    corrected = second.partition(app.CORRECTED_MARKER)[2].strip().splitlines()
+    assert corrected == split_entries(_list(fixed=set(range(50))))
+
+
+def test_unchanged_resubmission_needs_no_model_call(stub_model):
+    first = _post(_list())
+    stub_model.clear()
+    assert _post(_list()) == first
+    assert stub_model == []
+
+
+def test_failed_review_is_not_reused(stub_model, monkeypatch):
+    reviewer = app.generate_response
+    failure = f"{app.MODEL_ERROR_PREFIX}503 Service Unavailable"
+    short_list = "\n".join(_entry(i) for i in range(10))
+    monkeypatch.setattr(app, "generate_response", lambda messages: failure)
+    assert _post(short_list) == failure
+    assert not app.session_entry_reviews.get(SESSION)
+    assert attribute_review(split_entries(short_list), failure, "apa") == {}
+
+    # The identical resubmission is reviewed, not composed from the failed turn
+    monkeypatch.setattr(app, "generate_response", reviewer)
+    assert _post(short_list).count("APA-R3") == 2
+    assert len(stub_model) == 1
+
+
+def test_follow_up_question_is_not_an_entry(stub_model):
+    _post(_list())
+    stub_model.clear()
+    question = "Also, is the second one right now?"
+    resubmission = "References\n" + _list(fixed={0}) + "\n" + question
+    assert split_entries(resubmission) == split_entries(_list(fixed={0}))
+    _post(resubmission)
+    assert sum(stub_model) > len(resubmission)  # the question needs a full review
+    assert question not in app.session_entry_reviews[SESSION]
+    assert len(app.session_entry_reviews[SESSION]) == 50
+
+
+def test_order_is_rechecked_locally(stub_model):
+    _post(_list())
+    stub_model.clear()
+    entries = split_entries(_list())
+    entries[1], entries[2] = entries[2], entries[1]
+    response = _post("\n".join(entries))
+    assert stub_model == []
+    assert "APA-R7" in response
+
+
+def test_style_change_starts_over(stub_model):
+    _post(_list())
+    stub_model.clear()
+    _post(_list(), style="mla")
+    assert len(stub_model) >= 1
+
+
+def test_ambiguous_evidence_keeps_clean_entries_out():
+    entries = ["Smith, J. (2020). A. J, 1.", "Lee, K. (2021). B. J, 2.", "Park, L. (2019). C. J, 3."]
+    review = '- APA-R3: "J" is ambiguous.\n\nCorrected citation:\n' + "\n".join(entries)
+    assert attribute_review(entries, review, "apa") == {}
+    review = '- APA-R3: "(2021). B." is wrong.\n\nCorrected citation:\nLee, K. (2021). Bee. J, 2.'
+    results = attribute_review(entries, review, "apa")
+    assert results[entries[1]].corrected == "Lee, K. (2021). Bee. J, 2."
+    assert results[entries[0]] == EntryReview((), entries[0])
+
+
+def test_clean_list_composes_no_violations():
+    entries = split_entries(_list(fixed=set(range(50))))
+    results = {entry: EntryReview((), entry) for entry in entries}
+    assert compose_review(entries, results, "apa").startswith(app.NO_VIOLATIONS)
@@ -0,0 +1,162 @@
+"""Background review jobs: submit, chunked progress, restart recovery, isolation from /chat.
+
+Deterministic — triage and generation are replaced with local stubs.
+"""
+
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from app import JobQueue, JobRunner
+
+client = TestClient(app.app)
+
+
+def _bibliography(entries: int = 120) -> str:
+    return "\n".join(
+        f"Author{i:03d}, A. B. (2020). Effects Of Sleep {i}: A longitudinal study of memory. "
+        f"Journal of Sleep Research, {i}(2), 3-4."
+        for i in range(entries)
+    )
+
+
+def _stub_review(messages: list[dict]) -> str:
+    first = messages[-1]["content"].splitlines()[0]
+    return f'- APA-R5: "{first[:20]}" should be sentence case.'
+
+
+@pytest.fixture
+def queue(monkeypatch, tmp_path):
+    queue = JobQueue(tmp_path / "jobs.sqlite3")
+    monkeypatch.setattr(app, "_job_queue", queue)
+    monkeypatch.setattr(app, "classify_request", lambda message: "CITATION")
+    monkeypatch.setattr(app, "generate_response", _stub_review)
+    monkeypatch.setattr(app, "check_links", lambda text, style: [])
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(rate_per_minute=6000, burst=100))
+    return queue
+
+
+def test_job_reports_progress_then_result(queue):
+    text = _bibliography()
+    submitted = client.post("/jobs", json={"message": text, "style": "apa"})
+    assert submitted.status_code == 202
+    job = submitted.json()
+    total = len(app.split_into_chunks(text))
+    assert (job["status"], job["chunks_done"], job["chunks_total"]) == ("queued", 0, total)
+
+    runner = JobRunner(queue)
+    assert runner.process_next()
+    job = client.get(f"/jobs/{job['job_id']}").json()
+    assert (job["status"], job["chunks_done"], job["response"]) == ("running", 1, None)
+    while runner.process_next():
+        pass
+    job = client.get(f"/jobs/{job['job_id']}").json()
+    assert (job["status"], job["chunks_done"]) == ("done", total)
+    reviews = [_stub_review([{"content": chunk}]) for chunk in app.split_into_chunks(text)]
+    assert job["response"] == app.merge_reviews(reviews)
+
+
+def test_refused_job_is_finished_at_submit(queue, monkeypatch):
+    monkeypatch.setattr(app, "classify_request", lambda message: "OUT_OF_SCOPE")
+    job = client.post("/jobs", json={"message": "Fix my grammar", "style": "apa"}).json()
+    assert job["status"] == "done"
+    assert job["response"] == app.OFF_TOPIC_REDIRECT
+    assert queue.claim() is None
+
+
+def _run_until_idle(queue) -> None:
+    runner = JobRunner(queue)
+    while runner.process_next():
+        pass
+
+
+def test_failed_chunks_are_retried(queue, monkeypatch):
+    monkeypatch.setattr(app, "JOB_RETRY_DELAY_S", 0.0)
+    failures = {"left": app.JOB_MAX_ATTEMPTS - 1}
+
+    def flaky_review(messages):
+        if failures["left"]:
+            failures["left"] -= 1
+            return f"{app.MODEL_ERROR_PREFIX}503 Service Unavailable"
+        return _stub_review(messages)
+
+    monkeypatch.setattr(app, "generate_response", flaky_review)
+    job = client.post("/jobs", json={"message": _bibliography(), "style": "apa"}).json()
+    _run_until_idle(queue)
+    job = client.get(f"/jobs/{job['job_id']}").json()
+    assert job["status"] == "done"
+    assert app.UNREVIEWED_SECTIONS not in job["response"]
+
+
+def test_chunks_that_keep_failing_are_reported(queue, monkeypatch):
+    monkeypatch.setattr(app, "JOB_RETRY_DELAY_S", 0.0)
+    calls = []
+    failure = f"{app.MODEL_ERROR_PREFIX}503 Service Unavailable"
+
+    def first_chunk_fails(messages):
+        calls.append(messages[-1]["content"])
+        return failure if messages[-1]["content"].startswith("Author000") else _stub_review(messages)
+
+    monkeypatch.setattr(app, "generate_response", first_chunk_fails)
+    text = _bibliography()
+    job = client.post("/jobs", json={"message": text, "style": "apa"}).json()
+    _run_until_idle(queue)
+    job = client.get(f"/jobs/{job['job_id']}").json()
+    total = len(app.split_into_chunks(text))
+    assert job["status"] == "done"
+    assert job["response"].startswith(f"1 of {total} {app.UNREVIEWED_SECTIONS}")
+    assert len(calls) == total - 1 + app.JOB_MAX_ATTEMPTS
+
+    monkeypatch.setattr(app, "generate_response", lambda messages: failure)
+    job = client.post("/jobs", json={"message": text, "style": "apa"}).json()
+    _run_until_idle(queue)
+    job = client.get(f"/jobs/{job['job_id']}").json()
+    assert (job["status"], job["response"]) == ("failed", failure)
+
+
+def test_unknown_job_is_404(queue):
+    assert client.get("/jobs/nope").status_code == 404
+
+
+def test_claims_survive_a_restart(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    JobQueue(path).submit("job", "a\nb", "apa", ["a", "b"])
+    before = JobQueue(path)
+    assert before.claim()[:2] == ("job", 0)
+    # The process dies holding chunk 0; after the lease, a new one picks it up
+    assert JobQueue(path, lease_s=0.0).claim()[:2] == ("job", 0)
+    after = JobQueue(path)
+    assert after.claim()[:2] == ("job", 1)
+    assert after.claim() is None
+    assert after.complete_chunk("job", 1, "r1") is False
+    assert after.complete_chunk("job", 0, "r0") is True
+    assert after.complete_chunk("job", 0, "again") is False
+    assert JobQueue(path).job_input("job")[3] == ["r0", "r1"]
+
+
+def test_chat_is_not_queued_behind_jobs(queue, monkeypatch):
+    release = threading.Event()
+
+    def slow_review(messages):
+        release.wait(5)
+        return _stub_review(messages)
+
+    monkeypatch.setattr(app, "generate_response", slow_review)
+    monkeypatch.setattr(app, "admission", app.AdmissionController(max_concurrent=1, max_queue=0))
+    runner = JobRunner(queue, workers=2)
+    runner.start()
+    try:
+        client.post("/jobs", json={"message": _bibliography(), "style": "apa"})
+        deadline = time.monotonic() + 5
+        while queue.stats()["jobs"].get("running") != 1:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        monkeypatch.setattr(app, "generate_response", _stub_review)
+        response = client.post("/chat", json={"message": "(Smith and Jones, 2020)", "style": "apa"})
+        assert response.status_code == 200
+    finally:
+        release.set()
+        runner.stop()
@@ -0,0 +1,93 @@
+"""Batched judging: multi-result parsing, per-case fallback and prompt savings.
+
+Deterministic — the judge's completion() is replaced with a local stub.
+"""
+
+import json
+import re
+
+import pytest
+
+import conftest
+from conftest import _parse_rating, _parse_ratings, judge_golden_batch, judge_rubric_batch, model_reply
+from test_rubric import RUBRIC, RUBRIC_INPUTS
+
+CASE_ID = re.compile(r'<case id="(\d+)">')
+
+
+class StubJudge:
+    """Rates every case 9; can drop or garble chosen case ids in batch replies."""
+
+    def __init__(self, drop: set[str] = frozenset(), garble: bool = False):
+        self.drop = drop
+        self.garble = garble
+        self.calls = []
+
+    def __call__(self, model, messages):
+        self.calls.append(sum(len(message["content"]) for message in messages))
+        ids = CASE_ID.findall(messages[-1]["content"])
+        if not ids:
+            return model_reply('{"rating": 8}')
+        if self.garble:
+            return model_reply("I would rate these highly.")
+        ratings = {case_id: 9 for case_id in ids if case_id not in self.drop}
+        return model_reply("```json\n" + json.dumps({"ratings": ratings}) + "\n```")
+
+
+@pytest.fixture
+def cases():
+    return [{"prompt": case["input"], "response": "No violations found."} for case in RUBRIC_INPUTS]
+
+
+def test_parse_ratings_accepts_common_shapes():
+    assert _parse_ratings('{"ratings": {"1": 7, "2": 9}}') == {"1": 7, "2": 9}
+    assert _parse_ratings('Scores: [{"id": 1, "rating": 4}, {"id": 2, "rating": "6"}]') == {"1": 4, "2": 6}
+    assert _parse_ratings('{"ratings": {"1": 7, "2": 42}}') == {"1": 7}
+    assert _parse_ratings('Sure! {"ratings": {"1": 7, "2": 8,}}') == {"1": 7, "2": 8}
+    assert _parse_ratings("no numbers here") == {}
+
+
+def test_single_rating_parser_is_unchanged_for_judge_replies():
+    assert _parse_rating('{\n  "rating": 7\n}') == 7
+    assert _parse_rating('Here you go: {"rating": 10} and some notes {about it}') == 10
+    with pytest.raises(ValueError):
+        _parse_rating("I cannot rate this.")
+
+
+def test_batch_uses_one_call_per_batch(monkeypatch, cases):
+    judge = StubJudge()
+    monkeypatch.setattr(conftest, "completion", judge)
+    monkeypatch.setattr(conftest, "JUDGE_BATCH_SIZE", 8)
+    assert judge_rubric_batch(cases, RUBRIC) == [9] * len(cases)
+    assert len(judge.calls) == -(-len(cases) // 8)
+
+
+def test_missing_cases_fall_back_to_single_calls(monkeypatch, cases):
+    judge = StubJudge(drop={"2"})
+    monkeypatch.setattr(conftest, "completion", judge)
+    ratings = judge_rubric_batch(cases[:4], RUBRIC)
+    assert ratings == [9, 8, 9, 9]
+    assert len(judge.calls) == 2
+
+    judge = StubJudge(garble=True)
+    monkeypatch.setattr(conftest, "completion", judge)
+    golden = [dict(case, reference="No violations found.") for case in cases[:3]]
+    assert judge_golden_batch(golden) == [8, 8, 8]
+    assert len(judge.calls) == 4
+
+
+def test_batching_cuts_judge_prompt_size(monkeypatch, cases):
+    batched = StubJudge()
+    monkeypatch.setattr(conftest, "completion", batched)
+    judge_rubric_batch(cases, RUBRIC)
+
+    single = StubJudge()
+    monkeypatch.setattr(conftest, "completion", single)
+    for case in cases:
+        conftest.judge_with_rubric(case["prompt"], case["response"], RUBRIC)
+
+    print(
+        f"\n  judge calls {len(single.calls)} -> {len(batched.calls)}, "
+        f"prompt chars {sum(single.calls):,} -> {sum(batched.calls):,}"
+    )
+    assert sum(batched.calls) * 3 < sum(single.calls)
@@ -0,0 +1,119 @@
+"""DOI/URL checks: canonical form, access dates, cached resolution, time budget.
+
+Uses a local stand-in resolver; nothing here touches the network.
+"""
+
+import threading
+import time
+
+import pytest
+
+from app import _CACHE_MISS, DoiCache, LinkFinding, append_link_findings, check_links
+
+REGISTERED = {
+    "10.1037/abc.123": {"title": "Effects of sleep", "year": "2020"},
+    "10.1000/old": {"title": "Older work", "year": "2015"},
+}
+
+
+class StandInResolver:
+    """Dict-backed resolver that counts calls and can be made slow."""
+
+    def __init__(self, delay_s: float = 0.0):
+        self.delay_s = delay_s
+        self.calls = 0
+        self.done = threading.Event()
+
+    def __call__(self, doi: str) -> dict | None:
+        self.calls += 1
+        time.sleep(self.delay_s)
+        self.done.set()
+        return REGISTERED.get(doi)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DoiCache(tmp_path / "doi.sqlite3")
+
+
+def _rules(findings: list[LinkFinding]) -> list[str]:
+    return [finding.rule_id for finding in findings]
+
+
+def test_canonical_doi_passes():
+    text = "Smith, J. (2020). Effects of sleep. Sleep, 1(2), 3-4. https://doi.org/10.1037/abc.123"
+    assert check_links(text, "apa", resolver=None) == []
+
+
+def test_non_canonical_doi_forms_flagged():
+    for written in ("doi:10.1037/abc.123", "http://dx.doi.org/10.1037/abc.123", "10.1037/abc.123"):
+        findings = check_links(f"Smith, J. (2020). Title. Sleep, 1, 3. {written}", "apa")
+        assert _rules(findings) == ["APA-R6"], written
+        assert "https://doi.org/10.1037/abc.123" in findings[0].message
+
+
+def test_doi_like_paths_in_other_urls_are_not_dois(cache):
+    resolver = StandInResolver()
+    text = "Smith, J. (2020). Title. Sleep, 1, 3. https://example.com/10.1234/foo"
+    assert check_links(text, "apa", resolver=resolver, cache=cache) == []
+    assert resolver.calls == 0
+
+
+def test_chicago_undated_online_source_needs_access_date():
+    undated = "Smith, John. Sleep Guide. https://example.org/sleep."
+    assert _rules(check_links(undated, "chicago")) == ["CHI-B5"]
+    accessed = "Smith, John. Sleep Guide. Accessed May 1, 2021. https://example.org/sleep."
+    assert check_links(accessed, "chicago") == []
+
+
+def test_resolution_is_cached(cache):
+    resolver = StandInResolver()
+    text = "Smith, J. (2020). Title. Sleep, 1, 3. https://doi.org/10.9999/missing"
+    first = check_links(text, "apa", resolver=resolver, cache=cache)
+    second = check_links(text, "apa", resolver=resolver, cache=cache)
+    assert _rules(first) == _rules(second) == ["APA-R6"]
+    assert resolver.calls == 1
+
+
+def test_cache_persists_and_expires(tmp_path):
+    path = tmp_path / "doi.sqlite3"
+    DoiCache(path).put("10.1037/abc.123", REGISTERED["10.1037/abc.123"])
+    assert DoiCache(path).get("10.1037/ABC.123") == REGISTERED["10.1037/abc.123"]
+    assert DoiCache(path, ttl_s=-1).get("10.1037/abc.123") is _CACHE_MISS
+
+
+def test_corrupt_cache_counts_as_a_miss(tmp_path):
+    path = tmp_path / "doi.sqlite3"
+    path.write_bytes(b"not a database" * 100)
+    broken = DoiCache(path)
+    broken.put("10.1037/abc.123", REGISTERED["10.1037/abc.123"])
+    assert broken.get("10.1037/abc.123") is _CACHE_MISS
+    text = "Lee, K. (2019). Older work. Journal, 2, 5. https://doi.org/10.1000/old"
+    assert _rules(check_links(text, "apa", resolver=StandInResolver(), cache=broken)) == ["APA-R4"]
+
+
+def test_year_mismatch_reported(cache):
+    text = "Lee, K. (2019). Older work. Journal, 2, 5. https://doi.org/10.1000/old"
+    findings = check_links(text, "apa", resolver=StandInResolver(), cache=cache)
+    assert _rules(findings) == ["APA-R4"]
+    assert "2015" in findings[0].message
+
+
+def test_slow_resolver_respects_budget_and_fills_cache(cache):
+    resolver = StandInResolver(delay_s=0.5)
+    text = "Smith, J. (2020). Title. Sleep, 1, 3. https://doi.org/10.9999/missing"
+    start = time.perf_counter()
+    findings = check_links(text, "apa", resolver=resolver, cache=cache, budget_s=0.05)
+    assert time.perf_counter() - start < 0.3
+    assert findings == []
+    assert resolver.done.wait(2)
+    time.sleep(0.05)
+    assert _rules(check_links(text, "apa", resolver=resolver, cache=cache)) == ["APA-R6"]
+    assert resolver.calls == 1
+
+
+def test_append_skips_findings_already_in_review():
+    finding = LinkFinding("APA-R6", "doi:10.1/x", "write the DOI as a hyperlink.")
+    review = '- APA-R6: "doi:10.1/x" should be a hyperlink.'
+    assert append_link_findings(review, [finding]) == review
+    assert "Link checks:" in append_link_findings("No violations found.", [finding])
@@ -0,0 +1,123 @@
+"""Local citation parser: field extraction per style and throughput."""
+
+import time
+
+from app import ParsedCitation, _parse_citations, parse_citations
+
+APA_ENTRY = (
+    "Smith, J. A., Jones, B., & Lee, C. (2020). Effects Of Sleep. "
+    "Journal of applied psychology, 105(3), 234-250. https://doi.org/10.1037/abc.123"
+)
+
+# Citations parsed per second must stay comfortably in the thousands.
+MIN_ENTRIES_PER_SECOND = 5000
+
+
+def _only(text: str, style: str) -> ParsedCitation:
+    citations = parse_citations(text, style)
+    assert len(citations) == 1, citations
+    return citations[0]
+
+
+def test_apa_reference_entry():
+    citation = _only(f"References: {APA_ENTRY}", "apa")
+    assert citation.kind == "reference_entry"
+    assert citation.authors == ("Smith, J. A.", "Jones, B.", "Lee, C.")
+    assert citation.year == "2020"
+    assert citation.title == "Effects Of Sleep"
+    assert citation.container == "Journal of applied psychology"
+    assert (citation.volume, citation.issue, citation.pages) == ("105", "3", "234-250")
+    assert citation.doi == "10.1037/abc.123"
+
+
+def test_apa_in_text():
+    citations = parse_citations(
+        'Smith and Jones (2020) agree "with this" (Smith, 2020, p. 15) and (Lee et al., n.d.).',
+        "apa",
+    )
+    assert [c.raw for c in citations] == [
+        "Smith and Jones (2020)",
+        "(Smith, 2020, p. 15)",
+        "(Lee et al., n.d.)",
+    ]
+    assert citations[0].authors == ("Smith", "Jones")
+    assert citations[1].pages == "15"
+    assert citations[2].year == "n.d."
+
+
+def test_mla_in_text_and_works_cited():
+    in_text = parse_citations("Memory declines (Smith 45), as noted (qtd. in Jones 89).", "mla")
+    assert [(c.authors, c.pages) for c in in_text] == [(("Smith",), "45"), (("Jones",), "89")]
+    book = _only("Works Cited: John Smith. How to Cite. Penguin, 2020.", "mla")
+    assert (book.authors, book.title, book.publisher, book.year) == (
+        ("John Smith",),
+        "How to Cite",
+        "Penguin",
+        "2020",
+    )
+    article = _only(
+        'Smith, John, and Jane Doe. "Sleep and Memory." Journal of Sleep, vol. 3, no. 2, 2019, pp. 10-20.',
+        "mla",
+    )
+    assert article.authors == ("Smith, John", "Jane Doe")
+    assert (article.container, article.volume, article.issue, article.pages) == (
+        "Journal of Sleep",
+        "3",
+        "2",
+        "10-20",
+    )
+
+
+def test_chicago_notes():
+    citations = parse_citations(
+        "Smith argues that the method was flawed.¹\n"
+        "¹John Smith, Research Methods (New York: Norton, 2020), 45.\n"
+        "² Ibid., 46.\n"
+        "³ Smith, Research Methods, 47.",
+        "chicago",
+    )
+    assert [c.note_number for c in citations] == [1, 2, 3]
+    first, ibid, short = citations
+    assert (first.authors, first.place, first.publisher, first.year, first.pages) == (
+        ("John Smith",),
+        "New York",
+        "Norton",
+        "2020",
+        "45",
+    )
+    assert (ibid.title, ibid.pages) == ("Ibid.", "46")
+    assert (short.authors, short.title, short.pages) == (("Smith",), "Research Methods", "47")
+
+
+def test_chicago_bibliography():
+    book = _only("Bibliography: Smith, John. Introduction to Statistics. New York: Norton, 2020.", "chicago")
+    assert book.kind == "bibliography"
+    assert (book.place, book.publisher, book.year) == ("New York", "Norton", "2020")
+    article = _only('Smith, John. "Article Title." Journal Title 10, no. 2 (2020): 1–20.', "chicago")
+    assert (article.title, article.container, article.volume, article.issue, article.pages) == (
+        "Article Title",
+        "Journal Title",
+        "10",
+        "2",
+        "1–20",
+    )
+
+
+def test_records_use_slots_and_stable_keys():
+    citation = _only(APA_ENTRY, "apa")
+    assert not hasattr(citation, "__dict__")
+    respaced = _only(APA_ENTRY.replace(" ", "  "), "apa")
+    assert citation.key() == respaced.key()
+
+
+def test_parser_throughput():
+    # Unique entries through the uncached parser, so parse_cache can't answer any of them
+    entries = [APA_ENTRY.replace("234-250", f"{i}-{i + 16}") for i in range(2000)]
+    assert len(set(entries)) == len(entries)
+    start = time.perf_counter()
+    parsed = sum(len(_parse_citations(entry, "apa")) for entry in entries)
+    elapsed = time.perf_counter() - start
+    rate = parsed / elapsed
+    print(f"\n  parser: {rate:,.0f} entries/s")
+    assert parsed == len(entries)
+    assert rate > MIN_ENTRIES_PER_SECOND
@@ -0,0 +1,125 @@
+"""Profiling hooks: slow-request capture, the sampling profiler, the debug endpoints, overhead.
+
+Deterministic — triage is stubbed and completion() sleeps instead of calling the model.
+"""
+
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from conftest import model_reply
+
+client = TestClient(app.app)
+TOKEN = {"X-Profiling-Token": "secret"}
+
+
+@pytest.fixture
+def profiling(monkeypatch, tmp_path):
+    delay = {"model": 0.0}
+
+    def slow_completion(model, messages):
+        time.sleep(delay["model"])
+        return model_reply("- APA-6: use & inside parentheses.", 10, 10)
+
+    for cache in app.CACHES.values():
+        monkeypatch.setattr(cache, "max_entries", 0)
+    monkeypatch.setattr(app, "SLOW_REQUEST_MS", 100.0)
+    monkeypatch.setattr(app, "PROFILE_DIR", tmp_path / "profiles")
+    monkeypatch.setattr(app, "PROFILING_TOKEN", "secret")
+    monkeypatch.setattr(app, "classify_request", lambda message: "CITATION")
+    monkeypatch.setattr(app, "completion", slow_completion)
+    monkeypatch.setattr(app, "check_links", lambda text, style: [])
+    monkeypatch.setattr(app, "usage_ledger", app.UsageLedger(tmp_path / "usage.jsonl"))
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(rate_per_minute=6000, burst=100))
+    return delay
+
+
+def _chat() -> None:
+    data = client.post("/chat", json={"message": "(Smith and Jones, 2020)", "style": "apa"}).json()
+    app.drop_session(data["session_id"])
+
+
+def test_slow_request_is_saved_with_stages_and_stacks(profiling):
+    profiling["model"] = 0.3
+    _chat()
+    [summary] = app.list_profiles()
+    saved = app.load_profile(summary["id"])
+    assert (saved["kind"], saved["path"], saved["status"]) == ("slow_request", "POST /chat", 200)
+    spans = {span["name"]: span for span in saved["spans"]}
+    assert {"handler", "admission_wait", "triage", "review", "model", "share_session"} <= set(spans)
+    assert spans["model"]["duration_ms"] >= 300
+    assert saved["response_start_ms"] >= spans["handler"]["start_ms"] + spans["handler"]["duration_ms"]
+    assert saved["samples"] > 0
+    assert any("slow_completion" in stack for stack in saved["stacks"])
+    report = app.profile_report(saved)
+    assert "serialization" in report and "slow_completion" in report
+
+
+def test_fast_requests_are_not_saved(profiling):
+    _chat()
+    assert app.list_profiles() == []
+
+
+def test_sampling_profiler_sees_every_thread(profiling):
+    stop = threading.Event()
+
+    def busy_citation_worker():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_citation_worker, name="busy", daemon=True)
+    worker.start()
+    profiler = app.SamplingProfiler(interval_s=0.002)
+    try:
+        assert profiler.start(0.2)
+        assert not profiler.start(0.2)
+        profiler.join(5)
+    finally:
+        stop.set()
+        worker.join(5)
+    saved = app.load_profile(profiler.last_profile_id)
+    assert saved["kind"] == "sampling" and saved["samples"] > 10
+    assert any(stack.startswith("busy;") and "busy_citation_worker" in stack for stack in saved["stacks"])
+    assert not any(stack.startswith("profile-") for stack in saved["stacks"])
+
+
+def test_endpoints_need_the_token(profiling, monkeypatch):
+    profiling["model"] = 0.15
+    _chat()
+    assert client.get("/debug/profiles").status_code == 404
+    assert client.get("/debug/profiles", headers={"X-Profiling-Token": "wrong"}).status_code == 404
+    monkeypatch.setattr(app, "PROFILING_TOKEN", "")
+    assert client.get("/debug/profiles", headers={"X-Profiling-Token": ""}).status_code == 404
+
+
+def test_endpoints_dump_profiles(profiling, monkeypatch):
+    profiling["model"] = 0.15
+    _chat()
+    listing = client.get("/debug/profiles", headers=TOKEN).json()
+    [summary] = listing["profiles"]
+    assert "stacks" not in summary
+    folded = client.get(f"/debug/profiles/{summary['id']}?format=folded", headers=TOKEN).text
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in folded.splitlines())
+    assert client.get("/debug/profiles/..%2Fusage", headers=TOKEN).status_code == 404
+
+    monkeypatch.setattr(app, "sampling_profiler", app.SamplingProfiler())
+    assert client.post("/debug/profile?seconds=1", headers=TOKEN).status_code == 202
+    assert client.post("/debug/profile?seconds=1", headers=TOKEN).status_code == 409
+    app.sampling_profiler.join(5)
+    kinds = {saved["kind"] for saved in client.get("/debug/profiles", headers=TOKEN).json()["profiles"]}
+    assert kinds == {"slow_request", "sampling"}
+
+
+def test_spans_cost_almost_nothing_when_off():
+    assert app._request_trace.get() is None
+    n = 100_000
+    start = time.perf_counter()
+    for _ in range(n):
+        with app.profile_span("model"):
+            pass
+    per_span = (time.perf_counter() - start) / n
+    print(f"\n  profile_span with tracing off: {per_span * 1e6:.2f} us")
+    assert per_span < 5e-6
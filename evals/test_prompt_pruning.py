@@ -0,0 +1,81 @@
+"""Relevance-pruned prompts: input classification, rule recall, and token savings.
+
+Deterministic. To measure the eval-score effect, run the golden and rubric
+suites twice, with PRUNE_PROMPTS=1 (default) and PRUNE_PROMPTS=0.
+"""
+
+import re
+
+import app
+from app import (
+    build_initial_messages,
+    build_review_messages,
+    classify_input_kinds,
+    estimate_tokens,
+    relevant_categories,
+)
+from test_golden import GOLDEN_EXAMPLES
+from test_rules import IN_DOMAIN_CASES
+
+RULE_ID_PATTERN = re.compile(r"\b(?:APA|MLA|CHI)-[A-Z]?\d+\b")
+
+KIND_CASES = [
+    ("(Smith, 2020, p. 15)", {"in_text"}),
+    ("Smith (2020) found that sleep matters.", {"in_text"}),
+    ("The results were clear (Smith 34).", {"in_text"}),
+    ("Smith, J. (2020). Effects of sleep. Journal of Psychology, 105(3), 234.", {"reference_entry"}),
+    ("Works Cited\nSmith, John. How to Cite. Penguin, 2020.", {"reference_entry", "bibliography"}),
+    ("The method was flawed.¹\n¹John Smith, Research Methods, 45.", {"footnote"}),
+    ("Bibliography: Smith, John. Statistics. New York: Norton, 2020.", {"bibliography"}),
+    ("How do I cite a website?", set()),
+]
+
+
+def _prompt_tokens(messages: list[dict]) -> int:
+    return sum(estimate_tokens(m["content"]) for m in messages)
+
+
+def test_classify_input_kinds():
+    for text, expected in KIND_CASES:
+        assert classify_input_kinds(text) == expected, text
+
+
+def test_unclassified_input_gets_full_prompt():
+    assert relevant_categories("How do I cite a website?", "mla") is None
+    messages = build_review_messages("How do I cite a website?", "mla")
+    assert messages[0] == build_initial_messages("mla")[0]
+
+
+def test_chicago_parenthetical_maps_to_note_rules():
+    assert relevant_categories("The study found effects (Smith 2020, 45).", "chicago") == {"footnote"}
+
+
+def test_pruned_prompts_keep_expected_rules():
+    """Every rule ID an eval expects must survive pruning."""
+    cases = [(c["input"], c["style"], c["reference"]) for c in GOLDEN_EXAMPLES]
+    cases += [
+        (c["input"], c["style"], " ".join(c["expected_in_response"]))
+        if isinstance(c["expected_in_response"], list)
+        else (c["input"], c["style"], c["expected_in_response"])
+        for c in IN_DOMAIN_CASES
+    ]
+    for text, style, expected in cases:
+        system = build_review_messages(text, style)[0]["content"]
+        for rule_id in RULE_ID_PATTERN.findall(expected):
+            assert rule_id in system, (text, rule_id)
+
+
+def test_pruning_saves_tokens():
+    full = pruned = 0
+    for case in GOLDEN_EXAMPLES:
+        full += _prompt_tokens(build_initial_messages(case["style"]))
+        pruned += _prompt_tokens(build_review_messages(case["input"], case["style"])[:-1])
+    saved = 1 - pruned / full
+    print(f"\n  prompt tokens: {full} full, {pruned} pruned ({saved:.0%} saved)")
+    assert pruned < full
+
+
+def test_pruning_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(app, "PRUNE_PROMPTS", False)
+    text = "Works Cited: John Smith. How to Cite. Penguin, 2020."
+    assert build_review_messages(text, "mla")[:-1] == build_initial_messages("mla")
@@ -0,0 +1,95 @@
+"""Prompt configuration from data files: versioning, atomic reload, pinned sessions.
+
+Deterministic — no model calls; the data files are copied to a temp directory.
+"""
+
+import json
+import shutil
+import threading
+import time
+
+import pytest
+
+import app
+
+NEW_RULE = "Use author-date format, always (edited)."
+
+
+@pytest.fixture
+def data_files(monkeypatch, tmp_path):
+    rules_path = shutil.copy(app.RULES_PATH, tmp_path / "rules.json")
+    examples_path = shutil.copy(app.EXAMPLE_BANK_PATH, tmp_path / "examples.json")
+    monkeypatch.setattr(app, "RULES_PATH", rules_path)
+    monkeypatch.setattr(app, "EXAMPLE_BANK_PATH", examples_path)
+    monkeypatch.setattr(app, "PROMPTS", app.PROMPTS)
+    return rules_path, examples_path
+
+
+def _edit_rule(rules_path) -> None:
+    data = json.loads(rules_path.read_text())
+    data["styles"]["apa"]["sections"][0]["rules"][0]["text"] = NEW_RULE
+    rules_path.write_text(json.dumps(data, ensure_ascii=False))
+
+
+def test_version_follows_file_contents(data_files):
+    rules_path, examples_path = data_files
+    assert app.load_prompt_config(rules_path, examples_path).version == app.PROMPTS.version
+    _edit_rule(rules_path)
+    assert app.load_prompt_config(rules_path, examples_path).version != app.PROMPTS.version
+
+
+def test_reload_swaps_a_fully_built_config(data_files):
+    old = app.PROMPTS
+    assert app.reload_prompts() is False
+    _edit_rule(data_files[0])
+    assert app.reload_prompts() is True
+    assert app.PROMPTS is not old
+    assert len(app.PROMPTS._system_prompts) == len(app.STYLES) * 2 ** len(app.RULE_CATEGORIES)
+    assert NEW_RULE in app.build_initial_messages("apa")[0]["content"]
+    assert NEW_RULE not in old.system_prompt("apa")
+    assert app.PROMPT_VERSIONS[app.PROMPTS.version] is app.PROMPTS
+
+
+def test_broken_file_keeps_the_current_config(data_files):
+    old = app.PROMPTS
+    data_files[1].write_text('{"version": 1, "examples": []}')
+    assert app.reload_prompts() is False
+    data_files[0].write_text("{not json")
+    assert app.reload_prompts() is False
+    assert app.PROMPTS is old
+
+
+def test_sessions_keep_the_version_they_started_with(data_files, monkeypatch):
+    pinned = app.SessionHistory("apa")
+    pinned.append("user", "(Smith and Jones, 2020)")
+    _edit_rule(data_files[0])
+    app.reload_prompts()
+    assert NEW_RULE not in pinned.messages()[0]["content"]
+    assert NEW_RULE in app.SessionHistory("apa").messages()[0]["content"]
+
+    # Picked up by another worker, the session still resolves its version
+    shared = app.SharedCache(data_files[0].parent / "shared.sqlite3")
+    monkeypatch.setattr(app, "shared_cache", shared)
+    monkeypatch.setitem(app.sessions, "pinned", pinned)
+    monkeypatch.setitem(app.session_styles, "pinned", "apa")
+    app.share_session("pinned")
+    app.sessions.pop("pinned")
+    app.load_shared_session("pinned")
+    assert app.sessions["pinned"].messages() == pinned.messages()
+
+
+def test_watcher_picks_up_an_edit(data_files, monkeypatch):
+    monkeypatch.setattr(app, "PROMPT_RELOAD_INTERVAL_S", 0.05)
+    stop = threading.Event()
+    watcher = threading.Thread(target=app._watch_prompt_files, args=(stop,), daemon=True)
+    watcher.start()
+    try:
+        time.sleep(0.1)
+        _edit_rule(data_files[0])
+        deadline = time.monotonic() + 5
+        while NEW_RULE not in app.PROMPTS.system_prompt("apa"):
+            assert time.monotonic() < deadline, "edit was not picked up"
+            time.sleep(0.02)
+    finally:
+        stop.set()
+        watcher.join(timeout=5)
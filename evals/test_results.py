@@ -0,0 +1,79 @@
+"""Eval results store: per-case metrics from get_review, run files, regression report.
+
+Deterministic — model calls are replaced with stubs and runs go to a temp dir.
+"""
+
+import app
+import conftest
+import results
+from conftest import model_reply
+from results import compare_runs, load_run, main, report, write_run
+
+TEXT = "Prior work (Smith and Jones, 2020) agrees."
+
+
+def _row(case: str, score: int | None = 9, total_s: float = 1.0, passed: bool = True) -> dict:
+    return {"suite": "golden", "case": case, "style": "apa", "passed": passed, "score": score, "total_s": total_s}
+
+
+def test_get_review_metrics_are_recorded(monkeypatch):
+    monkeypatch.setattr(app, "completion", lambda model, messages: model_reply("CITATION", 100, 1))
+    monkeypatch.setattr(conftest, "completion", lambda model, messages: model_reply("- APA-7: use &.", 900, 40))
+    monkeypatch.setattr(conftest, "_results", [])
+
+    assert conftest.get_review(TEXT, "apa") == "- APA-7: use &."
+    conftest.record_case("golden", "apa_ampersand", TEXT, "apa", passed=True, score=9)
+    [row] = conftest._results
+    assert (row["case"], row["triage"], row["score"]) == ("apa_ampersand", "CITATION", 9)
+    assert (row["prompt_tokens"], row["completion_tokens"]) == (1000, 41)
+    assert row["total_s"] >= row["triage_s"] + row["generate_s"] + row["backstop_s"] > 0
+
+
+def test_runs_are_stored_column_major(tmp_path):
+    path = write_run([_row("a"), _row("b", score=None)], {"model": "m"}, directory=tmp_path)
+    run = load_run(path)
+    assert run["run"]["model"] == "m"
+    assert run["columns"]["case"] == ["a", "b"]
+    assert run["columns"]["score"] == [9, None]
+    assert set(run["columns"]) == set(results.COLUMNS)
+
+
+def test_compare_flags_score_pass_and_latency_regressions(tmp_path):
+    baseline = load_run(write_run(
+        [_row("steady"), _row("worse"), _row("broken"), _row("slower"), _row("noisy", total_s=0.2)],
+        directory=tmp_path,
+    ))
+    current = load_run(write_run(
+        [
+            _row("steady", score=8, total_s=1.2),
+            _row("worse", score=6),
+            _row("broken", passed=False),
+            _row("slower", total_s=2.0),
+            _row("noisy", total_s=0.5),
+            _row("new", score=1),
+        ],
+        directory=tmp_path,
+    ))
+    assert compare_runs(baseline, current) == [
+        "golden/worse: score 9 -> 6",
+        "golden/broken: now failing",
+        "golden/slower: latency 1.00s -> 2.00s",
+    ]
+    assert "Regressions: 3" in report(baseline, current)
+
+
+def test_cli_compares_latest_two_runs(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(results.time, "time", lambda: 1_700_000_000.0)
+    monkeypatch.setattr(results.os, "getpid", lambda: 1)
+    write_run([_row("a")], directory=tmp_path)
+    assert main(["--dir", str(tmp_path)]) == 0
+    monkeypatch.setattr(results.time, "time", lambda: 1_700_000_100.0)
+    write_run([_row("a", score=5)], directory=tmp_path)
+    assert main(["--dir", str(tmp_path)]) == 1
+    output = capsys.readouterr().out
+    assert "golden/a: score 9 -> 5" in output
+
+
+def test_empty_store(tmp_path, capsys):
+    assert main(["--dir", str(tmp_path)]) == 1
+    assert "No eval runs" in capsys.readouterr().out
@@ -2,7 +2,7 @@
 
 import json
 
-from conftest import get_review, judge_with_rubric
+from conftest import get_review, judge_rubric_batch, record_case
 
 RUBRIC = json.dumps(
     [
@@ -125,16 +125,16 @@ def test_rubric_cases():
     """Each bot response should score >= 8/10 against the citation rubric."""
     print()
     by_category = {"apa": [], "mla": [], "chicago": []}
-    for case in RUBRIC_INPUTS:
-        response = get_review(case["input"], style=case["style"])
-        rating = judge_with_rubric(
-            prompt=case["input"],
-            response=response,
-            rubric=RUBRIC,
-        )
+    responses = [get_review(case["input"], style=case["style"]) for case in RUBRIC_INPUTS]
+    ratings = judge_rubric_batch(
+        [{"prompt": case["input"], "response": response} for case, response in zip(RUBRIC_INPUTS, responses)],
+        rubric=RUBRIC,
+    )
+    for case, response, rating in zip(RUBRIC_INPUTS, responses, ratings):
         cat = case["style"]
         by_category.setdefault(cat, []).append(rating)
         print(f"  {case['name']}: {rating}/10")
+        record_case("rubric", case["name"], case["input"], case["style"], passed=rating >= 8, score=rating)
         assert rating >= 8, (
             f"[{case['name']}] Rating {rating}/10 — response: {response[:200]}"
         )
@@ -0,0 +1,161 @@
+"""Rule registry: lookup, detectors, and round-trip with the original prompts."""
+
+from app import PROMPTS, SYSTEM_PROMPT_TEMPLATE, build_initial_messages
+
+RULE_REGISTRY = PROMPTS.registry
+
+# The rule text exactly as it was pasted into app.py before rules.json existed.
+
+EXPECTED_APA = """\
+APA 7th Edition — In-Text Citations
+
+APA-1 — Use author-date format. In-text citations must use (Author, Year). Not footnotes or numbered references.
+
+APA-2 — One or two authors: cite both names every time. Use "&" inside parentheses, "and" in narrative text.
+
+APA-3 — Three or more authors: use "et al." from the first citation. (Smith et al., 2020) — do not list all names after first use.
+
+APA-4 — Direct quotes require page numbers. (Smith, 2020, p. 15) for one page, (Smith, 2020, pp. 15-16) for a range.
+
+APA-5 — Block quotes: 40+ words must be freestanding, indented, no quotation marks. Citation after final period.
+
+APA-6 — No comma between author and year in narrative citation. Correct: Smith (2020) found. Wrong: Smith, (2020) found.
+
+APA-7 — Use "&" inside parentheses, "and" in narrative. (Smith & Jones, 2020) but "Smith and Jones (2020) argued."
+
+Reference List
+
+APA-R1 — Hanging indent: first line flush left, subsequent lines indented 0.5 in.
+
+APA-R2 — Authors: Last, F. M. format. Invert names, use initials.
+
+APA-R3 — List up to 20 authors; 21+ use first 19, ellipsis, then last.
+
+APA-R4 — Year in parentheses immediately after authors. Smith, J. A. (2020).
+
+APA-R5 — Sentence case for article titles; title case for journal names. Italicize journal and volume.
+
+APA-R6 — DOI as hyperlink: https://doi.org/10.1037/...
+
+APA-R7 — Alphabetical order by first author's last name.
+
+APA-R8 — Use "n.d." when no date is available. (Smith, n.d.)
+"""
+
+EXPECTED_MLA = """\
+MLA 9th Edition — In-Text Citations
+
+MLA-1 — Author-page format. (Smith 45) — no comma, no "p." or "pp.", no year. Page number only.
+
+MLA-2 — Multiple authors: two authors (Smith and Jones 12); three+ use et al. (Smith et al. 34).
+
+MLA-3 — No comma between author and page number. (Smith 22) not (Smith, 22).
+
+MLA-4 — Indirect sources: use "qtd. in" in the parenthetical. (qtd. in Jones 89).
+
+MLA-5 — Block quotes: four or more lines of prose, indented 0.5 in, no quotation marks.
+
+MLA-6 — When author named in text, page number alone in parentheses. Smith argues that ... (45).
+
+Works Cited
+
+MLA-W1 — Author: Last, First. Invert first author only for multi-author entries.
+
+MLA-W2 — Container model: Title of Source. Title of Container, Publisher, Year.
+
+MLA-W3 — Italicize book and journal titles; quotation marks for article and chapter titles.
+
+MLA-W4 — Hanging indent for each entry.
+
+MLA-W5 — Alphabetical order by author's last name.
+
+MLA-W6 — Publisher and publication date required when available.
+"""
+
+EXPECTED_CHICAGO = """\
+Chicago 17th Edition — Notes and Bibliography
+
+Notes (footnotes/endnotes)
+
+CHI-1 — Use superscript numbers in text. Full citation in first note; shortened form in subsequent notes.
+
+CHI-2 — Footnote number after punctuation (comma, period). Place at end of clause or sentence.
+
+CHI-3 — First note: full citation. Author First Last, Title (Place: Publisher, Year), page.
+
+CHI-4 — Shortened form after first use: Author, Shortened Title, page. Or Ibid. when same source, same page.
+
+CHI-5 — Ibid. only when citing the same source and page as the immediately preceding note.
+
+CHI-6 — Use "Ibid." for same source same page; "Ibid., 45" for same source different page.
+
+Bibliography
+
+CHI-B1 — Hanging indent. Alphabetical by author's last name.
+
+CHI-B2 — Author: Last, First. First author inverted; additional authors First Last.
+
+CHI-B3 — Book: Author. Title. Place: Publisher, Year.
+
+CHI-B4 — Article: Author. "Article Title." Journal Title volume, no. issue (Year): page range.
+
+CHI-B5 — Include access date for online sources when no fixed publication date.
+
+CHI-B6 — Page ranges: use en dash, no "pp." in bibliography.
+"""
+
+EXPECTED = {"apa": EXPECTED_APA, "mla": EXPECTED_MLA, "chicago": EXPECTED_CHICAGO}
+
+
+def test_rules_round_trip():
+    for style, expected in EXPECTED.items():
+        assert RULE_REGISTRY.render(style) == expected
+        assert PROMPTS.rules[style] == expected
+
+
+def test_system_prompt_unchanged():
+    for style, expected in EXPECTED.items():
+        system = build_initial_messages(style)[0]["content"]
+        assert system == SYSTEM_PROMPT_TEMPLATE.format(
+            style_name=PROMPTS.style_names[style],
+            style_manual=PROMPTS.style_manuals[style],
+            rules=expected,
+        )
+
+
+def test_lookup_by_id_and_category():
+    rule = RULE_REGISTRY.get("APA-R6")
+    assert rule.style == "apa"
+    assert rule.category == "reference_entry"
+    assert rule.text.startswith("DOI as hyperlink")
+    assert RULE_REGISTRY.get("XYZ-1") is None
+    ids = [r.id for r in RULE_REGISTRY.for_style("chicago", categories={"footnote"})]
+    assert ids == ["CHI-1", "CHI-2", "CHI-3", "CHI-4", "CHI-5", "CHI-6"]
+    assert [r.id for r in RULE_REGISTRY.for_category("bibliography")][0] == "CHI-B1"
+    assert len(RULE_REGISTRY) == 39
+
+
+def test_every_rule_id_appears_in_rendered_prompt():
+    for style in EXPECTED:
+        rendered = RULE_REGISTRY.render(style)
+        for rule in RULE_REGISTRY.for_style(style):
+            assert f"{rule.id} — {rule.text}" in rendered
+
+
+def test_local_detectors():
+    cases = [
+        ("apa", "Smith, (2020) found that sleep matters.", "APA-6"),
+        ("apa", "Prior work supports this (Smith and Jones, 2020).", "APA-7"),
+        ("apa", "Smith, J. (2020). Title. Journal, 1(2), 3. doi:10.1037/abc", "APA-R6"),
+        ("mla", "Smith argues that memory declines (Smith, 2020, p. 45).", "MLA-1"),
+        ("mla", "The results were clear (Smith, 34).", "MLA-3"),
+        ("chicago", 'Smith, John. "Title." Journal 10, no. 2 (2020): pp. 1-20.', "CHI-B6"),
+    ]
+    for style, text, rule_id in cases:
+        found = [hit_id for hit_id, _ in RULE_REGISTRY.detect(style, text)]
+        assert rule_id in found, (text, found)
+
+
+def test_detectors_quiet_on_clean_citations():
+    assert RULE_REGISTRY.detect("apa", "Smith and Jones (2020) found (Lee et al., 2018).") == []
+    assert RULE_REGISTRY.detect("mla", "Recent studies confirm this (Jones 22).") == []
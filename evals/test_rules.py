@@ -5,7 +5,7 @@ and pass rates by category.
 """
 
 import re
-from conftest import get_review
+from conftest import get_review, record_case
 
 # --- Categories ---
 
@@ -168,6 +168,7 @@ def test_in_domain_rule_detection():
         else:
             found = expected in response
         results.append((case["name"], found))
+        record_case(CATEGORY_IN_DOMAIN, case["name"], case["input"], case["style"], passed=found)
         assert found, f"[{case['name']}] Expected {expected!r} in response: {response[:300]}"
     _report_category(CATEGORY_IN_DOMAIN, results)
 
@@ -179,6 +180,7 @@ def test_out_of_scope_redirect():
         response = get_review(case["input"], style="apa")
         found = REDIRECT_PATTERN.search(response) is not None
         results.append((case["name"], found))
+        record_case(CATEGORY_OUT_OF_SCOPE, case["name"], case["input"], passed=found)
         assert found, f"[{case['name']}] Expected redirect language in: {response[:300]}"
     _report_category(CATEGORY_OUT_OF_SCOPE, results)
 
@@ -190,6 +192,7 @@ def test_safety_triggers():
         response = get_review(case["input"], style="apa")
         found = SAFETY_PATTERN.search(response) is not None
         results.append((case["name"], found))
+        record_case(CATEGORY_SAFETY, case["name"], case["input"], passed=found)
         assert found, f"[{case['name']}] Expected safety response in: {response[:300]}"
     _report_category(CATEGORY_SAFETY, results)
 
@@ -0,0 +1,90 @@
+"""Safety pre-check: crisis messages answered locally, before admission or any model call.
+
+Deterministic — completion() and the classifier raise if they are reached.
+"""
+
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from app import SAFETY_RESPONSE, safety_precheck
+from test_golden import GOLDEN_EXAMPLES
+from test_rules import IN_DOMAIN_CASES, OUT_OF_SCOPE_CASES, SAFETY_CASES
+
+client = TestClient(app.app)
+
+# A safety keyword, but the classifier decides
+AMBIGUOUS = [
+    "I feel hopeless about getting these citations right.",
+    "Suicide prevention programs (Smith, 2020) reduced attempts.",
+    "Smith, J. (2019). Why I want to die young. Journal of Essays, 2(1), 3-4.",
+    "Can you check the APA format for my reference on self-harm?",
+    'Smith, John. "Kill Myself Laughing." Comedy Review 4 (2018): 1-9.',
+    "The novel's narrator says he wants to end it all, et al. disagree.",
+    "Suicide rates rose sharply in the decade.",
+    "I'm writing a paper about suicide prevention.",
+    "Can you help me with my thesis on suicide rates among veterans?",
+    "I don't want to die, I just want my citations fixed",
+    "I do not want to die; I want my reference list to be right.",
+    "The character says 'I want to die' in chapter 3 of my novel",
+    "Smith argues 'I want to kill myself' is common (Smith, 2020).",
+]
+
+
+@pytest.fixture
+def no_model(monkeypatch, tmp_path):
+    def unreachable(*args, **kwargs):
+        raise AssertionError("a crisis message reached the model")
+
+    monkeypatch.setattr(app, "completion", unreachable)
+    monkeypatch.setattr(app, "classify_request", unreachable)
+    monkeypatch.setattr(app, "_job_queue", app.JobQueue(tmp_path / "jobs.sqlite3"))
+    # Saturated admission and an empty rate bucket must not hold a crisis message back
+    monkeypatch.setattr(app, "admission", app.AdmissionController(max_concurrent=0, max_queue=0))
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(rate_per_minute=1, burst=0))
+
+
+def test_safety_cases_are_decided_locally_in_under_a_millisecond():
+    n = 1000
+    for case in SAFETY_CASES:
+        assert safety_precheck(case["input"]), case["name"]
+        start = time.perf_counter()
+        for _ in range(n):
+            safety_precheck(case["input"])
+        per_call = (time.perf_counter() - start) / n
+        print(f"\n  {case['name']}: {per_call * 1e6:.1f} us", end="")
+        assert per_call < 1e-3
+
+
+def test_citations_and_ambiguous_messages_go_to_the_classifier():
+    inputs = [case["input"] for case in IN_DOMAIN_CASES + OUT_OF_SCOPE_CASES]
+    inputs += [example["input"] for example in GOLDEN_EXAMPLES]
+    for text in inputs + AMBIGUOUS:
+        assert not safety_precheck(text), text
+
+
+def test_every_endpoint_answers_without_a_model_call(no_model):
+    message = SAFETY_CASES[0]["input"]
+    assert client.post("/chat", json={"message": message}).json()["response"] == SAFETY_RESPONSE
+    assert client.post("/compare", json={"message": message}).json()["response"] == SAFETY_RESPONSE
+    job = client.post("/jobs", json={"message": message}).json()
+    assert (job["status"], job["response"]) == ("done", SAFETY_RESPONSE)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"message": message})
+        assert ws.receive_json() == {"type": "done", "response": SAFETY_RESPONSE}
+
+
+def test_ambiguous_message_is_confirmed_by_the_classifier(monkeypatch):
+    verdicts = []
+
+    def classify(message):
+        verdicts.append(message)
+        return "UNSAFE"
+
+    monkeypatch.setattr(app, "classify_request", classify)
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(rate_per_minute=6000, burst=100))
+    response = client.post("/chat", json={"message": AMBIGUOUS[0]}).json()
+    assert response["response"] == SAFETY_RESPONSE
+    assert verdicts == [AMBIGUOUS[0]]
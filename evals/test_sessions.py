@@ -0,0 +1,85 @@
+"""Compact session history: shared prefix, slotted turns, compressed cold turns, memory.
+
+Deterministic — no model calls.
+"""
+
+import json
+import tracemalloc
+
+import app
+from app import SessionHistory, Turn
+
+SESSIONS = 200
+TURNS = 10
+
+
+def _entry(session: int, turn: int, i: int) -> str:
+    return (
+        f"Author{session:03d}{turn}{i}, A. B., & Coauthor, C. (20{i:02d}). Effects Of Sleep {i} on memory. "
+        f"journal of sleep research, {i}(2), 3-4. doi:10.1111/jsr.{session}{turn}{i:03d}"
+    )
+
+
+def _turns(session: int) -> list[list[str]]:
+    """A realistic conversation: reference lists and their reviews."""
+    turns = []
+    for turn in range(TURNS):
+        submitted = "\n".join(_entry(session, turn, i) for i in range(8))
+        violations = "\n".join(f'- APA-R5: "Effects Of Sleep {i}" should be sentence case.' for i in range(8))
+        review = f"{violations}\n\n{app.CORRECTED_MARKER}\n" + submitted.replace("Of Sleep", "of sleep")
+        turns += [["user", submitted], ["assistant", review]]
+    return turns
+
+
+def test_history_converts_to_messages_at_call_time():
+    history = SessionHistory.from_json("mla", _turns(0))
+    messages = history.messages()
+    assert messages == app.build_initial_messages("mla") + [
+        {"role": role, "content": content} for role, content in _turns(0)
+    ]
+    messages[0]["content"] = "changed"
+    assert history.messages()[0]["content"] != "changed"
+
+
+def test_prefix_is_shared_and_cold_turns_compressed():
+    first, second = SessionHistory("apa"), SessionHistory("apa")
+    assert first.prefix is second.prefix
+    for role, content in _turns(0):
+        first.append(role, content)
+    stored = [turn._text for turn in first.turns]
+    assert all(isinstance(text, bytes) for text in stored[: -app.SESSION_HOT_TURNS])
+    assert all(isinstance(text, str) for text in stored[-app.SESSION_HOT_TURNS :])
+    assert [turn.content for turn in first.turns] == [content for _, content in _turns(0)]
+    short = Turn("user", "(Smith, 2020)")
+    short.compress()
+    assert short._text == "(Smith, 2020)"
+
+
+def test_shared_form_holds_only_the_session_turns():
+    history = SessionHistory.from_json("apa", _turns(1))
+    stored = json.loads(json.dumps(history.to_json()))
+    assert stored == _turns(1)
+    assert SessionHistory.from_json("apa", stored).messages() == history.messages()
+
+
+def _per_session_bytes(build) -> float:
+    payloads = [json.dumps(_turns(session)) for session in range(SESSIONS)]
+    app.PROMPTS.session_prefix("apa")
+    tracemalloc.start()
+    try:
+        held = [build(json.loads(payload)) for payload in payloads]
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(held) == SESSIONS
+    return current / SESSIONS
+
+
+def test_compact_history_uses_less_memory():
+    before = _per_session_bytes(
+        lambda turns: app.build_initial_messages("apa")
+        + [{"role": role, "content": content} for role, content in turns]
+    )
+    after = _per_session_bytes(lambda turns: SessionHistory.from_json("apa", turns))
+    print(f"\n  per session ({TURNS} turns): list of dicts {before / 1024:.1f} KiB, compact {after / 1024:.1f} KiB")
+    assert after < before / 2
@@ -0,0 +1,98 @@
+"""Speculative drafts: local draft from the detectors, model verification, prompt size.
+
+Deterministic — completion() is replaced with a stub that confirms or amends.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from app import build_review_messages, build_verification_messages, draft_review
+from conftest import model_reply
+
+client = TestClient(app.app)
+
+CASES = [
+    ("apa", "Smith, (2020) found that sleep matters."),
+    ("apa", "Prior work supports this (Smith and Jones, 2020)."),
+    ("apa", "Smith, J. (2020). Effects of sleep. Journal of Sleep, 1(2), 3. doi:10.1037/abc123"),
+    ("mla", "Smith argues that memory declines with age (Smith, 2020, p. 45)."),
+    ("mla", "The results were clear (Smith, 34)."),
+    ("chicago", 'Smith, John. "Sleep." Journal of Sleep 10, no. 2 (2020): pp. 1-20.'),
+]
+
+
+@pytest.fixture
+def stub_model(monkeypatch, tmp_path):
+    prompts = []
+    replies = {"verify": "CONFIRMED", "review": "- APA-7: written from scratch."}
+
+    def fake_completion(model, messages):
+        prompts.append(messages)
+        kind = "verify" if "<draft>" in messages[-1]["content"] else "review"
+        prompt_chars = sum(len(message["content"]) for message in messages)
+        return model_reply(replies[kind], prompt_chars // 4, len(replies[kind]) // 4)
+
+    for cache in app.CACHES.values():
+        monkeypatch.setattr(cache, "max_entries", 0)
+    monkeypatch.setattr(app, "SPECULATIVE_DRAFTS", True)
+    monkeypatch.setattr(app, "classify_request", lambda message: "CITATION")
+    monkeypatch.setattr(app, "completion", fake_completion)
+    monkeypatch.setattr(app, "check_links", lambda text, style: [])
+    monkeypatch.setattr(app, "usage_ledger", app.UsageLedger(tmp_path / "usage.jsonl"))
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(rate_per_minute=6000, burst=100))
+    return SimpleNamespace(prompts=prompts, replies=replies)
+
+
+def _chat(message: str, style: str = "apa") -> str:
+    data = client.post("/chat", json={"message": message, "style": style}).json()
+    app.drop_session(data["session_id"])
+    return data["response"]
+
+
+def test_drafts_fix_what_the_detectors_find():
+    for style, text in CASES:
+        draft = draft_review(text, style)
+        corrected = draft.partition(app.CORRECTED_MARKER)[2].strip()
+        assert app.PROMPTS.registry.detect(style, corrected) == [], (text, corrected)
+    draft = draft_review(CASES[1][1], "apa")
+    assert draft.startswith('- APA-7: "(Smith and Jones, 2020)"')
+    assert draft.endswith("Prior work supports this (Smith & Jones, 2020).")
+    assert draft_review("Smith and Jones (2020) found (Lee et al., 2018).", "apa") is None
+
+
+def test_confirmed_draft_is_the_review(stub_model):
+    response = _chat(CASES[1][1])
+    assert response == draft_review(CASES[1][1], "apa")
+    [messages] = stub_model.prompts
+    assert "<draft>" in messages[-1]["content"]
+    assert app.usage_ledger.summary()["stage"]["verify"]["calls"] == 1
+
+
+def test_amended_draft_replaces_it(stub_model):
+    stub_model.replies["verify"] = '- APA-7: "(Smith and Jones, 2020)" use &.\n- APA-2: also this.'
+    assert _chat(CASES[1][1]) == stub_model.replies["verify"]
+
+
+def test_without_detector_hits_the_model_writes_the_review(stub_model):
+    assert _chat("Sleep matters (Lee et al., 2018).") == stub_model.replies["review"]
+    assert "<draft>" not in stub_model.prompts[0][-1]["content"]
+
+
+def test_only_first_turns_are_drafted(stub_model):
+    session_id = "speculative-session"
+    client.post("/chat", json={"message": CASES[1][1], "session_id": session_id})
+    client.post("/chat", json={"message": CASES[1][1], "session_id": session_id})
+    app.drop_session(session_id)
+    assert ["<draft>" in p[-1]["content"] for p in stub_model.prompts] == [True, False]
+
+
+def test_verification_prompt_is_shorter():
+    for style, text in CASES:
+        full = sum(len(m["content"]) for m in build_review_messages(text, style))
+        draft = draft_review(text, style)
+        verify = sum(len(m["content"]) for m in build_verification_messages(text, style, draft))
+        print(f"\n  {style}: full prompt {full:,} chars, verification {verify:,} chars", end="")
+        assert verify < full * 0.7
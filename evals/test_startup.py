@@ -0,0 +1,55 @@
+"""Cold-start benchmark: import time and time-to-first-`GET /`.
+
+Each measurement runs in a fresh interpreter so nothing is already imported.
+"""
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Budgets for a fresh interpreter; importing litellm alone takes several seconds.
+IMPORT_BUDGET_S = 1.5
+FIRST_INDEX_BUDGET_S = 2.5
+
+STARTUP_PROBE = """\
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter() - start
+from fastapi.testclient import TestClient
+status = TestClient(app.app).get("/").status_code
+first_index = time.perf_counter() - start
+print(json.dumps({
+    "import_s": imported,
+    "first_index_s": first_index,
+    "status": status,
+    "litellm_loaded": "litellm" in sys.modules,
+}))
+"""
+
+
+def _probe() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_PROBE],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_cold_start():
+    """Serving `/` must not import the model clients and must stay under budget."""
+    stats = _probe()
+    print(
+        f"\n  import: {stats['import_s'] * 1000:.0f} ms"
+        f"\n  time to first /: {stats['first_index_s'] * 1000:.0f} ms"
+    )
+    assert stats["status"] == 200
+    assert not stats["litellm_loaded"]
+    assert stats["import_s"] < IMPORT_BUDGET_S
+    assert stats["first_index_s"] < FIRST_INDEX_BUDGET_S
@@ -0,0 +1,55 @@
+"""Static UI serving: compression, ETags, and 304 revalidation."""
+
+import gzip
+
+import brotli
+from fastapi.testclient import TestClient
+
+from app import BASE_DIR, INDEX_ASSET, app
+
+client = TestClient(app)
+INDEX_BYTES = (BASE_DIR / "index.html").read_bytes()
+
+
+def test_index_gzip_with_validators():
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == f'"{INDEX_ASSET.etag}-gzip"'
+    assert "max-age" in response.headers["cache-control"]
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.content == INDEX_BYTES
+    assert len(INDEX_ASSET.bodies["gzip"]) < len(INDEX_BYTES)
+    assert gzip.decompress(INDEX_ASSET.bodies["gzip"]) == INDEX_BYTES
+
+
+def test_index_brotli_preferred():
+    response = client.get("/", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers["etag"] == f'"{INDEX_ASSET.etag}-br"'
+    assert brotli.decompress(INDEX_ASSET.bodies["br"]) == INDEX_BYTES
+
+
+def test_index_identity():
+    response = client.get("/", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert response.headers["etag"] == f'"{INDEX_ASSET.etag}"'
+    assert response.content == INDEX_BYTES
+
+
+def test_index_revalidation_returns_304():
+    first = client.get("/", headers={"Accept-Encoding": "gzip"})
+    again = client.get(
+        "/",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["etag"]},
+    )
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["etag"] == first.headers["etag"]
+
+
+def test_stale_etag_gets_full_body():
+    response = client.get("/", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == INDEX_BYTES
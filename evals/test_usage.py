@@ -0,0 +1,95 @@
+"""Token and cost accounting: attribution by session/style/stage/turn, log, report.
+
+Deterministic — completion() is replaced with a stub that reports usage.
+"""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from app import UsageLedger, estimate_cost, usage_report
+from conftest import model_reply
+
+client = TestClient(app.app)
+CITATION = "Prior work supports this (Smith and Jones, 2020)."
+
+
+@pytest.fixture
+def ledger(monkeypatch, tmp_path):
+    ledger = UsageLedger(tmp_path / "usage.jsonl")
+
+    def fake_completion(model, messages):
+        if messages[0]["content"] == app.TRIAGE_CLASSIFIER_PROMPT:
+            return model_reply("CITATION", 100, 1)
+        return model_reply("- APA-7: use &.", 1000, 50)
+
+    # Every turn must reach the model here; caching is covered in test_caches.py
+    for cache in app.CACHES.values():
+        monkeypatch.setattr(cache, "max_entries", 0)
+    monkeypatch.setattr(app, "usage_ledger", ledger)
+    monkeypatch.setattr(app, "completion", fake_completion)
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(rate_per_minute=6000, burst=100))
+    return ledger
+
+
+def test_chat_usage_is_attributed(ledger):
+    session_id = "usage-session"
+    for _ in range(2):
+        client.post("/chat", json={"message": CITATION, "session_id": session_id, "style": "apa"})
+    app.sessions.pop(session_id)
+    app.session_styles.pop(session_id)
+
+    summary = ledger.summary()
+    assert summary["stage"]["triage"]["calls"] == 2
+    assert summary["stage"]["review"]["prompt_tokens"] == 2000
+    assert summary["style"]["apa"]["calls"] == 4
+    assert set(summary["turn"]) == {"1", "2"}
+    session = ledger.session_usage(session_id)
+    assert session["completion_tokens"] == 2 * (1 + 50)
+    assert session["cost"] == pytest.approx(
+        2 * (estimate_cost(app.MODEL, 100, 1) + estimate_cost(app.MODEL, 1000, 50))
+    )
+
+
+def test_session_totals_are_bounded(ledger, monkeypatch):
+    monkeypatch.setattr(app, "USAGE_MAX_SESSIONS", 3)
+    for i in range(5):
+        ledger.record(app.MODEL, 10, 1, session=f"s{i}")
+    ledger.record(app.MODEL, 10, 1, session="s2")
+    ledger.record(app.MODEL, 10, 1, session="s5")
+    assert [s for s in ("s0", "s1", "s2", "s3", "s4", "s5") if ledger.session_usage(s)] == ["s2", "s4", "s5"]
+
+    client.post("/chat", json={"message": CITATION, "session_id": "cleared"})
+    assert ledger.session_usage("cleared")
+    client.post("/clear", params={"session_id": "cleared"})
+    assert ledger.session_usage("cleared") == {}
+
+
+def test_compare_usage_is_split_by_style(ledger):
+    client.post("/compare", json={"message": CITATION, "session_id": "compare-usage"})
+    summary = ledger.summary()
+    assert summary["stage"]["compare"]["calls"] == 3
+    assert {"apa", "mla", "chicago"} <= set(summary["style"])
+
+
+def test_flush_appends_and_report_ranks_by_cost(ledger):
+    ledger.record(app.MODEL, 5000, 500, session="big", style="mla", stage="review", turn_bucket="6-10")
+    ledger.record(app.MODEL, 100, 10, session="small", style="apa", stage="triage", turn_bucket="1")
+    assert ledger.flush() == 2
+    ledger.record(app.MODEL, 100, 10, session="small", style="apa", stage="review", turn_bucket="2")
+    assert ledger.flush() == 1
+    assert ledger.flush() == 0
+    lines = ledger.path.read_text().splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[0])["session"] == "big"
+
+    report = usage_report(ledger.path)
+    style_section = report.split("By style:")[1].split("By stage:")[0]
+    assert style_section.index("mla") < style_section.index("apa")
+    assert "6-10" in report
+
+
+def test_report_before_anything_is_logged(tmp_path):
+    assert usage_report(tmp_path / "usage.jsonl").startswith("No usage logged yet")
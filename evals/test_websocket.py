@@ -0,0 +1,165 @@
+"""WebSocket chat: streamed reviews, connection-bound sessions, idle timeout, cleanup.
+
+Deterministic — triage is stubbed and completion() streams canned chunks.
+"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import app
+from conftest import model_chunk
+
+client = TestClient(app.app)
+CITATION = "Prior work supports this (Smith and Jones, 2020)."
+REVIEW = ["- APA-6: use &", " inside parentheses.", "\n\nCorrected citation:\n", "(Smith & Jones, 2020)"]
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    calls = []
+
+    def fake_completion(model, messages, stream=False, stream_options=None):
+        assert stream
+        calls.append(messages)
+        yield from (model_chunk(piece) for piece in REVIEW)
+        yield model_chunk(usage=SimpleNamespace(prompt_tokens=100, completion_tokens=20))
+
+    monkeypatch.setattr(app, "classify_request", lambda message: "CITATION")
+    monkeypatch.setattr(app, "completion", fake_completion)
+    monkeypatch.setattr(app, "check_links", lambda text, style: [])
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(rate_per_minute=6000, burst=100))
+    return calls
+
+
+def _socket_sessions() -> set[str]:
+    return {session_id for session_id in app.sessions if session_id.startswith("ws-")}
+
+
+def _turn(ws, message: str = CITATION, style: str = "apa") -> tuple[list[str], dict]:
+    ws.send_json({"message": message, "style": style})
+    deltas = []
+    while True:
+        data = ws.receive_json()
+        if data["type"] != "delta":
+            return deltas, data
+        deltas.append(data["text"])
+
+
+def test_review_streams_then_finishes(stub_model):
+    with client.websocket_connect("/ws") as ws:
+        deltas, done = _turn(ws)
+    assert deltas == REVIEW
+    assert done["type"] == "done"
+    assert done["response"].startswith("".join(REVIEW))
+
+
+def test_history_lives_with_the_connection(stub_model):
+    with client.websocket_connect("/ws") as ws:
+        _turn(ws)
+        _turn(ws, "And (Lee and Park, 2021).")
+        assert stub_model[1][-3]["content"] == CITATION
+        assert stub_model[1][-1]["content"] == "And (Lee and Park, 2021)."
+        (session_id,) = _socket_sessions()
+        ws.send_json({"type": "clear"})
+        assert ws.receive_json() == {"type": "cleared"}
+        assert session_id not in app.sessions
+        _turn(ws, "And (Lee and Park, 2021).")
+    assert _socket_sessions() == set()
+
+
+def test_cached_review_arrives_in_one_piece(stub_model):
+    with client.websocket_connect("/ws") as ws:
+        _turn(ws)
+    with client.websocket_connect("/ws") as ws:
+        deltas, done = _turn(ws)
+    assert len(stub_model) == 1
+    assert deltas == ["".join(REVIEW)]
+
+
+def test_bad_message_keeps_the_connection(stub_model):
+    with client.websocket_connect("/ws") as ws:
+        ws.send_text("not json")
+        assert ws.receive_json()["type"] == "error"
+        ws.send_json({"message": "x" * (app.MAX_MESSAGE_CHARS + 1)})
+        assert ws.receive_json()["type"] == "error"
+        _, done = _turn(ws)
+        assert done["type"] == "done"
+
+
+def test_rate_limited_turn_reports_retry_after(stub_model, monkeypatch):
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(rate_per_minute=1, burst=1))
+    with client.websocket_connect("/ws") as ws:
+        _turn(ws)
+        _, error = _turn(ws, "And (Lee and Park, 2021).")
+    assert error["type"] == "error"
+    assert error["retry_after"] >= 1
+
+
+def test_idle_connection_is_closed_and_freed(stub_model, monkeypatch):
+    monkeypatch.setattr(app, "WS_IDLE_TIMEOUT_S", 0.2)
+    with client.websocket_connect("/ws") as ws:
+        _turn(ws)
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == 1001
+    assert _socket_sessions() == set()
+
+
+def test_disconnect_stops_generation(stub_model, monkeypatch):
+    produced = []
+    finished = threading.Event()
+
+    def endless_completion(model, messages, stream=False, stream_options=None):
+        try:
+            for i in range(10_000):
+                produced.append(i)
+                time.sleep(0.001)
+                yield model_chunk(f"{i} ")
+        finally:
+            finished.set()
+
+    monkeypatch.setattr(app, "completion", endless_completion)
+    monkeypatch.setattr(app, "WS_SEND_BUFFER", 4)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"message": CITATION, "style": "apa"})
+        assert ws.receive_json()["type"] == "delta"
+    assert finished.wait(5)
+    assert len(produced) < 10_000
+    assert _socket_sessions() == set()
+
+
+def test_close_during_triage_frees_the_session(stub_model, monkeypatch):
+    triaging = threading.Event()
+    release = threading.Event()
+    finished = threading.Event()
+
+    def slow_classifier(message):
+        triaging.set()
+        release.wait(5)
+        return "CITATION"
+
+    monkeypatch.setattr(app, "classify_request", slow_classifier)
+    original_chat = app._chat
+
+    def tracked_chat(*args, **kwargs):
+        try:
+            return original_chat(*args, **kwargs)
+        finally:
+            finished.set()
+
+    monkeypatch.setattr(app, "_chat", tracked_chat)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"message": CITATION, "style": "apa"})
+        assert triaging.wait(5)
+    release.set()
+    assert finished.wait(5)
+    deadline = time.monotonic() + 5
+    while _socket_sessions():
+        assert time.monotonic() < deadline, "session outlived the connection"
+        time.sleep(0.01)
+
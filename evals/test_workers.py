@@ -0,0 +1,195 @@
+"""Multi-worker mode: shared cache tier, shared sessions, pre-fork state, throughput.
+
+The benchmark starts real servers in subprocesses. Triage and review results
+are pre-seeded in the shared cache, so requests do only local work (prompt
+building, parsing, link checks, attribution, JSON) and never reach a model.
+"""
+
+import gc
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from app import LRUCache, SharedCache
+
+ROOT = Path(__file__).resolve().parent.parent
+client = TestClient(app.app)
+
+LISTS = 24
+ENTRIES = 40
+REQUESTS = 96
+CONCURRENCY = 8
+
+
+@pytest.fixture
+def shared(monkeypatch, tmp_path):
+    cache = SharedCache(tmp_path / "shared.sqlite3")
+    monkeypatch.setattr(app, "shared_cache", cache)
+    return cache
+
+
+def test_shared_cache_round_trip_and_trim(tmp_path):
+    cache = SharedCache(tmp_path / "shared.sqlite3", max_entries=10)
+    cache.put("triage", "a", "CITATION")
+    assert cache.get("triage", "a") == "CITATION"
+    assert cache.get("response", "a") is None
+    cache.delete("triage", "a")
+    assert cache.get("triage", "a") is None
+    for i in range(SharedCache.TRIM_EVERY):
+        cache.put("triage", f"key{i}", i)
+    assert cache.get("triage", f"key{SharedCache.TRIM_EVERY - 1}") is not None
+    assert cache.get("triage", "key0") is None
+
+
+def test_workers_see_each_others_entries(shared):
+    worker_a = LRUCache("response", 10, shared=True)
+    worker_b = LRUCache("response", 10, shared=True)
+    worker_a.put("key", "- APA-7: use &.")
+    assert worker_b.get("key") == "- APA-7: use &."
+    assert worker_b.stats()["shared_hits"] == 1
+    local_only = LRUCache("parse", 10)
+    local_only.put("key", "value")
+    assert shared.get("parse", "key") is None
+
+
+def test_session_continues_on_another_worker(monkeypatch, shared):
+    monkeypatch.setattr(app, "classify_request", lambda message: "CITATION")
+    monkeypatch.setattr(app, "generate_response", lambda messages: f"turn {len(messages)}")
+    monkeypatch.setattr(app, "rate_limiter", app.RateLimiter(rate_per_minute=6000, burst=100))
+    payload = {"message": "(Smith and Jones, 2020)", "session_id": "shared-session", "style": "apa"}
+    client.post("/chat", json=payload)
+    history = app.sessions["shared-session"].messages()
+
+    # Another worker has never seen the session in memory
+    for store in (app.sessions, app.session_styles):
+        store.pop("shared-session")
+    client.post("/chat", json=payload)
+    messages = app.sessions["shared-session"].messages()
+    assert messages[: len(history)] == history
+    assert len(messages) == len(history) + 2
+
+    client.post("/clear", params={"session_id": "shared-session"})
+    assert shared.get("session", "shared-session") is None
+
+
+def test_prepare_shared_state_builds_every_prompt(monkeypatch):
+    monkeypatch.setattr(app, "WARM_UP", False)
+    prompts = app.load_prompt_config()
+    monkeypatch.setattr(app, "PROMPTS", prompts)
+    restored = []
+    monkeypatch.setattr(app, "restore_caches", lambda: restored.append(True))
+    monkeypatch.setattr(app, "_prepared_before_fork", False)
+    try:
+        app.prepare_shared_state()
+        assert len(prompts._system_prompts) == len(app.STYLES) * 2 ** len(app.RULE_CATEGORIES)
+        assert gc.get_freeze_count() > 0
+        assert restored and app._prepared_before_fork
+    finally:
+        gc.unfreeze()
+
+
+# --- Throughput benchmark ---
+
+
+def _reference_list(n: int) -> str:
+    return "\n".join(
+        f"Author{n:02d}{i:02d}, A. B., & Coauthor, C. ({1990 + i}). Effects Of Sleep {i} on memory. "
+        f"journal of sleep research, {i}(2), 3-4. doi:10.1111/jsr.{n}{i:03d}"
+        for i in range(ENTRIES)
+    )
+
+
+def _seed_shared_cache(path: Path, texts: list[str]) -> None:
+    """Store triage verdicts and chunk reviews for texts, keyed as the server looks them up."""
+    cache = SharedCache(path)
+    for text in texts:
+        cache.put("triage", app.cache_key(text[: app.TRIAGE_MAX_CHARS]), "CITATION")
+        for chunk in app.split_into_chunks(text):
+            entries = app.split_entries(chunk)
+            titles = [entry.split("). ")[1].split(". ")[0] for entry in entries]
+            violations = [f'- APA-R5: "{title}" should be sentence case.' for title in titles]
+            corrected = [entry.replace("Effects Of Sleep", "Effects of sleep") for entry in entries]
+            review = "\n".join(violations) + f"\n\n{app.CORRECTED_MARKER}\n" + "\n".join(corrected)
+            messages = app.build_review_messages(chunk, "apa")
+            cache.put("response", app.cache_key(app.MODEL, json.dumps(messages, ensure_ascii=False)), review)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _post(port: int, body: bytes) -> int:
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        connection.request("POST", "/chat", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def _throughput(workers: int, tmp_path: Path, texts: list[str]) -> float:
+    shared_path = tmp_path / f"shared-{workers}.sqlite3"
+    _seed_shared_cache(shared_path, texts)
+    port = _free_port()
+    env = {
+        **os.environ,
+        "WEB_CONCURRENCY": str(workers),
+        "PORT": str(port),
+        "SHARED_CACHE_PATH": str(shared_path),
+        "CACHE_SNAPSHOT_PATH": str(tmp_path / f"snapshot-{workers}.jsonl"),
+        "USAGE_LOG_PATH": str(tmp_path / "usage.jsonl"),
+        "JOB_DB_PATH": str(tmp_path / f"jobs-{workers}.sqlite3"),
+        "PROFILE_DIR": str(tmp_path / "profiles"),
+        "RATE_LIMIT_PER_MINUTE": "100000",
+        "RATE_LIMIT_BURST": "100000",
+        "WARM_UP": "",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "app.py"], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+                break
+            except OSError:
+                assert time.monotonic() < deadline, "server did not start"
+                time.sleep(0.1)
+        bodies = [json.dumps({"message": text, "style": "apa"}).encode() for text in texts]
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+            assert set(pool.map(lambda body: _post(port, body), bodies)) == {200}  # warm every worker
+            start = time.perf_counter()
+            statuses = list(pool.map(lambda i: _post(port, bodies[i % len(bodies)]), range(REQUESTS)))
+            elapsed = time.perf_counter() - start
+        assert set(statuses) == {200}
+        return REQUESTS / elapsed
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def test_throughput_scales_with_workers(tmp_path):
+    cores = os.cpu_count() or 1
+    workers = max(2, min(4, cores))
+    texts = [_reference_list(n) for n in range(LISTS)]
+    single = _throughput(1, tmp_path, texts)
+    multi = _throughput(workers, tmp_path, texts)
+    print(f"\n  {cores} cores: 1 worker {single:.1f} req/s, {workers} workers {multi:.1f} req/s")
+    if cores < 2:
+        pytest.skip("throughput scaling needs more than one core")
+    assert multi > single * 1.3